@@ -0,0 +1,26 @@
+"""GPU-free benchmarks for the weibo extraction pipeline.
+
+Modules:
+  synth_corpus  generate a crawler-format corpus (weibo JSON + img/ + video/)
+  fake_backend  ``LocalEngineBackend`` over ``switchable_persona.fake_vlm`` with tunable latencies
+  suite         the benchmarks: media lookup, preprocessing, batching, resume,
+                output writing and an end-to-end fake-backend run
+  __main__      runner; writes one JSON result file per invocation
+
+Usage:
+  python3 -m benchmarks --scale small --out bench_results/$(git rev-parse --short HEAD).json
+  python3 -m benchmarks --only output,resume --compare bench_results/<old>.json
+  python3 -m benchmarks.synth_corpus --root /tmp/weibo --users 20 --posts-per-user 500
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+
+# The pipeline driver is a flat script under scripts/; everything it drives is
+# the package under src/.
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for _path in (os.path.join(REPO_ROOT, "scripts"), os.path.join(REPO_ROOT, "src")):
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
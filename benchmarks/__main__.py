@@ -0,0 +1,152 @@
+"""Run the benchmark suite and store the results as JSON.
+
+The result file records the commit, whether the tree was dirty, the host and
+every parameter next to the metrics, so two files can be compared with
+``--compare`` (numeric metrics side by side with the new/old ratio).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+from datetime import datetime, timezone
+from typing import Optional
+
+from benchmarks.fake_backend import FakeLatency
+from benchmarks.suite import BENCHMARKS, BenchContext
+from benchmarks.synth_corpus import CorpusSpec, generate_corpus
+
+SCALES = {
+    "tiny": CorpusSpec(users=4, posts_per_user=50),
+    "small": CorpusSpec(users=10, posts_per_user=200),
+    "medium": CorpusSpec(users=40, posts_per_user=500),
+}
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _git(*args: str) -> Optional[str]:
+    try:
+        out = subprocess.run(["git", *args], cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def _compare(old_path: str, new: dict) -> None:
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    print(f"[compare] {old['meta'].get('commit')} -> {new['meta'].get('commit')}", file=sys.stderr)
+    for name, metrics in new["benchmarks"].items():
+        before = old.get("benchmarks", {}).get(name) or {}
+        for key, value in metrics.items():
+            prev = before.get(key)
+            if not isinstance(value, (int, float)) or not isinstance(prev, (int, float)):
+                continue
+            ratio = f"{value / prev:.2f}x" if prev else "n/a"
+            print(f"[compare] {name}.{key}: {prev:.6g} -> {value:.6g} ({ratio})", file=sys.stderr)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="GPU-free benchmarks for the extraction pipeline")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small", help="Size of the synthetic corpus")
+    parser.add_argument("--corpus", default="", help="Benchmark this crawl root instead of generating one")
+    parser.add_argument("--work-dir", default="", help="Scratch dir (default: a temp dir, removed afterwards)")
+    parser.add_argument("--only", default="", help=f"Comma-separated subset of: {','.join(BENCHMARKS)}")
+    parser.add_argument("--max-posts", type=int, default=2000, help="Posts taken from the corpus")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=4, help="Prepare pool size")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per timed section; the best is kept")
+    parser.add_argument("--step-latency", type=float, default=0.05, help="Fake engine seconds per wave")
+    parser.add_argument("--seq-latency", type=float, default=0.002, help="Fake engine seconds per sequence in a wave")
+    parser.add_argument("--image-decode", type=float, default=FakeLatency.image_decode_s, help="Seconds per image")
+    parser.add_argument("--video-decode", type=float, default=FakeLatency.video_decode_s, help="Seconds per video")
+    parser.add_argument("--out", default="", help="Result JSON (default: bench_results/<commit>-<utc time>.json)")
+    parser.add_argument("--compare", default="", help="Earlier result JSON to compare against")
+    args = parser.parse_args()
+
+    names = [n.strip() for n in args.only.split(",") if n.strip()] or list(BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="extract-bench-")
+    os.makedirs(work_dir, exist_ok=True)
+    spec = SCALES[args.scale]
+    try:
+        corpus_root = args.corpus
+        if not corpus_root:
+            corpus_root = os.path.join(work_dir, "weibo")
+            shutil.rmtree(corpus_root, ignore_errors=True)
+            stats = generate_corpus(corpus_root, spec)
+            print(f"[synth] {' '.join(f'{k}={v}' for k, v in stats.items())}", file=sys.stderr)
+        latency = FakeLatency(
+            step_latency_s=args.step_latency,
+            seq_latency_s=args.seq_latency,
+            image_decode_s=args.image_decode,
+            video_decode_s=args.video_decode,
+        )
+        ctx = BenchContext(
+            corpus_root=corpus_root,
+            work_dir=work_dir,
+            latency=latency,
+            max_posts=args.max_posts,
+            batch_size=args.batch_size,
+            workers=args.workers,
+            repeat=args.repeat,
+        )
+        results: dict[str, dict] = {}
+        for name in names:
+            started = time.perf_counter()
+            results[name] = BENCHMARKS[name](ctx)
+            summary = " ".join(
+                f"{k}={v:.4g}" if isinstance(v, float) else f"{k}={v}" for k, v in results[name].items()
+            )
+            print(f"[bench] {name} ({time.perf_counter() - started:.1f}s) {summary}", file=sys.stderr)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    commit = _git("rev-parse", "--short", "HEAD")
+    report = {
+        "meta": {
+            "commit": commit,
+            "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "params": {
+            "corpus": args.corpus or {"scale": args.scale, **asdict(spec)},
+            "max_posts": args.max_posts,
+            "batch_size": args.batch_size,
+            "workers": args.workers,
+            "repeat": args.repeat,
+            "latency": latency.as_dict(),
+        },
+        "benchmarks": results,
+    }
+    out = args.out or os.path.join(
+        REPO_ROOT, "bench_results", f"{commit or 'nogit'}-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.json"
+    )
+    out_dir = os.path.dirname(out)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[bench] results -> {out}", file=sys.stderr)
+    if args.compare:
+        _compare(args.compare, report)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
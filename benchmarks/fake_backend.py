@@ -0,0 +1,51 @@
+"""Deterministic fake inference backend with tunable latencies.
+
+Wraps ``switchable_persona.fake_vlm`` in the same ``LocalEngineBackend`` the
+extraction loop uses for ``--backend fake``. Outputs depend only on the
+prompt, so two runs over the same corpus produce identical records; only the
+simulated costs are tunable:
+
+  step_latency_s   fixed cost of each engine wave (prefill/decode step)
+  seq_latency_s    extra cost per sequence in a wave
+  max_num_seqs     sequences per wave
+  image_decode_s   CPU cost of decoding one image in ``process_vision_info``
+  video_decode_s   same for one video
+
+Set everything to 0 to measure the pipeline's own overhead.
+"""
+
+from __future__ import annotations
+
+from dataclasses import asdict, dataclass
+from typing import Any
+
+from switchable_persona import fake_vlm
+from switchable_persona.inference_backend import LocalEngineBackend
+from switchable_persona.extraction import SCHEMA_JSON
+
+
+@dataclass
+class FakeLatency:
+    step_latency_s: float = 0.05
+    seq_latency_s: float = 0.002
+    max_num_seqs: int = 256
+    image_decode_s: float = fake_vlm.IMAGE_DECODE_S
+    video_decode_s: float = fake_vlm.VIDEO_DECODE_S
+
+    def as_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+def make_backend(latency: FakeLatency, max_tokens: int = 2048) -> LocalEngineBackend:
+    # ``process_vision_info`` reads its decode costs from module globals.
+    fake_vlm.IMAGE_DECODE_S = latency.image_decode_s
+    fake_vlm.VIDEO_DECODE_S = latency.video_decode_s
+    llm = fake_vlm.FakeLLM(
+        model="fake",
+        max_num_seqs=latency.max_num_seqs,
+        step_latency_s=latency.step_latency_s,
+        seq_latency_s=latency.seq_latency_s,
+        enable_prefix_caching=True,
+    )
+    sampling_params = fake_vlm.SamplingParams(temperature=0.0, max_tokens=max_tokens, structured_outputs=SCHEMA_JSON)
+    return LocalEngineBackend(llm, fake_vlm.FakeProcessor(), sampling_params, fake_vlm.process_vision_info)
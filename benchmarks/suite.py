@@ -0,0 +1,304 @@
+"""The benchmarks. Each takes a ``BenchContext`` and returns a flat dict of metrics.
+
+Rates are per second, durations in seconds. Timed sections run ``repeat``
+times and report the best run, which is the least noisy estimate of what the
+code itself costs on a shared box.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from extract_all_weibo import _run_pipeline, _write_records
+from switchable_persona import media_index
+from switchable_persona.extraction import generate_batch, prepare_request, select_media_paths
+from switchable_persona.fake_vlm import fake_extraction
+from switchable_persona.inference_backend import prompt_token_count
+from switchable_persona.length_scheduler import LengthScheduler, TokenEstimator
+from switchable_persona.output_sink import completed_post_ids, open_sink
+from switchable_persona.resume_ledger import ledger_path
+from switchable_persona.weibo_stream import iter_posts, iter_weibo_jsons
+
+from benchmarks.fake_backend import FakeLatency, make_backend
+
+
+@dataclass
+class BenchContext:
+    corpus_root: str
+    work_dir: str
+    latency: FakeLatency
+    max_posts: int = 2000
+    batch_size: int = 8
+    workers: int = 4
+    repeat: int = 3
+    _posts: list = field(default_factory=list)
+
+    def posts(self) -> list[tuple[dict, str]]:
+        """``(post, weibo_json)`` for up to ``max_posts`` posts, in crawl order."""
+        if not self._posts:
+            for weibo_json in sorted(iter_weibo_jsons(self.corpus_root)):
+                for post in iter_posts(weibo_json):
+                    self._posts.append((post, weibo_json))
+                    if len(self._posts) >= self.max_posts:
+                        return self._posts
+        return self._posts
+
+    def scratch(self, name: str) -> str:
+        path = os.path.join(self.work_dir, name)
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        return path
+
+
+def _best(repeat: int, fn: Callable[[], Any]) -> float:
+    best = float("inf")
+    for _ in range(max(1, repeat)):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def _media_roots(ctx: BenchContext) -> list[str]:
+    return sorted({os.path.dirname(weibo_json) for _, weibo_json in ctx.posts()})
+
+
+def _record(post: dict) -> dict:
+    return {"post_id": post["id"], "extraction": fake_extraction(post["id"]), "media_used": {"images": [], "videos": []}}
+
+
+def bench_media_lookup(ctx: BenchContext) -> dict:
+    """Index build from scratch, index reload from disk, and per-post lookups against a warm index."""
+    roots = _media_roots(ctx)
+    posts = ctx.posts()
+
+    def cold() -> None:
+        media_index._indexes.clear()
+        for root in roots:
+            try:
+                os.remove(os.path.join(root, media_index.INDEX_NAME))
+            except FileNotFoundError:
+                pass
+            media_index.load_media_index(root)
+
+    def from_disk() -> None:
+        media_index._indexes.clear()
+        for root in roots:
+            media_index.load_media_index(root)
+
+    def lookups() -> None:
+        for post, weibo_json in posts:
+            select_media_paths(post, os.path.dirname(weibo_json), 3, None)
+
+    cold_s = _best(ctx.repeat, cold)
+    disk_s = _best(ctx.repeat, from_disk)
+    lookup_s = _best(ctx.repeat, lookups)
+    index_bytes = sum(os.path.getsize(os.path.join(root, media_index.INDEX_NAME)) for root in roots)
+    return {
+        "media_roots": len(roots),
+        "posts": len(posts),
+        "cold_index_s": cold_s,
+        "disk_index_s": disk_s,
+        "index_bytes": index_bytes,
+        "lookups_per_s": len(posts) / lookup_s if lookup_s else 0.0,
+    }
+
+
+def bench_preprocessing(ctx: BenchContext) -> dict:
+    """``prepare_request`` (media, template, vision) sequentially and on the prepare pool."""
+    backend = make_backend(ctx.latency)
+    posts = ctx.posts()
+
+    def prepare(item: tuple[dict, str]) -> dict:
+        post, weibo_json = item
+        return prepare_request(backend, post, os.path.dirname(weibo_json), 3, None, False, [])
+
+    started = time.perf_counter()
+    requests = [prepare(item) for item in posts]
+    sequential_s = time.perf_counter() - started
+    with ThreadPoolExecutor(max_workers=ctx.workers) as pool:
+        started = time.perf_counter()
+        list(pool.map(prepare, posts))
+        pooled_s = time.perf_counter() - started
+
+    metrics: dict[str, Any] = {
+        "posts": len(posts),
+        "workers": ctx.workers,
+        "sequential_posts_per_s": len(posts) / sequential_s if sequential_s else 0.0,
+        "pooled_posts_per_s": len(posts) / pooled_s if pooled_s else 0.0,
+    }
+    for stage in ("media", "template", "vision"):
+        values = [req["timings"].get(stage, 0.0) for req in requests]
+        metrics[f"{stage}_mean_ms"] = 1000 * sum(values) / len(values) if values else 0.0
+    return metrics
+
+
+def _padding_ratio(batches: list[list[int]]) -> float:
+    """Share of slots lost to padding each batch to its longest prompt (a KV-cache waste proxy)."""
+    used = sum(sum(b) for b in batches)
+    padded = sum(max(b) * len(b) for b in batches if b)
+    return (padded - used) / used if used else 0.0
+
+
+def bench_batching(ctx: BenchContext) -> dict:
+    """Token-estimate accuracy and batch shape per scheduler setting."""
+    backend = make_backend(FakeLatency(step_latency_s=0, seq_latency_s=0, image_decode_s=0, video_decode_s=0))
+    estimator = TokenEstimator(backend.processor)
+    requests = [
+        prepare_request(backend, post, os.path.dirname(weibo_json), 3, None, False, [])
+        for post, weibo_json in ctx.posts()
+    ]
+    estimates = [estimator.estimate(req["input"]) for req in requests]
+    actual = [prompt_token_count(out) for out in backend.generate([req["input"] for req in requests])]
+    metrics: dict[str, Any] = {
+        "posts": len(requests),
+        "estimated_tokens": sum(estimates),
+        "actual_tokens": sum(actual),
+        "estimate_error": (sum(estimates) - sum(actual)) / sum(actual) if sum(actual) else 0.0,
+    }
+    budget = ctx.batch_size * (sum(estimates) // max(1, len(estimates)))
+    for window, max_tokens in ((1, 0), (1, budget), (64, 0), (64, budget), (512, budget)):
+        scheduler = LengthScheduler(ctx.batch_size, max_tokens, window)
+        batches: list[list[int]] = []
+        started = time.perf_counter()
+        for tokens in estimates:
+            batches += scheduler.add(tokens, tokens)
+        batches += scheduler.flush()
+        elapsed = time.perf_counter() - started
+        tag = f"w{window}_{'budget' if max_tokens else 'nobudget'}"
+        metrics[f"{tag}_batches"] = len(batches)
+        metrics[f"{tag}_padding_ratio"] = _padding_ratio(batches)
+        metrics[f"{tag}_us_per_post"] = 1e6 * elapsed / len(estimates) if estimates else 0.0
+    return metrics
+
+
+def _write_output(ctx: BenchContext, output: str, posts: list[tuple[dict, str]], **sink_kwargs: Any) -> Any:
+    sink = open_sink(output=output, output_dir=os.path.join(os.path.dirname(output), "per_post"), **sink_kwargs)
+    try:
+        for start in range(0, len(posts), ctx.batch_size):
+            batch = posts[start : start + ctx.batch_size]
+            _write_records(sink, "fake", batch, [_record(post) for post, _ in batch])
+    finally:
+        sink.close()
+    return sink
+
+
+def bench_resume(ctx: BenchContext) -> dict:
+    """Finding completed posts: ledger load, ledger rebuild, catch-up of an unledgered tail, full JSON decode."""
+    posts = ctx.posts()
+    output = os.path.join(ctx.scratch("resume"), "extractions.jsonl")
+    _write_output(ctx, output, posts, output_format="jsonl")
+
+    ledger_s = _best(ctx.repeat, lambda: completed_post_ids(output))
+
+    def rebuild() -> None:
+        os.remove(ledger_path(output))
+        completed_post_ids(output)
+
+    rebuild_s = _best(ctx.repeat, rebuild)
+
+    def decode_all() -> set:
+        done = set()
+        with open(output, "r", encoding="utf-8") as f:
+            for line in f:
+                done.add(json.loads(line)["meta"]["post_id"])
+        return done
+
+    decode_s = _best(ctx.repeat, decode_all)
+
+    # An interrupted run: the last tenth of the records never reached the ledger.
+    keep = len(posts) - len(posts) // 10
+    with open(ledger_path(output), "r", encoding="utf-8") as f:
+        head = f.readlines()[:keep]
+
+    def tail() -> None:
+        with open(ledger_path(output), "w", encoding="utf-8") as f:
+            f.writelines(head)
+        completed_post_ids(output)
+
+    tail_s = _best(ctx.repeat, tail)
+    return {
+        "records": len(posts),
+        "output_bytes": os.path.getsize(output),
+        "ledger_load_s": ledger_s,
+        "ledger_rebuild_s": rebuild_s,
+        "tail_catchup_s": tail_s,
+        "full_decode_s": decode_s,
+    }
+
+
+def bench_output(ctx: BenchContext) -> dict:
+    """Sink throughput per output format and flush policy."""
+    posts = ctx.posts()
+    metrics: dict[str, Any] = {"records": len(posts), "batch_size": ctx.batch_size}
+    for output_format, flush_policy in (("jsonl", "batch"), ("jsonl", "close"), ("shards", "batch"), ("files", "batch")):
+        tag = f"{output_format}_{flush_policy}"
+        best = float("inf")
+        written = 0
+        for _ in range(max(1, ctx.repeat)):
+            output = os.path.join(ctx.scratch(f"output_{tag}"), "extractions.jsonl")
+            started = time.perf_counter()
+            sink = _write_output(
+                ctx, output, posts, output_format=output_format, flush_policy=flush_policy, shard_max_bytes=4 << 20
+            )
+            best = min(best, time.perf_counter() - started)
+            written = getattr(sink, "bytes_written", 0)
+        metrics[f"{tag}_records_per_s"] = len(posts) / best if best else 0.0
+        if written:
+            metrics[f"{tag}_mb_per_s"] = written / (1 << 20) / best if best else 0.0
+    return metrics
+
+
+def bench_end_to_end(ctx: BenchContext) -> dict:
+    """The threaded prepare -> generate -> write pipeline over the fake backend."""
+    backend = make_backend(ctx.latency)
+    estimator = TokenEstimator(backend.processor)
+    posts = ctx.posts()
+    output = os.path.join(ctx.scratch("end_to_end"), "extractions.jsonl")
+    sink = open_sink("jsonl", output, "")
+
+    def prepare(post: dict, media_root: str) -> dict:
+        req = prepare_request(backend, post, media_root, 3, None, False, [])
+        req["est_tokens"] = estimator.estimate(req["input"])
+        return req
+
+    started = time.perf_counter()
+    try:
+        total, stage_stats = _run_pipeline(
+            iter(posts),
+            prepare,
+            lambda prepared: generate_batch(backend, prepared),
+            lambda batch, records, prepared: _write_records(sink, "fake", batch, records),
+            scheduler=LengthScheduler(ctx.batch_size),
+            prefetch_depth=2 * ctx.batch_size,
+            workers=ctx.workers,
+        )
+    finally:
+        sink.close()
+    elapsed = time.perf_counter() - started
+    produce_stats, generate_stats, write_stats = stage_stats
+    return {
+        "posts": total,
+        "elapsed_s": elapsed,
+        "posts_per_s": total / elapsed if elapsed else 0.0,
+        "generate_calls": backend.llm.num_generate_calls,
+        "producer_blocked_s": produce_stats.wait_s,
+        "generator_starved_s": generate_stats.wait_s,
+        "generator_blocked_s": write_stats.wait_s,
+    }
+
+
+BENCHMARKS: dict[str, Callable[[BenchContext], dict]] = {
+    "media_lookup": bench_media_lookup,
+    "preprocessing": bench_preprocessing,
+    "batching": bench_batching,
+    "resume": bench_resume,
+    "output": bench_output,
+    "end_to_end": bench_end_to_end,
+}
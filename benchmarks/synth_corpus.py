@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""Synthetic crawler-format weibo corpus for benchmarks.
+
+Lays out the same tree the crawler produces:
+
+  <root>/<user>/<uid>.json             {"user": {...}, "weibo": [post, ...]}
+  <root>/<user>/img/原创微博图片/<name>.jpg
+  <root>/<user>/video/<name>.mp4
+
+Post text lengths are drawn from a skewed distribution (mostly short, a tail
+of long posts) so length-aware batching has something to sort. A fraction of
+posts carry images and/or a video; some videos are written empty, which the
+fake backend (like a real decoder) rejects. ``duplicate_ratio`` re-posts
+earlier content under new ids in other users' files, like overlapping
+re-crawls. Everything is drawn from a seeded RNG, so a given set of
+parameters always yields the same corpus.
+
+Images are real JPEGs of varying size when Pillow is installed and JPEG-magic
+stubs otherwise; the fake backend only reads their first bytes.
+
+Usage:
+  python3 -m benchmarks.synth_corpus --root /tmp/weibo --users 20 --posts-per-user 500
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import os
+import random
+import sys
+from dataclasses import dataclass
+
+_PHRASES = (
+    "今天天气不错",
+    "分享一下我的日常",
+    "大家怎么看",
+    "真的太好笑了哈哈哈",
+    "转发这条微博",
+    "打卡",
+    "有点累但是很开心",
+    "新的一周加油",
+    "这个观点我不太同意",
+    "推荐给大家",
+)
+_IMG_DIR = os.path.join("img", "原创微博图片")
+
+
+@dataclass
+class CorpusSpec:
+    users: int = 10
+    posts_per_user: int = 100
+    image_ratio: float = 0.35
+    max_images: int = 3
+    video_ratio: float = 0.15
+    bad_video_ratio: float = 0.2
+    duplicate_ratio: float = 0.05
+    long_text_ratio: float = 0.1
+    seed: int = 0
+
+
+def _text(rng: random.Random, long: bool) -> str:
+    count = rng.randint(40, 200) if long else rng.randint(1, 8)
+    return "，".join(rng.choice(_PHRASES) for _ in range(count))
+
+
+def _image_bytes(rng: random.Random) -> bytes:
+    try:
+        from PIL import Image
+    except ImportError:
+        return b"\xff\xd8\xff\xe0" + rng.randbytes(256) + b"\xff\xd9"
+    size = (rng.choice((320, 640, 1080)), rng.choice((320, 480, 1440)))
+    buf = io.BytesIO()
+    Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3))).save(buf, "JPEG", quality=60)
+    return buf.getvalue()
+
+
+def generate_corpus(root: str, spec: CorpusSpec) -> dict[str, int]:
+    """Write the corpus under ``root``; return counts of what was written."""
+    rng = random.Random(spec.seed)
+    stats = {"files": 0, "posts": 0, "images": 0, "videos": 0, "bad_videos": 0, "duplicates": 0}
+    seen: list[dict] = []
+    for u in range(spec.users):
+        uid = str(1000000 + u)
+        user_dir = os.path.join(root, f"user{u:04d}")
+        os.makedirs(os.path.join(user_dir, _IMG_DIR), exist_ok=True)
+        os.makedirs(os.path.join(user_dir, "video"), exist_ok=True)
+        posts: list[dict] = []
+        for i in range(spec.posts_per_user):
+            post_id = f"{uid}{i:06d}"
+            if seen and rng.random() < spec.duplicate_ratio:
+                # Same content and media under another id, as in overlapping crawls.
+                post = dict(rng.choice(seen), id=post_id)
+                stats["duplicates"] += 1
+            else:
+                post = {
+                    "id": post_id,
+                    "content": _text(rng, rng.random() < spec.long_text_ratio),
+                    "publish_time": f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d} {i % 24:02d}:00",
+                    "original_pictures": "无",
+                    "retweet_pictures": "无",
+                    "video_url": "无",
+                    "up_num": rng.randrange(1000),
+                    "retweet_num": rng.randrange(100),
+                    "comment_num": rng.randrange(100),
+                }
+                if rng.random() < spec.image_ratio:
+                    names = [f"{post_id}_{k}.jpg" for k in range(rng.randint(1, spec.max_images))]
+                    for name in names:
+                        with open(os.path.join(user_dir, _IMG_DIR, name), "wb") as f:
+                            f.write(_image_bytes(rng))
+                    post["original_pictures"] = ",".join(f"https://wx1.sinaimg.cn/large/{n}" for n in names)
+                    stats["images"] += len(names)
+                if rng.random() < spec.video_ratio:
+                    name = f"{post_id}.mp4"
+                    bad = rng.random() < spec.bad_video_ratio
+                    with open(os.path.join(user_dir, "video", name), "wb") as f:
+                        f.write(b"" if bad else rng.randbytes(4096))
+                    post["video_url"] = f"https://f.video.weibocdn.com/{name}"
+                    stats["videos"] += 1
+                    stats["bad_videos"] += bad
+                seen.append(post)
+            posts.append(post)
+        with open(os.path.join(user_dir, f"{uid}.json"), "w", encoding="utf-8") as f:
+            json.dump({"user": {"id": uid, "nickname": f"user{u}"}, "weibo": posts}, f, ensure_ascii=False)
+        stats["files"] += 1
+        stats["posts"] += len(posts)
+    return stats
+
+
+def main() -> int:
+    defaults = CorpusSpec()
+    parser = argparse.ArgumentParser(description="Generate a synthetic crawler-format weibo corpus")
+    parser.add_argument("--root", required=True, help="Output root (one folder per user)")
+    parser.add_argument("--users", type=int, default=defaults.users)
+    parser.add_argument("--posts-per-user", type=int, default=defaults.posts_per_user)
+    parser.add_argument("--image-ratio", type=float, default=defaults.image_ratio)
+    parser.add_argument("--max-images", type=int, default=defaults.max_images)
+    parser.add_argument("--video-ratio", type=float, default=defaults.video_ratio)
+    parser.add_argument("--bad-video-ratio", type=float, default=defaults.bad_video_ratio)
+    parser.add_argument("--duplicate-ratio", type=float, default=defaults.duplicate_ratio)
+    parser.add_argument("--long-text-ratio", type=float, default=defaults.long_text_ratio)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    args = parser.parse_args()
+
+    spec = CorpusSpec(
+        users=args.users,
+        posts_per_user=args.posts_per_user,
+        image_ratio=args.image_ratio,
+        max_images=args.max_images,
+        video_ratio=args.video_ratio,
+        bad_video_ratio=args.bad_video_ratio,
+        duplicate_ratio=args.duplicate_ratio,
+        long_text_ratio=args.long_text_ratio,
+        seed=args.seed,
+    )
+    stats = generate_corpus(args.root, spec)
+    print(f"[synth] {' '.join(f'{k}={v}' for k, v in stats.items())} -> {args.root}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,22 @@
+"""Makes the ``switchable_persona`` package under ``src/`` importable from scripts/.
+
+Every script in this directory imports this module before the package, so
+they run from a plain checkout without installing it. The scripts named after
+a package module (``video_probe.py``, ``sharding.py``, ...) are nothing but
+``run`` of that module's ``main``; their usage is in the module docstring.
+"""
+
+from __future__ import annotations
+
+import importlib
+import os
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+
+def run(module: str) -> int:
+    """Run ``switchable_persona.<module>.main()`` and return its exit status."""
+    return importlib.import_module(f"switchable_persona.{module}").main()
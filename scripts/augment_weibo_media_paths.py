@@ -5,7 +5,9 @@ from __future__ import annotations
 import argparse
 import json
 import os
-from pathlib import Path
+
+import _package  # noqa: F401  (puts src/ on sys.path)
+from switchable_persona.weibo_stream import iter_events
 
 
 def _infer_image_paths(media_root: str, publish_time: str, post_id: str, urls: list[str]) -> list[dict]:
@@ -42,6 +44,38 @@ def _infer_video_paths(media_root: str, publish_time: str, post_id: str, url: st
     return []
 
 
+def _augment_post(item: dict, media_root: str) -> dict:
+    item.setdefault("media", {"original_pictures": [], "retweet_pictures": [], "video": []})
+    publish_time = item.get("publish_time", "")
+    post_id = item.get("id", "")
+
+    pics = item.get("original_pictures")
+    if pics and pics != "无":
+        urls = [u.strip() for u in pics.split(",") if u.strip()]
+        mapped = _infer_image_paths(media_root, publish_time, post_id, urls)
+        if mapped:
+            item["media"]["original_pictures"] = mapped
+
+    rpics = item.get("retweet_pictures")
+    if rpics and rpics != "无":
+        urls = [u.strip() for u in rpics.split(",") if u.strip()]
+        mapped = _infer_image_paths(media_root, publish_time, post_id, urls)
+        if mapped:
+            item["media"]["retweet_pictures"] = mapped
+
+    vurl = item.get("video_url")
+    if vurl and vurl != "无":
+        mapped = _infer_video_paths(media_root, publish_time, post_id, vurl)
+        if mapped:
+            item["media"]["video"] = mapped
+    return item
+
+
+def _dump(value, depth: int) -> str:
+    # Same layout as json.dumps(..., indent=2) on the whole document.
+    return json.dumps(value, ensure_ascii=False, indent=2).replace("\n", "\n" + "  " * depth)
+
+
 def main() -> int:
     parser = argparse.ArgumentParser(description="Augment weibo JSON with local media paths")
     parser.add_argument("--weibo-json", required=True, help="Weibo JSON path")
@@ -49,35 +83,31 @@ def main() -> int:
     parser.add_argument("--output", help="Output JSON path (defaults to in-place)")
     args = parser.parse_args()
 
-    data = json.loads(Path(args.weibo_json).read_text(encoding="utf-8"))
-    posts = data.get("weibo", [])
-    for item in posts:
-        item.setdefault("media", {"original_pictures": [], "retweet_pictures": [], "video": []})
-        publish_time = item.get("publish_time", "")
-        post_id = item.get("id", "")
-
-        pics = item.get("original_pictures")
-        if pics and pics != "无":
-            urls = [u.strip() for u in pics.split(",") if u.strip()]
-            mapped = _infer_image_paths(args.media_root, publish_time, post_id, urls)
-            if mapped:
-                item["media"]["original_pictures"] = mapped
-
-        rpics = item.get("retweet_pictures")
-        if rpics and rpics != "无":
-            urls = [u.strip() for u in rpics.split(",") if u.strip()]
-            mapped = _infer_image_paths(args.media_root, publish_time, post_id, urls)
-            if mapped:
-                item["media"]["retweet_pictures"] = mapped
-
-        vurl = item.get("video_url")
-        if vurl and vurl != "无":
-            mapped = _infer_video_paths(args.media_root, publish_time, post_id, vurl)
-            if mapped:
-                item["media"]["video"] = mapped
-
     out_path = args.output or args.weibo_json
-    Path(out_path).write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp_path = f"{out_path}.tmp"
+    # Stream posts through one at a time; the rewritten file is moved into
+    # place only once complete, so in-place runs never read a half-written file.
+    with open(tmp_path, "w", encoding="utf-8") as fo:
+        fo.write("{")
+        members = 0
+        items = 0
+        for event in iter_events(args.weibo_json):
+            kind = event[0]
+            if kind == "field":
+                fo.write(("," if members else "") + f"\n  {json.dumps(event[1], ensure_ascii=False)}: {_dump(event[2], 1)}")
+                members += 1
+            elif kind == "begin":
+                fo.write(("," if members else "") + f"\n  {json.dumps(event[1], ensure_ascii=False)}: [")
+                members += 1
+                items = 0
+            elif kind == "item":
+                item = _augment_post(event[1], args.media_root)
+                fo.write(("," if items else "") + f"\n    {_dump(item, 2)}")
+                items += 1
+            elif kind == "end":
+                fo.write("\n  ]" if items else "]")
+        fo.write("\n}" if members else "}")
+    os.replace(tmp_path, out_path)
     return 0
 
 
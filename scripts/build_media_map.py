@@ -13,6 +13,9 @@ from typing import Dict, Iterable, List, Tuple
 
 import requests
 
+import _package  # noqa: F401  (puts src/ on sys.path)
+from switchable_persona.weibo_stream import iter_posts
+
 
 def sha256_file(path: str, chunk_size: int = 1024 * 1024) -> str:
     h = hashlib.sha256()
@@ -57,11 +60,9 @@ def download_to_tmp(url: str) -> str:
 
 
 def extract_urls(weibo_json: str) -> Tuple[List[str], List[str]]:
-    data = json.loads(Path(weibo_json).read_text(encoding="utf-8"))
-    posts = data.get("weibo", [])
     img_urls: List[str] = []
     vid_urls: List[str] = []
-    for item in posts:
+    for item in iter_posts(weibo_json):
         pics = item.get("original_pictures")
         if pics and pics != "无":
             for u in pics.split(","):
@@ -1,428 +1,572 @@
 #!/usr/bin/env python3
-"""Batch extraction for all weibo JSON files under a root directory."""
+"""Batch extraction for all weibo JSON files under a root directory.
+
+Per-post work (media, prompt, generation, parsing) is done by
+``switchable_persona.extraction.ExtractionEngine``; this script adds the
+corpus walk, the threaded pipeline, resume, output sinks, the cascade and
+the repair queue around it.
+"""
 
 from __future__ import annotations
 
 import argparse
 import json
 import os
-import site
 import sys
-import tempfile
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import Iterable, Optional
-from urllib.request import urlretrieve
-
-import ctypes
-from transformers import AutoProcessor
-from qwen_vl_utils import process_vision_info
-
-from vllm import LLM, SamplingParams
-from vllm.sampling_params import StructuredOutputsParams
-
-DEFAULT_MODEL = "~/models/Qwen/Qwen3-VL-8B-Thinking"
-
-SCHEMA_JSON = {
-    "type": "object",
-    "additionalProperties": False,
-    "required": ["post_id", "style", "safety_rewrite", "stance", "topic", "knowledge_facts"],
-    "properties": {
-        "post_id": {"type": "string"},
-        "style": {
-            "type": "object",
-            "additionalProperties": False,
-            "required": [
-                "catchphrases",
-                "signature_patterns",
-                "tone",
-                "emotion",
-                "evidence",
-                "confidence",
-            ],
-            "properties": {
-                "catchphrases": {"type": "array", "items": {"type": "string"}},
-                "signature_patterns": {"type": "array", "items": {"type": "string"}},
-                "tone": {
-                    "type": "array",
-                    "items": {
-                        "type": "string",
-                        "enum": [
-                            "formal",
-                            "casual",
-                            "celebratory",
-                            "persuasive",
-                            "objective",
-                            "humorous",
-                            "sarcastic",
-                            "empathetic",
-                            "authoritative",
-                            "promotional",
-                            "instructional",
-                            "narrative",
-                            "urgent",
-                            "reflective",
-                        ],
-                    },
-                },
-                "emotion": {
-                    "type": "string",
-                    "enum": [
-                        "joy",
-                        "trust",
-                        "fear",
-                        "surprise",
-                        "sadness",
-                        "disgust",
-                        "anger",
-                        "anticipation",
-                        "none",
-                    ],
-                },
-                "evidence": {"type": "array", "items": {"type": "string"}},
-                "confidence": {"type": "number"},
-            },
-        },
-        "safety_rewrite": {
-            "type": "object",
-            "additionalProperties": False,
-            "required": ["terms", "evidence", "confidence"],
-            "properties": {
-                "terms": {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "additionalProperties": False,
-                        "required": ["term", "replacement"],
-                        "properties": {
-                            "term": {"type": "string"},
-                            "replacement": {"type": "string"},
-                        },
-                    },
-                },
-                "evidence": {"type": "array", "items": {"type": "string"}},
-                "confidence": {"type": "number"},
-            },
-        },
-        "stance": {
-            "type": "object",
-            "additionalProperties": False,
-            "required": ["targets", "reasoning"],
-            "properties": {
-                "targets": {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "additionalProperties": False,
-                        "required": ["target", "position", "evidence", "confidence"],
-                        "properties": {
-                            "target": {"type": "string"},
-                            "position": {"type": "string"},
-                            "evidence": {"type": "array", "items": {"type": "string"}},
-                            "confidence": {"type": "number"},
-                        },
-                    },
-                },
-                "reasoning": {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "additionalProperties": False,
-                        "required": [
-                            "target",
-                            "opinion",
-                            "intent",
-                            "evidence",
-                            "confidence",
-                        ],
-                        "properties": {
-                            "target": {"type": "string"},
-                            "opinion": {"type": "string"},
-                            "intent": {"type": "string"},
-                            "evidence": {"type": "array", "items": {"type": "string"}},
-                            "confidence": {"type": "number"},
-                        },
-                    },
-                },
-            },
-        },
-        "topic": {
-            "type": "object",
-            "additionalProperties": False,
-            "required": ["trigger", "one_sentence_summary", "evidence", "confidence"],
-            "properties": {
-                "trigger": {"type": "string"},
-                "one_sentence_summary": {"type": "string"},
-                "evidence": {"type": "array", "items": {"type": "string"}},
-                "confidence": {"type": "number"},
-            },
-        },
-        "knowledge_facts": {
-            "type": "array",
-            "items": {
-                "type": "object",
-                "additionalProperties": False,
-                "required": ["fact", "evidence", "confidence"],
-                "properties": {
-                    "fact": {"type": "string"},
-                    "evidence": {"type": "array", "items": {"type": "string"}},
-                    "confidence": {"type": "number"},
-                },
-            },
-        },
-    },
-}
-
-
-def build_user_text(text: str, post_id: str) -> str:
-    return (
-        "你是信息抽取器，服务于“基于三层人格架构构建虚拟角色”的长期任务。"
-        "你的输出将直接用于驱动虚拟角色的行为、写作风格与记忆库。"
-        "请基于单条微博（文字+图像/视频）做精确抽取，输出必须为严格 JSON。"
-        "不得输出分析过程或多余文本。\n\n"
-        "核心目标（与你的字段定义直接对应）：\n"
-        "A) style：提取“发帖风格线索”。tone 不是情感极性，必须描述说话语气与风格"
-        "（如 formal/casual/celebratory/persuasive/objective 等），可多选 1-3 个。"
-        "emotion 使用 8 大情绪（joy/trust/fear/surprise/sadness/disgust/anger/anticipation），"
-        "若无明显情绪则为 none。\n"
-        "B) stance：抽取作者对“具体目标对象”的立场与观点，并说明其背后意图。"
-        "必须拆成两层：targets（目标+立场+证据）与 reasoning（观点+意图+证据）。\n"
-        "C) topic：等价于“发帖原因/触发事件/主题”，用于驱动虚拟角色发帖的动机描述，"
-        "要求一句话概括，直接描述“因为什么而发帖”。\n"
-        "D) knowledge_facts：用于构建虚拟角色的“经历/认知/记忆库”。只记录稳定的实体或长期事实"
-        "（人/组织/品牌/物品/长期偏好/价值取向）。不要写一次性事件、短期里程碑或时间点。\n"
-        "E) safety_rewrite：不是审查，而是“表达时可替换的敏感词/表述”（若无则空）。\n\n"
-        "通用抽取原则：\n"
-        "1) 只抽取文本或图像/视频中可直接支持的内容；不要主观脑补。\n"
-        "2) 若某项不存在或不明显，保持为空列表/空字符串，confidence=0。\n"
-        "3) 证据字段必须为原文或视觉线索的最小片段。\n"
-        "4) 不要把“发帖原因”误放入 knowledge_facts；它应归入 topic。\n"
-        "5) knowledge_facts 里只保留“长期可复用的事实/实体”。\n\n"
-        f"POST_ID: {post_id}\n"
-        f"TEXT: {text}\n\n"
-        "输出 JSON schema（仅供参考，不要复述）：\n"
-        f"{json.dumps(SCHEMA_JSON, ensure_ascii=False)}\n"
-    )
-
-
-def _download_media(urls: list[str], suffix: str) -> list[str]:
-    tmp_dir = tempfile.mkdtemp(prefix="vlm_media_")
-    local_paths: list[str] = []
-    for idx, url in enumerate(urls, start=1):
-        try:
-            out_path = os.path.join(tmp_dir, f"media_{idx:02d}{suffix}")
-            urlretrieve(url, out_path)
-            local_paths.append(out_path)
-        except Exception:
-            continue
-    return local_paths
+from typing import Any, Callable, Iterable, Optional
 
+import _package  # noqa: F401  (puts src/ on sys.path)
+from switchable_persona.extraction import (
+    DEFAULT_MODEL,
+    PACK_TOKENS_PER_POST,
+    PROMPT_LAYOUTS,
+    SCHEMA_JSON,
+    EngineConfig,
+    ExtractionEngine,
+    build_messages,
+    ensure_cuda_runtime,
+    load_backend,
+    prompt_texts,
+    resolve_media,
+)
+from switchable_persona.image_cache import ImageCache
+from switchable_persona.inference_backend import MEDIA_MODES, LocalEngineBackend, OpenAIChatBackend
+from switchable_persona.length_scheduler import LengthScheduler, TokenEstimator
+from switchable_persona.media_downloader import DEFAULT_CACHE_DIR, MediaDownloader
+from switchable_persona.repair_queue import DEFAULT_QUEUE as DEFAULT_REPAIR_QUEUE
+from switchable_persona.repair_queue import RepairQueue, load_queue, write_queue
+from switchable_persona.result_cache import DEFAULT_CACHE_DIR as DEFAULT_RESULT_CACHE_DIR
+from switchable_persona.result_cache import ResultCache
+from switchable_persona.stage_metrics import StageMetrics, timed
+from switchable_persona.video_probe import DEFAULT_TABLE as DEFAULT_VIDEO_PROBE_TABLE
+from switchable_persona.video_probe import VideoProbeTable
+from switchable_persona.extraction_store import ExtractionStore, StoreSink
+from switchable_persona.output_sink import (
+    FLUSH_POLICIES,
+    OUTPUT_FORMATS,
+    BadVideoLog,
+    TeeSink,
+    completed_post_ids,
+    open_sink,
+    patch_records,
+)
+from switchable_persona.post_registry import PostRegistry
+from switchable_persona.sharding import shard_of, shard_output
+from switchable_persona.visual_relevance import DEFAULT_THRESHOLD as DEFAULT_CASCADE_THRESHOLD
+from switchable_persona.visual_relevance import image_size, visual_relevance
+from switchable_persona.weibo_stream import iter_posts, iter_weibo_jsons
 
-def _find_by_basename(root: str, basenames: list[str]) -> list[str]:
-    if not root or not os.path.isdir(root):
-        return []
-    found: list[str] = []
-    for base in basenames:
-        for dirpath, _, filenames in os.walk(root):
-            if base in filenames:
-                found.append(os.path.join(dirpath, base))
+
+def _iter_pending_posts(
+    root: str,
+    processed: set,
+    limit: int,
+    num_shards: int = 1,
+    shard_index: int = 0,
+    registry: Optional[PostRegistry] = None,
+    bad_files: Optional[list[tuple[str, str]]] = None,
+) -> Iterable[tuple[dict, str]]:
+    """Yield ``(post, weibo_json)`` for every post of this shard that still needs extraction.
+
+    With a ``registry`` only the canonical occurrence of each distinct post is yielded.
+    If ``bad_files`` is given, files that cannot be read or parsed are recorded
+    there as ``(weibo_json, error)`` and skipped instead of aborting the walk.
+    """
+    total = 0
+    for weibo_json in iter_weibo_jsons(root):
+        posts = iter_posts(weibo_json)
+        while True:
+            try:
+                post = next(posts)
+            except StopIteration:
                 break
-    return found
-
-
-def _as_file_uri(path: str) -> str:
-    if path.startswith(("file://", "http://", "https://", "data:")):
-        return path
-    return f"file://{path}"
-
-
-def _ensure_cuda_runtime() -> None:
-    cuda_lib_dirs = []
-    cuda_runtime_lib = None
-    for sp in site.getsitepackages():
-        candidate = os.path.join(sp, "nvidia", "cuda_runtime", "lib")
-        if os.path.isdir(candidate):
-            cuda_lib_dirs.append(candidate)
-            cand_lib = os.path.join(candidate, "libcudart.so.12")
-            if os.path.isfile(cand_lib) and cuda_runtime_lib is None:
-                cuda_runtime_lib = cand_lib
-    if cuda_lib_dirs:
-        existing = os.environ.get("LD_LIBRARY_PATH", "")
-        os.environ["LD_LIBRARY_PATH"] = ":".join(cuda_lib_dirs + ([existing] if existing else []))
-    if cuda_runtime_lib and os.environ.get("CUDA_PRELOAD_DONE") != "1":
-        env = dict(os.environ)
-        env["CUDA_PRELOAD_DONE"] = "1"
-        env["LD_PRELOAD"] = f"{cuda_runtime_lib}:{env.get('LD_PRELOAD', '')}".rstrip(":")
-        os.execve(sys.executable, [sys.executable] + sys.argv, env)
-    if cuda_runtime_lib:
+            except (OSError, ValueError) as exc:
+                if bad_files is None:
+                    raise
+                bad_files.append((weibo_json, str(exc)))
+                break
+            post_id = post.get("id", "")
+            if not post_id or post_id in processed:
+                continue
+            if num_shards > 1 and shard_of(post_id, num_shards) != shard_index:
+                continue
+            if registry is not None and registry.is_duplicate(post, weibo_json):
+                continue
+            yield post, weibo_json
+            total += 1
+            if limit and total >= limit:
+                return
+
+
+def _iter_queued_posts(entries: dict[str, dict]) -> Iterable[tuple[dict, str]]:
+    """Yield ``(post, weibo_json)`` for repair-queue entries, reading each weibo JSON once."""
+    by_file: dict[str, set[str]] = {}
+    for post_id, entry in entries.items():
+        by_file.setdefault(entry.get("weibo_json", ""), set()).add(post_id)
+    for weibo_json, wanted in by_file.items():
+        if not os.path.isfile(weibo_json):
+            print(f"[warn] repair: {weibo_json} no longer exists", file=sys.stderr)
+            continue
+        for post in iter_posts(weibo_json):
+            post_id = post.get("id", "")
+            if post_id in wanted:
+                wanted.discard(post_id)
+                yield post, weibo_json
+                if not wanted:
+                    break
+
+
+def _write_records(
+    sink: Any,
+    model_path: str,
+    batch: list[tuple[dict, str]],
+    records: list[dict],
+) -> None:
+    for (post, weibo_json), record in zip(batch, records):
+        post_id = record["post_id"]
+        meta = {
+            "post_id": post_id,
+            "weibo_json": weibo_json,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "model": model_path,
+            "publish_time": post.get("publish_time"),
+        }
+        sink.write(post_id, {"meta": meta, "input": post, "result": record})
+    sink.end_batch()
+
+
+class _RecordCollector:
+    """Sink stand-in for ``--repair``: keeps the new record lines for patching into the output."""
+
+    def __init__(self) -> None:
+        self.lines: dict[str, dict] = {}
+        self.records = 0
+        self.bytes_written = 0
+
+    def write(self, post_id: str, line: dict) -> None:
+        self.lines[post_id] = line
+        self.records += 1
+
+    def end_batch(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def _apply_repairs(
+    args: argparse.Namespace,
+    output: str,
+    queue_path: str,
+    entries: dict[str, dict],
+    lines: dict[str, dict],
+    outcomes: dict[str, Optional[str]],
+    store: Optional[ExtractionStore] = None,
+) -> None:
+    """Patch fixed records into the output (and the store) and rewrite the queue with what still fails."""
+    fixed = {post_id: line for post_id, line in lines.items() if outcomes.get(post_id) is None}
+    patched = patch_records(args.output_format, output, args.output_dir, fixed)
+    if store is not None:
+        store.put_many((post_id, fixed[post_id]) for post_id in patched)
+    remaining: list[dict] = []
+    still_failing = not_found = 0
+    for post_id, entry in entries.items():
+        if post_id in patched:
+            continue
+        if post_id in outcomes:
+            still_failing += 1
+            entry = dict(entry, reason=outcomes[post_id] or entry.get("reason"), attempt=entry.get("attempt", 0) + 1)
+        else:
+            not_found += 1
+        remaining.append(entry)
+    write_queue(queue_path, remaining)
+    print(
+        f"[repair] queued={len(entries)} rerun={len(outcomes)} fixed={len(fixed)} patched={len(patched)} "
+        f"still_failing={still_failing} not_found={not_found} max_tokens={args.max_tokens} "
+        f"temperature={args.temperature} -> {queue_path} ({len(remaining)} left)",
+        file=sys.stderr,
+    )
+    if len(fixed) > len(patched):
+        print(
+            f"[warn] repair: {len(fixed) - len(patched)} fixed record(s) were not found in {output}; "
+            "they stay queued",
+            file=sys.stderr,
+        )
+
+
+class _Cascade:
+    """Bookkeeping for ``--cascade``: which text-pass results to keep, which posts to re-extract.
+
+    ``prepared`` runs in the prepare pool on every text-pass request, ``split``
+    in the writer thread on every text-pass batch. Posts whose media score at
+    or above ``threshold`` are held back from the output and queued in
+    ``deferred`` for a second, multimodal pass.
+    """
+
+    def __init__(self, threshold: float, estimator: TokenEstimator) -> None:
+        self.threshold = threshold
+        self.estimator = estimator
+        self.deferred: list[tuple[dict, str]] = []
+        self.text_only_posts = 0
+        self.media_posts = 0
+        self.visual_tokens = 0
+        self.visual_tokens_avoided = 0
+        self._scores: dict[str, dict] = {}
+
+    def prepared(self, req: dict) -> None:
+        media = req.get("media_available") or {}
+        sizes = [image_size(path) for path in media.get("images") or []]
+        req["image_sizes"] = sizes
+        req["visual_tokens"] = self.estimator.media_tokens(sizes, len(media.get("videos") or []))
+
+    def split(
+        self, batch: list[tuple[dict, str]], records: list[dict], prepared: list[dict]
+    ) -> tuple[list[tuple[dict, str]], list[dict], list[dict]]:
+        """Keep text-pass results that need no media; defer the rest."""
+        kept: tuple[list, list, list] = ([], [], [])
+        for item, record, req in zip(batch, records, prepared):
+            media = req.get("media_available") or {}
+            if record.get("error"):
+                # Not written; a rerun with --resume tries the post again.
+                pass
+            elif not media.get("images") and not media.get("videos"):
+                self.text_only_posts += 1
+                record["cascade"] = {"pass": "text"}
+            else:
+                self.media_posts += 1
+                self.visual_tokens += req["visual_tokens"]
+                score, signals = visual_relevance(
+                    item[0].get("content", ""), req["image_sizes"], len(media.get("videos") or []), record["extraction"]
+                )
+                info = {"relevance": round(score, 3), "signals": signals}
+                if score >= self.threshold:
+                    self._scores[record["post_id"]] = info
+                    self.deferred.append(item)
+                    continue
+                self.visual_tokens_avoided += req["visual_tokens"]
+                record["cascade"] = {"pass": "text", **info}
+            kept[0].append(item)
+            kept[1].append(record)
+            kept[2].append(req)
+        return kept
+
+    def mark_vision(self, records: list[dict]) -> None:
+        for record in records:
+            record["cascade"] = {"pass": "vision", **self._scores.pop(record["post_id"], {})}
+
+    def summary(self) -> str:
+        return (
+            f"threshold={self.threshold} text_only={self.text_only_posts} media_posts={self.media_posts} "
+            f"reextracted={len(self.deferred)} "
+            f"({len(self.deferred) / self.media_posts if self.media_posts else 0.0:.1%} of media posts) "
+            f"visual_tokens_est={self.visual_tokens} avoided={self.visual_tokens_avoided} "
+            f"({self.visual_tokens_avoided / self.visual_tokens if self.visual_tokens else 0.0:.1%})"
+        )
+
+
+def _load_dry_backend(args: argparse.Namespace, model_path: str, startup: dict) -> Any:
+    """A backend that can render prompts but not generate: no model weights, no CUDA.
+
+    For ``--backend vllm`` only the processor (tokenizer + chat template) is
+    loaded, so prompts and text token counts match a real run. If that fails
+    the fake chat template is used and the failure is reported.
+    """
+    if args.backend == "openai":
+        return load_backend(EngineConfig.from_args(args), startup=startup)
+    from switchable_persona.fake_vlm import FakeProcessor
+
+    processor: Any = FakeProcessor()
+    if args.backend == "vllm":
         try:
-            ctypes.CDLL(cuda_runtime_lib, mode=ctypes.RTLD_GLOBAL)
-        except OSError:
-            pass
-
-
-def _iter_weibo_jsons(root: str) -> Iterable[str]:
-    for dirpath, _, filenames in os.walk(root):
-        for name in filenames:
-            if name.endswith(".json"):
-                yield os.path.join(dirpath, name)
-
-
-def _select_media_paths(post: dict, media_root: str, max_images: int, allow_download: bool) -> tuple[list[str], list[str]]:
-    image_paths: list[str] = []
-    video_paths: list[str] = []
-
-    media = post.get("media") or {}
-    media_imgs = media.get("original_pictures") or []
-    if media_imgs:
-        for item in media_imgs[:max_images]:
-            path = item.get("path")
-            if path and os.path.isfile(path):
-                image_paths.append(path)
-    media_vids = media.get("video") or []
-    if media_vids:
-        for item in media_vids:
-            path = item.get("path")
-            if path and os.path.isfile(path):
-                video_paths.append(path)
-
-    if not image_paths:
+            with timed(startup, "imports"):
+                from transformers import AutoProcessor
+            with timed(startup, "model_load"):
+                processor = AutoProcessor.from_pretrained(model_path, trust_remote_code=True)
+        except Exception as exc:
+            print(
+                f"[dry-run] cannot load the processor for {model_path} ({type(exc).__name__}: {exc}); "
+                "rendering with the fake chat template, token estimates are rough",
+                file=sys.stderr,
+            )
+    return LocalEngineBackend(None, processor, None, None)
+
+
+def _expected_media(post: dict, max_images: int) -> tuple[int, int]:
+    """Images (capped at ``max_images``) and videos a post references, found locally or not."""
+    images = len((post.get("media") or {}).get("original_pictures") or [])
+    if not images:
         pics = post.get("original_pictures")
         if pics and pics != "无":
-            urls = [u.strip() for u in pics.split(",") if u.strip()]
-            bases = [os.path.basename(u) for u in urls]
-            local_imgs = _find_by_basename(os.path.join(media_root, "img"), bases)
-            image_paths = local_imgs[:max_images]
-            if not image_paths and allow_download:
-                image_paths = _download_media(urls[:max_images], ".jpg")
-
-    if not video_paths:
+            images = len([u for u in pics.split(",") if u.strip()])
+    videos = len((post.get("media") or {}).get("video") or [])
+    if not videos:
         vurl = post.get("video_url")
-        if vurl and vurl != "无":
-            base = os.path.basename(vurl)
-            local_vids = _find_by_basename(os.path.join(media_root, "video"), [base])
-            video_paths = local_vids
-            if not video_paths and allow_download:
-                video_paths = _download_media([vurl], ".mp4")
-
-    return image_paths, video_paths
-
-
-def _extract_one(
-    llm: LLM,
-    processor: AutoProcessor,
-    sampling_params: SamplingParams,
-    post: dict,
-    media_root: str,
-    max_images: int,
-    allow_download: bool,
-    skip_videos: bool,
-    bad_videos: list[dict],
-) -> dict:
-    text = post.get("content", "")
-    post_id = post.get("id", "")
-
-    images, videos = _select_media_paths(post, media_root, max_images, allow_download)
-    if skip_videos:
-        videos = []
-    user_text = build_user_text(text, post_id)
-
-    messages: list[dict] = [
-        {
-            "role": "system",
-            "content": "Return ONLY valid JSON. Do not include any extra text.",
-        },
-        {
-            "role": "user",
-            "content": (
-                [{"type": "image", "image": _as_file_uri(path)} for path in images]
-                + [{"type": "video", "video": _as_file_uri(path)} for path in videos]
-                + [{"type": "text", "text": user_text}]
-            ),
-        },
-    ]
-
-    prompt = processor.apply_chat_template(
-        messages, tokenize=False, add_generation_prompt=True, enable_thinking=False
-    )
+        videos = 1 if vurl and vurl != "无" else 0
+    return min(images, max_images), videos
+
+
+def _dry_run(
+    args: argparse.Namespace,
+    backend: Any,
+    posts: Iterable[tuple[dict, str]],
+    bad_files: list[tuple[str, str]],
+    probe_table: Optional[VideoProbeTable],
+) -> int:
+    """Walk the pending posts, resolve media, render prompts and estimate tokens; report problems.
+
+    Media are not decoded; images and videos are estimated at the scheduler's
+    per-item fallback sizes. Returns 1 if any weibo JSON could not be read.
+    """
+    estimator = TokenEstimator(backend.processor)
+    report = open(args.dry_run_report, "w", encoding="utf-8") if args.dry_run_report else None
+    counts = {
+        "posts": 0,
+        "images": 0,
+        "missing_images": 0,
+        "videos": 0,
+        "missing_videos": 0,
+        "rejected_videos": 0,
+        "empty_videos": 0,
+        "over_length": 0,
+    }
+    est_tokens: list[int] = []
+    shown = 0
+
+    def problem(post_id: str, weibo_json: str, issue: str) -> None:
+        nonlocal shown
+        if report is not None:
+            report.write(json.dumps({"post_id": post_id, "weibo_json": weibo_json, "issue": issue}, ensure_ascii=False) + "\n")
+        if shown < args.dry_run_show:
+            print(f"[dry-run] {post_id} ({weibo_json}): {issue}", file=sys.stderr)
+        shown += 1
+
     try:
-        image_inputs, video_inputs, video_kwargs = process_vision_info(
-            messages,
-            image_patch_size=processor.image_processor.patch_size,
-            return_video_kwargs=True,
-            return_video_metadata=True,
-        )
-    except Exception as exc:
-        # If video decoding fails, retry with images only.
-        if videos:
-            for path in videos:
-                bad_videos.append(
-                    {
-                        "post_id": post_id,
-                        "video_path": path,
-                        "error": str(exc),
-                        "weibo_media_root": media_root,
-                    }
-                )
-            print(f"[warn] video decode failed for post {post_id}: {exc}", file=sys.stderr)
-            videos = []
-            messages = [
-                {
-                    "role": "system",
-                    "content": "Return ONLY valid JSON. Do not include any extra text.",
-                },
-                {
-                    "role": "user",
-                    "content": (
-                        [{"type": "image", "image": _as_file_uri(path)} for path in images]
-                        + [{"type": "text", "text": user_text}]
-                    ),
-                },
-            ]
-            prompt = processor.apply_chat_template(
-                messages, tokenize=False, add_generation_prompt=True, enable_thinking=False
+        for post, weibo_json in posts:
+            post_id = post.get("id", "")
+            media_root = os.path.dirname(weibo_json)
+            rejected: list[dict] = []
+            images, videos = resolve_media(
+                post, media_root, args.max_images, None, args.skip_videos, rejected, probe_table, args.max_video_seconds
             )
-            image_inputs, video_inputs, video_kwargs = process_vision_info(
-                messages,
-                image_patch_size=processor.image_processor.patch_size,
-                return_video_kwargs=True,
-                return_video_metadata=True,
+            want_images, want_videos = _expected_media(post, args.max_images)
+            if args.skip_videos:
+                want_videos = 0
+            counts["posts"] += 1
+            counts["images"] += len(images)
+            counts["videos"] += len(videos)
+            missing_images = max(0, want_images - len(images))
+            missing_videos = max(0, want_videos - len(videos) - len(rejected))
+            if missing_images:
+                counts["missing_images"] += missing_images
+                problem(post_id, weibo_json, f"{missing_images} image(s) not found locally")
+            if missing_videos:
+                counts["missing_videos"] += missing_videos
+                problem(post_id, weibo_json, "video not found locally")
+            for entry in rejected:
+                counts["rejected_videos"] += 1
+                problem(post_id, weibo_json, f"video rejected ({entry['error']}): {entry['video_path']}")
+            for path in videos:
+                if os.path.getsize(path) == 0:
+                    counts["empty_videos"] += 1
+                    problem(post_id, weibo_json, f"empty video, will fail to decode: {path}")
+
+            system_text, user_text = prompt_texts(post.get("content", ""), post_id, args.prompt_layout)
+            prompt = backend.render(build_messages(images, videos, user_text, system_text))
+            tokens = estimator.estimate(
+                {"prompt": prompt, "media_counts": {"image": len(images), "video": len(videos)}}
             )
-        else:
-            raise
-    mm_data: dict = {}
-    if image_inputs is not None:
-        mm_data["image"] = image_inputs
-    if video_inputs is not None:
-        mm_data["video"] = video_inputs
-
-    inputs = [
-        {
-            "prompt": prompt,
-            "multi_modal_data": mm_data,
-            "mm_processor_kwargs": video_kwargs,
-        }
-    ]
-
-    outputs = llm.generate(inputs, sampling_params)
-    text_out = ""
-    if outputs and outputs[0].outputs:
-        text_out = outputs[0].outputs[0].text.strip()
-    if not text_out:
-        pieces = []
-        for out in outputs or []:
-            for cand in out.outputs:
-                if cand.text:
-                    pieces.append(cand.text)
-        text_out = "".join(pieces).strip()
+            est_tokens.append(tokens)
+            if tokens > args.max_model_len:
+                counts["over_length"] += 1
+                problem(post_id, weibo_json, f"~{tokens} prompt tokens > --max-model-len {args.max_model_len}")
+        for weibo_json, error in bad_files:
+            problem("-", weibo_json, f"unreadable weibo JSON: {error}")
+    finally:
+        if report is not None:
+            report.close()
+
+    if shown > args.dry_run_show:
+        print(f"[dry-run] ... {shown - args.dry_run_show} more problem(s)", file=sys.stderr)
+    est_tokens.sort()
+    p95 = est_tokens[min(len(est_tokens) - 1, int(0.95 * len(est_tokens)))] if est_tokens else 0
+    print(
+        f"[dry-run] {' '.join(f'{k}={v}' for k, v in counts.items())} bad_files={len(bad_files)} "
+        f"est_tokens={sum(est_tokens)} est_tokens_p95={p95} est_tokens_max={est_tokens[-1] if est_tokens else 0} "
+        f"problems={shown}" + (f" report={args.dry_run_report}" if args.dry_run_report else ""),
+        file=sys.stderr,
+    )
+    return 1 if bad_files else 0
+
+
+_DONE = object()
+
+
+class _StageStats:
+    """Queue-depth samples and blocked time for one pipeline stage."""
+
+    def __init__(self, name: str, wait_label: str) -> None:
+        self.name = name
+        self.wait_label = wait_label
+        self.samples = 0
+        self.depth_sum = 0
+        self.depth_max = 0
+        self.wait_s = 0.0
+
+    def sample(self, q: queue.Queue) -> None:
+        depth = q.qsize()
+        self.samples += 1
+        self.depth_sum += depth
+        self.depth_max = max(self.depth_max, depth)
+
+    def summary(self) -> str:
+        mean = self.depth_sum / self.samples if self.samples else 0.0
+        return (
+            f"{self.name}: depth_mean={mean:.1f} depth_max={self.depth_max} "
+            f"{self.wait_label}={self.wait_s:.1f}s"
+        )
+
+
+def _put(q: queue.Queue, item: Any, stop: threading.Event, stats: _StageStats) -> bool:
+    """Blocking put that gives up once ``stop`` is set; time spent blocked counts as backpressure."""
+    started = time.perf_counter()
     try:
-        parsed = json.loads(text_out)
-    except json.JSONDecodeError:
-        parsed = {"_raw": text_out}
-    return {
-        "post_id": post_id,
-        "extraction": parsed,
-        "media_used": {"images": images, "videos": videos},
-    }
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    finally:
+        stats.wait_s += time.perf_counter() - started
+
+
+def _produce(
+    posts: Iterable[tuple[dict, str]],
+    pool: ThreadPoolExecutor,
+    prepare_q: queue.Queue,
+    stop: threading.Event,
+    stats: _StageStats,
+    errors: list[BaseException],
+    prepare: Callable[[dict, str], dict],
+) -> None:
+    """Submit posts to the preprocessing pool in order.
+
+    Futures are queued rather than results so output order follows input order,
+    and the bounded queue caps how many decoded requests exist at once.
+    """
+    try:
+        for post, weibo_json in posts:
+            fut = pool.submit(prepare, post, os.path.dirname(weibo_json))
+            stats.sample(prepare_q)
+            if not _put(prepare_q, (post, weibo_json, fut), stop, stats):
+                fut.cancel()
+                return
+    except BaseException as exc:
+        errors.append(exc)
+    finally:
+        _put(prepare_q, _DONE, stop, stats)
+
+
+def _write_worker(
+    write_q: queue.Queue,
+    errors: list[BaseException],
+    write: Callable[[list[tuple[dict, str]], list[dict], list[dict]], None],
+) -> None:
+    while True:
+        item = write_q.get()
+        if item is _DONE:
+            return
+        if errors:
+            # Keep draining so the generator never blocks on a dead writer.
+            continue
+        try:
+            write(*item)
+        except BaseException as exc:
+            errors.append(exc)
+
+
+def _run_pipeline(
+    posts: Iterable[tuple[dict, str]],
+    prepare: Callable[[dict, str], dict],
+    generate: Callable[[list[dict]], list[dict]],
+    write: Callable[[list[tuple[dict, str]], list[dict], list[dict]], None],
+    scheduler: LengthScheduler,
+    prefetch_depth: int,
+    workers: int,
+) -> tuple[int, list[_StageStats]]:
+    """Run prepare -> generate -> write as three overlapping stages.
+
+    Media lookup and vision preprocessing run in a ``workers``-sized thread pool
+    at most ``prefetch_depth`` posts ahead of generation; ``scheduler`` decides
+    which prepared posts go into each ``generate`` call. Finished batches are
+    handed to a writer thread through a small bounded queue. Returns the number
+    of posts generated and per-stage stats.
+    """
+    prepare_q: queue.Queue = queue.Queue(maxsize=prefetch_depth)
+    write_q: queue.Queue = queue.Queue(maxsize=2)
+    stop = threading.Event()
+    produce_stats = _StageStats("prepare_queue", "producer_blocked")
+    generate_stats = _StageStats("generate", "starved")
+    write_stats = _StageStats("write_queue", "generator_blocked")
+    produce_errors: list[BaseException] = []
+    write_errors: list[BaseException] = []
+
+    total = 0
+
+    def run(group: list[tuple[dict, str, dict]]) -> None:
+        nonlocal total
+        batch = [(post, weibo_json) for post, weibo_json, _ in group]
+        prepared = [req for _, _, req in group]
+        write_stats.sample(write_q)
+        _put(write_q, (batch, generate(prepared), prepared), stop, write_stats)
+        total += len(prepared)
+
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prepare")
+    producer = threading.Thread(
+        target=_produce,
+        args=(posts, pool, prepare_q, stop, produce_stats, produce_errors, prepare),
+        daemon=True,
+    )
+    writer = threading.Thread(
+        target=_write_worker, args=(write_q, write_errors, write), daemon=True
+    )
+    producer.start()
+    writer.start()
+    try:
+        while True:
+            generate_stats.sample(prepare_q)
+            started = time.perf_counter()
+            item = prepare_q.get()
+            if item is not _DONE:
+                post, weibo_json, fut = item
+                req = fut.result()
+            generate_stats.wait_s += time.perf_counter() - started
+            if item is _DONE:
+                break
+            for group in scheduler.add((post, weibo_json, req), req.get("est_tokens", 0)):
+                run(group)
+            if write_errors:
+                break
+        if not write_errors:
+            for group in scheduler.flush():
+                run(group)
+    finally:
+        stop.set()
+        producer.join()
+        pool.shutdown(wait=True, cancel_futures=True)
+        write_q.put(_DONE)
+        writer.join()
+    if produce_errors:
+        raise produce_errors[0]
+    if write_errors:
+        raise write_errors[0]
+    return total, [produce_stats, generate_stats, write_stats]
 
 
 def main() -> int:
@@ -430,96 +574,588 @@ def main() -> int:
     parser.add_argument("--weibo-root", required=True, help="Root dir that contains weibo JSON folders")
     parser.add_argument("--model", default=DEFAULT_MODEL, help="Model path")
     parser.add_argument("--output", default="processed_data/extractions.jsonl")
-    parser.add_argument("--output-dir", default="processed_data/extractions")
+    parser.add_argument(
+        "--output-dir",
+        default="processed_data/extractions",
+        help="Per-post JSON directory (only written with --output-format files)",
+    )
+    parser.add_argument(
+        "--output-format",
+        choices=OUTPUT_FORMATS,
+        default="files",
+        help="jsonl: JSONL only; files: JSONL + per-post JSON files; shards: size-rotated JSONL shards",
+    )
+    parser.add_argument("--shard-max-bytes", type=int, default=1 << 30, help="Rotate shards past this size")
+    parser.add_argument("--write-buffer-bytes", type=int, default=1 << 20)
+    parser.add_argument(
+        "--flush-policy",
+        choices=FLUSH_POLICIES,
+        default="batch",
+        help="Flush output after every batch, every --flush-interval seconds, or only at close",
+    )
+    parser.add_argument("--flush-interval", type=float, default=5.0)
+    parser.add_argument("--fsync", action="store_true", help="fsync output and ledger on every flush")
     parser.add_argument("--max-images", type=int, default=3)
     parser.add_argument("--allow-download-media", action="store_true")
+    parser.add_argument("--media-cache-dir", default=DEFAULT_CACHE_DIR, help="Persistent cache for downloaded media")
+    parser.add_argument("--media-cache-quota", type=int, default=20 << 30, help="Media cache size cap in bytes")
+    parser.add_argument("--download-workers", type=int, default=8)
+    parser.add_argument("--download-timeout", type=float, default=30.0, help="Per-request timeout in seconds")
+    parser.add_argument("--download-retries", type=int, default=2)
+    parser.add_argument(
+        "--image-cache-dir",
+        default="",
+        help="Cache decoded+resized images here so reruns skip image decoding (empty = off)",
+    )
+    parser.add_argument("--image-cache-max-bytes", type=int, default=10 << 30)
+    parser.add_argument(
+        "--result-cache-dir",
+        default="",
+        help=(
+            "Reuse outputs for identical model path/prompt/schema/sampling/media, e.g. "
+            f"{DEFAULT_RESULT_CACHE_DIR} ('' = off). Weights swapped under the same --model "
+            "path are not detected: use a fresh directory or prune with scripts/result_cache.py"
+        ),
+    )
+    parser.add_argument("--result-cache-max-bytes", type=int, default=2 << 30)
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=30.0,
+        help="Seconds between [metrics] lines with per-stage p50/p95 and throughput (0 = only at the end)",
+    )
+    parser.add_argument("--metrics-jsonl", default="", help="Append per-post stage timings and tokens here ('' = off)")
+    parser.add_argument(
+        "--prometheus-textfile",
+        default="",
+        help="Rewrite this .prom file with run metrics on every report (node_exporter textfile collector)",
+    )
     parser.add_argument("--skip-videos", action="store_true", help="Skip video inputs if decoding is unstable")
     parser.add_argument("--bad-video-log", default="processed_data/bad_videos.jsonl")
+    parser.add_argument(
+        "--video-probe-table",
+        default=DEFAULT_VIDEO_PROBE_TABLE,
+        help="Results of scripts/video_probe.py; known-bad videos are dropped up front ('' = off)",
+    )
+    parser.add_argument(
+        "--max-video-seconds",
+        type=float,
+        default=0.0,
+        help="Drop probed videos longer than this (0 = no limit)",
+    )
+    parser.add_argument(
+        "--post-registry",
+        default="",
+        help="Registry from scripts/post_registry.py; only canonical occurrences are extracted ('' = off)",
+    )
     parser.add_argument("--limit", type=int, default=0)
+    parser.add_argument(
+        "--num-shards",
+        type=int,
+        default=1,
+        help="Split posts by a stable hash of post_id across this many processes/nodes",
+    )
+    parser.add_argument(
+        "--shard-index",
+        type=int,
+        default=0,
+        help="Shard handled by this process; output, ledger and bad-video log get a shard suffix",
+    )
     parser.add_argument("--resume", action="store_true")
+    parser.add_argument(
+        "--repair-queue",
+        default=DEFAULT_REPAIR_QUEUE,
+        help="Record posts whose output is not JSON, truncated or off-schema here ('' = off)",
+    )
+    parser.add_argument(
+        "--repair",
+        action="store_true",
+        help="Re-run only the posts in --repair-queue and patch fixed records into the output in place",
+    )
+    parser.add_argument(
+        "--store",
+        default="",
+        help="Also write records to this SQLite store (see scripts/extraction_store.py; '' = off)",
+    )
+    parser.add_argument(
+        "--repair-token-factor",
+        type=float,
+        default=2.0,
+        help="With --repair, multiply --max-tokens by this",
+    )
+    parser.add_argument("--repair-temperature", type=float, default=0.0, help="With --repair, sampling temperature")
+    parser.add_argument(
+        "--cascade",
+        action="store_true",
+        help="Extract from text first; re-extract with media only posts whose media look relevant",
+    )
+    parser.add_argument(
+        "--cascade-threshold",
+        type=float,
+        default=DEFAULT_CASCADE_THRESHOLD,
+        help="Visual-relevance score (0-1) at which a media post is re-extracted with its media",
+    )
+    parser.add_argument(
+        "--pack",
+        type=int,
+        default=0,
+        help="Extract up to this many short text-only posts of a batch in one request (0 = off)",
+    )
+    parser.add_argument(
+        "--pack-post-chars",
+        type=int,
+        default=140,
+        help="With --pack, only posts with at most this many characters of text are packed",
+    )
+    parser.add_argument(
+        "--pack-max-tokens",
+        type=int,
+        default=4096,
+        help=f"With --pack, completion budget of one packed request ({PACK_TOKENS_PER_POST} reserved per post)",
+    )
+    parser.add_argument(
+        "--num-samples",
+        type=int,
+        default=1,
+        help="Sample this many completions per prompt in one request and merge them by vote (1 = off)",
+    )
+    parser.add_argument(
+        "--vote-threshold",
+        type=float,
+        default=0.5,
+        help="With --num-samples, keep list items found in at least this share of the usable samples",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Walk the corpus, resolve media, render prompts and estimate tokens without loading the model",
+    )
+    parser.add_argument("--dry-run-report", default="", help="With --dry-run, write every problem found here (JSONL)")
+    parser.add_argument("--dry-run-show", type=int, default=20, help="With --dry-run, problems printed to stderr")
     parser.add_argument("--max-model-len", type=int, default=110000)
     parser.add_argument("--gpu-memory-utilization", type=float, default=0.9)
     parser.add_argument("--temperature", type=float, default=0.2)
     parser.add_argument("--max-tokens", type=int, default=1200)
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=8,
+        help="Posts whose prompts are collected and submitted to the engine in one generate call",
+    )
+    parser.add_argument(
+        "--max-inflight",
+        type=int,
+        default=0,
+        help="Max sequences the engine runs concurrently (vLLM max_num_seqs; 0 = engine default)",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["vllm", "openai", "fake"],
+        default="vllm",
+        help=(
+            "Inference backend: in-process vLLM, a running OpenAI-compatible server, "
+            "or 'fake' (tests and benchmarks only: synthetic output, no model)"
+        ),
+    )
+    parser.add_argument("--api-base", default="http://127.0.0.1:8000/v1", help="Server URL for --backend openai")
+    parser.add_argument("--api-key", default="", help="Bearer token for --backend openai (default: $OPENAI_API_KEY)")
+    parser.add_argument(
+        "--served-model-name",
+        default="",
+        help="Model name the server expects (default: the --model path, as vllm serve registers it)",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=32,
+        help="Max in-flight HTTP requests for --backend openai (use a --batch-size at least this large)",
+    )
+    parser.add_argument("--request-timeout", type=float, default=600.0, help="Per-request timeout in seconds")
+    parser.add_argument(
+        "--remote-media",
+        choices=MEDIA_MODES,
+        default="data",
+        help="Send media inline as base64 or as file:// URLs (server needs --allowed-local-media-path)",
+    )
+    parser.add_argument(
+        "--prefetch-depth",
+        type=int,
+        default=0,
+        help="Max preprocessed posts queued ahead of generation (0 = 2x batch size)",
+    )
+    parser.add_argument(
+        "--prepare-workers",
+        type=int,
+        default=4,
+        help="Threads doing media lookup and vision preprocessing",
+    )
+    parser.add_argument(
+        "--prompt-layout",
+        choices=PROMPT_LAYOUTS,
+        default="legacy",
+        help="'prefix' puts instructions+schema in a shared leading prefix for vLLM prefix caching",
+    )
+    parser.add_argument(
+        "--schedule-window",
+        type=int,
+        default=0,
+        help="Buffer this many prepared posts and batch them by estimated prompt length (0 = crawl order)",
+    )
+    parser.add_argument(
+        "--max-batch-tokens",
+        type=int,
+        default=0,
+        help="Cap on estimated prompt tokens per generate call (0 = only --batch-size applies)",
+    )
     args = parser.parse_args()
+    main_started = time.perf_counter()
+    if args.batch_size < 1:
+        parser.error("--batch-size must be >= 1")
+    if args.prefetch_depth < 0 or args.prepare_workers < 1:
+        parser.error("--prefetch-depth must be >= 0 and --prepare-workers >= 1")
+    if args.num_shards < 1 or not 0 <= args.shard_index < args.num_shards:
+        parser.error("--shard-index must be in [0, --num-shards)")
+    if not os.path.isdir(args.weibo_root):
+        parser.error(f"--weibo-root {args.weibo_root} is not a directory")
+    if args.post_registry and not os.path.isfile(args.post_registry):
+        parser.error(f"--post-registry {args.post_registry} does not exist (build it with scripts/post_registry.py)")
+    if args.dry_run_report and not args.dry_run:
+        parser.error("--dry-run-report requires --dry-run")
+    if args.pack and args.pack_max_tokens < 2 * PACK_TOKENS_PER_POST:
+        parser.error(f"--pack-max-tokens must leave room for two posts ({2 * PACK_TOKENS_PER_POST})")
+    if args.num_samples < 1:
+        parser.error("--num-samples must be >= 1")
+    if args.num_samples > 1:
+        if args.pack:
+            parser.error("--num-samples cannot be combined with --pack")
+        if args.temperature <= 0:
+            parser.error("--num-samples > 1 needs --temperature > 0 (greedy samples are identical)")
+        if not 0 < args.vote_threshold <= 1:
+            parser.error("--vote-threshold must be in (0, 1]")
+    if args.repair and (args.dry_run or args.cascade or not args.repair_queue):
+        parser.error("--repair needs --repair-queue and cannot be combined with --dry-run or --cascade")
+    output = shard_output(args.output, args.shard_index, args.num_shards)
+    model_path = os.path.expanduser(args.model)
+    repair_queue_path = shard_output(args.repair_queue, args.shard_index, args.num_shards) if args.repair_queue else ""
+    repair_entries: dict[str, dict] = {}
+    if args.repair:
+        repair_entries = load_queue(repair_queue_path)
+        if not repair_entries:
+            print(f"[repair] nothing queued in {repair_queue_path}", file=sys.stderr)
+            return 0
+        # These outputs already failed once with the configured budget and
+        # temperature; retry with more room and less randomness.
+        args.max_tokens = int(args.max_tokens * args.repair_token_factor)
+        args.temperature = args.repair_temperature
+        if args.temperature <= 0:
+            # Greedy samples would all be the same.
+            args.num_samples = 1
+    if args.backend == "vllm" and not args.dry_run:
+        # May re-exec the interpreter; do it before anything expensive has run.
+        ensure_cuda_runtime()
 
-    _ensure_cuda_runtime()
+    # Always load (and if needed build/catch up) the ledger so it stays complete
+    # even for runs without --resume. A dry run only reads it for --resume.
+    completed = completed_post_ids(output) if args.resume or not args.dry_run else set()
+    processed = completed if args.resume else set()
 
-    model_path = os.path.expanduser(args.model)
-    llm = LLM(
-        model=model_path,
-        trust_remote_code=True,
-        max_model_len=args.max_model_len,
-        gpu_memory_utilization=args.gpu_memory_utilization,
-    )
-    processor = AutoProcessor.from_pretrained(model_path, trust_remote_code=True)
-    sampling_params = SamplingParams(
-        temperature=args.temperature,
-        max_tokens=args.max_tokens,
-        structured_outputs=StructuredOutputsParams(json=SCHEMA_JSON),
-    )
-
-    os.makedirs(args.output_dir, exist_ok=True)
-    os.makedirs(os.path.dirname(args.output), exist_ok=True)
-
-    processed = set()
-    if args.resume:
-        if os.path.isfile(args.output):
-            with open(args.output, "r", encoding="utf-8") as f:
-                for line in f:
-                    try:
-                        rec = json.loads(line)
-                        processed.add(rec.get("post_id"))
-                    except json.JSONDecodeError:
-                        continue
+    registry = None
+    if args.post_registry:
+        registry = PostRegistry(args.post_registry, args.weibo_root)
+        print(f"[registry] loaded {len(registry)} canonical posts", file=sys.stderr)
 
-    total = 0
-    bad_videos: list[dict] = []
-    with open(args.output, "a", encoding="utf-8") as out:
-        for weibo_json in _iter_weibo_jsons(args.weibo_root):
-            data = json.loads(open(weibo_json, "r", encoding="utf-8").read())
-            posts = data.get("weibo", [])
-            media_root = os.path.dirname(weibo_json)
-            for post in posts:
-                post_id = post.get("id", "")
-                if not post_id:
-                    continue
-                if args.resume and post_id in processed:
-                    continue
-                record = _extract_one(
-                    llm,
-                    processor,
-                    sampling_params,
-                    post,
-                    media_root,
-                    args.max_images,
-                    args.allow_download_media,
-                    args.skip_videos,
-                    bad_videos,
-                )
-                meta = {
-                    "post_id": post_id,
-                    "weibo_json": weibo_json,
-                    "created_at": datetime.now(timezone.utc).isoformat(),
-                    "model": model_path,
-                    "publish_time": post.get("publish_time"),
+    probe_table = None
+    if args.video_probe_table and os.path.isfile(args.video_probe_table):
+        probe_table = VideoProbeTable(args.video_probe_table)
+        print(
+            f"[video-probe] loaded {len(probe_table.entries)} entries"
+            f" (ignored {probe_table.ignored} from probes that could not run)",
+            file=sys.stderr,
+        )
+
+    startup: dict = {}
+    if args.dry_run:
+        backend = _load_dry_backend(args, model_path, startup)
+        bad_files: list[tuple[str, str]] = []
+        try:
+            status = _dry_run(
+                args,
+                backend,
+                _iter_pending_posts(
+                    args.weibo_root,
+                    processed,
+                    args.limit,
+                    args.num_shards,
+                    args.shard_index,
+                    registry,
+                    bad_files,
+                ),
+                bad_files,
+                probe_table,
+            )
+        finally:
+            backend.close()
+        if registry is not None:
+            print(
+                f"[registry] skipped_duplicates={registry.duplicates} unregistered={registry.unregistered}",
+                file=sys.stderr,
+            )
+        print(f"[dry-run] elapsed={time.perf_counter() - main_started:.1f}s", file=sys.stderr)
+        return status
+
+    image_cache = None
+    if args.image_cache_dir:
+        image_cache = ImageCache(args.image_cache_dir, max_bytes=args.image_cache_max_bytes)
+    backend = load_backend(EngineConfig.from_args(args), image_cache, startup)
+    print(
+        f"[startup] backend={args.backend} imports={startup.get('imports', 0.0):.1f}s "
+        f"model_load={startup.get('model_load', 0.0):.1f}s ready_after={time.perf_counter() - main_started:.1f}s",
+        file=sys.stderr,
+    )
+
+    result_cache = None
+    if args.result_cache_dir:
+        result_cache = ResultCache(
+            args.result_cache_dir,
+            model_path,
+            SCHEMA_JSON,
+            backend.sampling_params,
+            max_bytes=args.result_cache_max_bytes,
+        )
+
+    bad_videos = BadVideoLog(shard_output(args.bad_video_log, args.shard_index, args.num_shards))
+    downloader = None
+    if args.allow_download_media:
+        downloader = MediaDownloader(
+            cache_dir=args.media_cache_dir,
+            quota_bytes=args.media_cache_quota,
+            workers=args.download_workers,
+            timeout_s=args.download_timeout,
+            retries=args.download_retries,
+        )
+    engine = ExtractionEngine(
+        backend,
+        model_path,
+        max_images=args.max_images,
+        downloader=downloader,
+        skip_videos=args.skip_videos,
+        bad_videos=bad_videos,
+        prompt_layout=args.prompt_layout,
+        probe_table=probe_table,
+        max_video_seconds=args.max_video_seconds,
+        result_cache=result_cache,
+        batch_size=args.batch_size,
+        pack_size=args.pack,
+        pack_max_chars=args.pack_post_chars,
+        pack_max_tokens=args.pack_max_tokens,
+        num_samples=args.num_samples,
+        vote_threshold=args.vote_threshold,
+    )
+
+    estimator = TokenEstimator(backend.processor)
+    over_length: list[str] = []
+
+    cascade = _Cascade(args.cascade_threshold, estimator) if args.cascade else None
+
+    def prepare(post: dict, media_root: str, text_only: bool = False) -> dict:
+        req = engine.prepare(post, media_root, text_only)
+        if cascade is not None and text_only:
+            cascade.prepared(req)
+        if req["input"] is None:
+            req["est_tokens"] = 0
+            return req
+        req["est_tokens"] = estimator.estimate(req["input"])
+        if req["est_tokens"] > args.max_model_len:
+            over_length.append(req["post_id"])
+            print(
+                f"[warn] post {req['post_id']} estimated at {req['est_tokens']} prompt tokens "
+                f"(> --max-model-len {args.max_model_len})",
+                file=sys.stderr,
+            )
+        return req
+
+    scheduler = LengthScheduler(args.batch_size, args.max_batch_tokens, args.schedule_window)
+    metrics = StageMetrics(args.metrics_interval, args.metrics_jsonl, args.prometheus_textfile)
+
+    repair_queue = RepairQueue(repair_queue_path) if repair_queue_path and not args.repair else None
+    repair_outcomes: dict[str, Optional[str]] = {}
+
+    failed: list[str] = []
+
+    def write(batch: list[tuple[dict, str]], records: list[dict], prepared: list[dict]) -> None:
+        if any(record.get("error") for record in records):
+            # Requests the backend could not complete are neither written nor
+            # ledgered, so --resume (or the repair queue) retries them.
+            kept = [i for i, record in enumerate(records) if not record.get("error")]
+            for record in records:
+                if record.get("error"):
+                    failed.append(record["post_id"])
+                    if args.repair:
+                        entry = repair_entries[record["post_id"]]
+                        repair_outcomes[record["post_id"]] = entry.get("reason") or "request_failed"
+            batch = [batch[i] for i in kept]
+            records = [records[i] for i in kept]
+            prepared = [prepared[i] for i in kept]
+        if args.repair:
+            for record in records:
+                entry = repair_entries[record["post_id"]]
+                record["repair"] = {
+                    "previous_reason": entry.get("reason"),
+                    "attempt": entry.get("attempt", 0) + 1,
+                    "max_tokens": args.max_tokens,
+                    "temperature": args.temperature,
                 }
-                line = {"meta": meta, "input": post, "result": record}
-                out.write(json.dumps(line, ensure_ascii=False) + "\n")
-                with open(
-                    os.path.join(args.output_dir, f"{post_id}.json"),
-                    "w",
-                    encoding="utf-8",
-                ) as fp:
-                    json.dump(line, fp, ensure_ascii=False, indent=2)
-                total += 1
-                if args.limit and total >= args.limit:
-                    return 0
-    if bad_videos:
-        os.makedirs(os.path.dirname(args.bad_video_log), exist_ok=True)
-        with open(args.bad_video_log, "a", encoding="utf-8") as f:
-            for item in bad_videos:
-                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+        started = time.perf_counter()
+        _write_records(sink, model_path, batch, records)
+        write_s = (time.perf_counter() - started) / len(records) if records else 0.0
+        for (_, weibo_json), req in zip(batch, prepared):
+            timings = req.get("timings", {})
+            timings["write"] = write_s
+            metrics.record(req["post_id"], timings, req.get("tokens", {}))
+            reason = req.get("repair_reason")
+            if args.repair:
+                repair_outcomes[req["post_id"]] = reason
+            elif reason is not None and repair_queue is not None:
+                repair_queue.append(
+                    {
+                        "post_id": req["post_id"],
+                        "weibo_json": weibo_json,
+                        "reason": reason,
+                        "attempt": 0,
+                        "created_at": datetime.now(timezone.utc).isoformat(),
+                    }
+                )
+
+    usage: dict = {}
+    started = time.perf_counter()
+    if args.repair:
+        sink: Any = _RecordCollector()
+    else:
+        sink = open_sink(
+            args.output_format,
+            output,
+            args.output_dir,
+            shard_max_bytes=args.shard_max_bytes,
+            buffer_bytes=args.write_buffer_bytes,
+            flush_policy=args.flush_policy,
+            flush_interval_s=args.flush_interval,
+            fsync=args.fsync,
+        )
+    store = ExtractionStore(args.store) if args.store else None
+    if store is not None and not args.repair:
+        sink = TeeSink(sink, StoreSink(store))
+
+    def run(posts: Iterable[tuple[dict, str]], prepare: Callable, write: Callable) -> tuple[int, list]:
+        return _run_pipeline(
+            posts,
+            prepare,
+            lambda prepared: engine.generate(prepared, usage),
+            write,
+            scheduler=scheduler,
+            prefetch_depth=args.prefetch_depth or 2 * args.batch_size,
+            workers=args.prepare_workers,
+        )
+
+    vision_stats: list = []
+    if args.repair:
+        pending = _iter_queued_posts(repair_entries)
+    else:
+        pending = _iter_pending_posts(
+            args.weibo_root, processed, args.limit, args.num_shards, args.shard_index, registry
+        )
+    try:
+        if cascade is None:
+            total, stage_stats = run(pending, prepare, write)
+        else:
+            # Pass 1: every post from its text alone; media posts whose
+            # relevance crosses the threshold are held back for pass 2.
+            total, stage_stats = run(
+                pending,
+                lambda post, media_root: prepare(post, media_root, text_only=True),
+                lambda batch, records, prepared: write(*cascade.split(batch, records, prepared)),
+            )
+            if cascade.deferred:
+                print(f"[cascade] re-extracting {len(cascade.deferred)} posts with their media", file=sys.stderr)
+
+                def write_vision(batch: list[tuple[dict, str]], records: list[dict], prepared: list[dict]) -> None:
+                    cascade.mark_vision(records)
+                    write(batch, records, prepared)
+
+                _, vision_stats = run(iter(cascade.deferred), prepare, write_vision)
+        if args.repair:
+            _apply_repairs(args, output, repair_queue_path, repair_entries, sink.lines, repair_outcomes, store)
+    finally:
+        sink.close()
+        if store is not None:
+            print(f"[store] {args.store} {store.stats()}", file=sys.stderr)
+            store.close()
+        bad_videos.close()
+        if repair_queue is not None:
+            repair_queue.close()
+            if repair_queue.count:
+                print(
+                    f"[repair-queue] queued={repair_queue.count} -> {repair_queue_path} "
+                    "(re-run them with --repair)",
+                    file=sys.stderr,
+                )
+        engine.close()
+        metrics.close()
+        if isinstance(backend, OpenAIChatBackend):
+            print(f"[remote] {args.api_base} {backend.stats()}", file=sys.stderr)
+        if downloader is not None:
+            print(f"[download] {downloader.stats()}", file=sys.stderr)
+        if image_cache is not None:
+            print(f"[image-cache] {image_cache.stats()}", file=sys.stderr)
+        if result_cache is not None:
+            print(f"[result-cache] {result_cache.stats()}", file=sys.stderr)
+    elapsed = time.perf_counter() - started
+    print(
+        f"[done] posts={total} elapsed={elapsed:.1f}s "
+        f"posts/s={total / elapsed if elapsed > 0 else 0.0:.2f} batch_size={args.batch_size}",
+        file=sys.stderr,
+    )
+    for stats in stage_stats:
+        print(f"[pipeline] {stats.summary()}", file=sys.stderr)
+    for stats in vision_stats:
+        print(f"[pipeline:cascade-media] {stats.summary()}", file=sys.stderr)
+    print(f"[stages] {metrics.summary()}", file=sys.stderr)
+    if cascade is not None:
+        print(f"[cascade] {cascade.summary()}", file=sys.stderr)
+    if engine.packer is not None:
+        print(f"[pack] {engine.packer.summary()}", file=sys.stderr)
+    if engine.voter is not None:
+        print(f"[vote] {engine.voter.summary()}", file=sys.stderr)
+    prompt_tokens = usage.get("prompt_tokens", 0)
+    cached_tokens = usage.get("cached_tokens", 0)
+    print(
+        f"[prefix-cache] layout={args.prompt_layout} prompt_tokens={prompt_tokens} "
+        f"cached_tokens={cached_tokens} "
+        f"hit_ratio={cached_tokens / prompt_tokens if prompt_tokens else 0.0:.3f} "
+        f"uncached_tokens/post={(prompt_tokens - cached_tokens) / total if total else 0.0:.0f}",
+        file=sys.stderr,
+    )
+    if registry is not None:
+        print(
+            f"[registry] skipped_duplicates={registry.duplicates} unregistered={registry.unregistered}",
+            file=sys.stderr,
+        )
+    print(
+        f"[schedule] {scheduler.summary(usage.get('estimated_tokens', 0), prompt_tokens)} "
+        f"over_max_model_len={len(over_length)}",
+        file=sys.stderr,
+    )
+    print(
+        f"[output] format={args.output_format} path={output} records={sink.records} "
+        f"bytes={sink.bytes_written} bad_videos={bad_videos.count} (already logged: {bad_videos.duplicates})",
+        file=sys.stderr,
+    )
+    if failed:
+        print(
+            f"[warn] {len(failed)} post(s) failed at the backend and were not written "
+            f"(first: {', '.join(failed[:5])}); rerun with --resume to retry them",
+            file=sys.stderr,
+        )
+        return 1
     return 0
 
 
@@ -0,0 +1,7 @@
+#!/usr/bin/env python3
+"""Command-line entry point for ``switchable_persona.media_index`` (usage in its docstring)."""
+
+from _package import run
+
+if __name__ == "__main__":
+    raise SystemExit(run("media_index"))
@@ -1,319 +1,111 @@
 #!/usr/bin/env python3
-"""Test single-post extraction with Qwen3-VL via vLLM."""
+"""Test single-post extraction with Qwen3-VL via vLLM.
+
+Uses the same engine, prompt and schema as ``extract_all_weibo.py``
+(``switchable_persona.extraction``), so a spot check reproduces what the
+batch run would write for that post.
+
+Loading the model dominates a one-off check. Start a resident engine once
+with ``--serve`` and send posts to it with ``--daemon``. Per-post flags
+(``--max-images``, ``--skip-videos``, ``--prompt-layout``, ...) travel with each
+request; sampling flags must match what the engine was started with.
+
+Usage:
+  python3 scripts/test_single_post_extract.py --weibo-json weibo/<user>/<user>.json --post-id <id>
+  python3 scripts/test_single_post_extract.py --serve &
+  python3 scripts/test_single_post_extract.py --daemon --text "..." --image a.jpg
+"""
 
 from __future__ import annotations
 
 import argparse
 import json
 import os
-import site
 import sys
-import tempfile
-from typing import List, Optional
-from urllib.request import urlretrieve
-
-import ctypes
-from transformers import AutoProcessor
-from qwen_vl_utils import process_vision_info
-
-
-DEFAULT_MODEL = "~/models/Qwen/Qwen3-VL-8B-Thinking"
-
-
-SCHEMA_HINT = {
-    "post_id": "string",
-    "style": {
-        "catchphrases": ["string"],
-        "signature_patterns": ["string"],
-        "tone": ["e.g. formal", "casual", "celebratory", "persuasive"],
-        "emotion": "one of: joy|trust|fear|surprise|sadness|disgust|anger|anticipation",
-        "evidence": ["text span or visual cue"],
-        "confidence": 0.0,
-    },
-    "safety_rewrite": {
-        "terms": [{"term": "string", "replacement": "string"}],
-        "evidence": ["text span"],
-        "confidence": 0.0,
-    },
-    "stance": {
-        "targets": [
-            {
-                "target": "string",
-                "position": "support|oppose|neutral",
-                "evidence": ["text span or visual cue"],
-                "confidence": 0.0,
-            }
-        ],
-        "reasoning": [
-            {
-                "target": "string",
-                "opinion": "string",
-                "intent": "string",
-                "evidence": ["text span or visual cue"],
-                "confidence": 0.0,
-            }
-        ],
-    },
-    "topic": {
-        "trigger": "string",
-        "one_sentence_summary": "string",
-        "evidence": ["text span or visual cue"],
-        "confidence": 0.0,
-    },
-    "knowledge_facts": [
-        {"fact": "string", "evidence": ["text span"], "confidence": 0.0}
-    ],
-}
-
-SCHEMA_JSON = {
-    "type": "object",
-    "additionalProperties": False,
-    "required": ["post_id", "style", "safety_rewrite", "stance", "topic", "knowledge_facts"],
-    "properties": {
-        "post_id": {"type": "string"},
-        "style": {
-            "type": "object",
-            "additionalProperties": False,
-            "required": [
-                "catchphrases",
-                "signature_patterns",
-                "tone",
-                "emotion",
-                "evidence",
-                "confidence",
-            ],
-            "properties": {
-                "catchphrases": {"type": "array", "items": {"type": "string"}},
-                "signature_patterns": {"type": "array", "items": {"type": "string"}},
-                "tone": {
-                    "type": "array",
-                    "items": {
-                        "type": "string",
-                        "enum": [
-                            "formal",
-                            "casual",
-                            "celebratory",
-                            "persuasive",
-                            "objective",
-                            "humorous",
-                            "sarcastic",
-                            "empathetic",
-                            "authoritative",
-                            "promotional",
-                            "instructional",
-                            "narrative",
-                            "urgent",
-                            "reflective",
-                        ],
-                    },
-                },
-                "emotion": {
-                    "type": "string",
-                    "enum": [
-                        "joy",
-                        "trust",
-                        "fear",
-                        "surprise",
-                        "sadness",
-                        "disgust",
-                        "anger",
-                        "anticipation",
-                        "none",
-                    ],
-                },
-                "evidence": {"type": "array", "items": {"type": "string"}},
-                "confidence": {"type": "number"},
-            },
-        },
-        "safety_rewrite": {
-            "type": "object",
-            "additionalProperties": False,
-            "required": ["terms", "evidence", "confidence"],
-            "properties": {
-                "terms": {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "additionalProperties": False,
-                        "required": ["term", "replacement"],
-                        "properties": {
-                            "term": {"type": "string"},
-                            "replacement": {"type": "string"},
-                        },
-                    },
-                },
-                "evidence": {"type": "array", "items": {"type": "string"}},
-                "confidence": {"type": "number"},
-            },
-        },
-        "stance": {
-            "type": "object",
-            "additionalProperties": False,
-            "required": ["targets", "reasoning"],
-            "properties": {
-                "targets": {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "additionalProperties": False,
-                        "required": ["target", "position", "evidence", "confidence"],
-                        "properties": {
-                            "target": {"type": "string"},
-                            "position": {"type": "string"},
-                            "evidence": {"type": "array", "items": {"type": "string"}},
-                            "confidence": {"type": "number"},
-                        },
-                    },
-                },
-                "reasoning": {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "additionalProperties": False,
-                        "required": [
-                            "target",
-                            "opinion",
-                            "intent",
-                            "evidence",
-                            "confidence",
-                        ],
-                        "properties": {
-                            "target": {"type": "string"},
-                            "opinion": {"type": "string"},
-                            "intent": {"type": "string"},
-                            "evidence": {"type": "array", "items": {"type": "string"}},
-                            "confidence": {"type": "number"},
-                        },
-                    },
-                },
-            },
-        },
-        "topic": {
-            "type": "object",
-            "additionalProperties": False,
-            "required": ["trigger", "one_sentence_summary", "evidence", "confidence"],
-            "properties": {
-                "trigger": {"type": "string"},
-                "one_sentence_summary": {"type": "string"},
-                "evidence": {"type": "array", "items": {"type": "string"}},
-                "confidence": {"type": "number"},
-            },
-        },
-        "knowledge_facts": {
-            "type": "array",
-            "items": {
-                "type": "object",
-                "additionalProperties": False,
-                "required": ["fact", "evidence", "confidence"],
-                "properties": {
-                    "fact": {"type": "string"},
-                    "evidence": {"type": "array", "items": {"type": "string"}},
-                    "confidence": {"type": "number"},
-                },
-            },
-        },
-    },
-}
-
-
-def _download_media(urls: List[str], suffix: str) -> List[str]:
-    tmp_dir = tempfile.mkdtemp(prefix="vlm_media_")
-    local_paths: List[str] = []
-    for idx, url in enumerate(urls, start=1):
-        try:
-            out_path = os.path.join(tmp_dir, f"media_{idx:02d}{suffix}")
-            urlretrieve(url, out_path)
-            local_paths.append(out_path)
-        except Exception:
-            continue
-    return local_paths
-
-
-def _find_by_basename(root: str, basenames: List[str]) -> List[str]:
-    if not root or not os.path.isdir(root):
-        return []
-    found: List[str] = []
-    for base in basenames:
-        for dirpath, _, filenames in os.walk(root):
-            if base in filenames:
-                found.append(os.path.join(dirpath, base))
-                break
-    return found
-
-
-def _gather_media_paths(
-    image_path: Optional[str], video_path: Optional[str], max_images: int
-) -> tuple[list[str], list[str]]:
-    images: list[str] = []
-    videos: list[str] = []
-    if image_path:
-        images.append(image_path)
-    if video_path:
-        videos.append(video_path)
-    return images[:max_images], videos
-
-
-def _as_file_uri(path: str) -> str:
-    if path.startswith(("file://", "http://", "https://", "data:")):
-        return path
-    return f"file://{path}"
+from typing import Optional
+
+import _package  # noqa: F401  (puts src/ on sys.path)
+from switchable_persona.extraction import (
+    DEFAULT_MODEL,
+    DEFAULT_SOCKET,
+    PROMPT_LAYOUTS,
+    EngineConfig,
+    ExtractionEngine,
+    daemon_request,
+    serve,
+)
+from switchable_persona.inference_backend import MEDIA_MODES
+from switchable_persona.media_downloader import DEFAULT_CACHE_DIR, MediaDownloader
+from switchable_persona.weibo_stream import iter_posts
 
 
 def _select_post(weibo_json: str, post_id: Optional[str]) -> dict:
-    data = json.loads(open(weibo_json, "r", encoding="utf-8").read())
-    posts = data.get("weibo", [])
-    if not posts:
-        raise ValueError("No posts found in weibo JSON.")
-    if post_id:
-        for item in posts:
+    first = None
+    for item in iter_posts(weibo_json):
+        if post_id:
             if item.get("id") == post_id:
                 return item
-        raise ValueError(f"Post id {post_id} not found.")
-    # Prefer a post with media
-    for item in posts:
+            continue
+        if first is None:
+            first = item
+        # Prefer a post with media
         if item.get("original_pictures") not in (None, "无") or item.get("video_url") not in (None, "无"):
             return item
-    return posts[0]
+    if post_id:
+        raise ValueError(f"Post id {post_id} not found.")
+    if first is None:
+        raise ValueError("No posts found in weibo JSON.")
+    return first
 
 
-def build_user_text(text: str, post_id: str) -> str:
-    return (
-        "你是信息抽取器，服务于“基于三层人格架构构建虚拟角色”的长期任务。"
-        "你的输出将直接用于驱动虚拟角色的行为、写作风格与记忆库。"
-        "请基于单条微博（文字+图像/视频）做精确抽取，输出必须为严格 JSON。"
-        "不得输出分析过程或多余文本。\n\n"
-        "核心目标（与你的字段定义直接对应）：\n"
-        "A) style：提取“发帖风格线索”。tone 不是情感极性，必须描述说话语气与风格"
-        "（如 formal/casual/celebratory/persuasive/objective 等），可多选 1-3 个。"
-        "emotion 使用 8 大情绪（joy/trust/fear/surprise/sadness/disgust/anger/anticipation），"
-        "若无明显情绪则为 none。\n"
-        "B) stance：抽取作者对“具体目标对象”的立场与观点，并说明其背后意图。"
-        "必须拆成两层：targets（目标+立场+证据）与 reasoning（观点+意图+证据）。\n"
-        "C) topic：等价于“发帖原因/触发事件/主题”，用于驱动虚拟角色发帖的动机描述，"
-        "要求一句话概括，直接描述“因为什么而发帖”。\n"
-        "D) knowledge_facts：用于构建虚拟角色的“经历/认知/记忆库”。只记录稳定的实体或长期事实"
-        "（人/组织/品牌/物品/长期偏好/价值取向）。不要写一次性事件、短期里程碑或时间点。\n"
-        "E) safety_rewrite：不是审查，而是“表达时可替换的敏感词/表述”（若无则空）。\n\n"
-        "通用抽取原则：\n"
-        "1) 只抽取文本或图像/视频中可直接支持的内容；不要主观脑补。\n"
-        "2) 若某项不存在或不明显，保持为空列表/空字符串，confidence=0。\n"
-        "3) 证据字段必须为原文或视觉线索的最小片段。\n"
-        "4) 不要把“发帖原因”误放入 knowledge_facts；它应归入 topic。\n"
-        "5) knowledge_facts 里只保留“长期可复用的事实/实体”。\n\n"
-        "少样本对齐（仅用于统一任务理解，不是硬性规则）：\n"
-        "POST_ID: EXAMPLE1\n"
-        "TEXT: “比亚迪成为全球首家达成第500万辆新能源汽车下线的车企。这份成绩属于比亚迪，更属于中国汽车品牌。在一起，才是中国汽车。”\n"
-        "正确理解：\n"
-        "- topic = 因“第500万辆下线”而发帖（一次性事件）。\n"
-        "- knowledge_facts = “比亚迪”“中国汽车品牌/行业”等长期实体，不写“第500万辆下线”。\n"
-        "- stance targets 可包含“比亚迪”“中国汽车工业/品牌”。\n"
-        "- style.tone 应为 celebratory/promotional 等风格，不是“积极/消极”。\n"
-        "- emotion 可为 joy/trust（如无明确情绪则 none）。\n\n"
-        f"POST_ID: {post_id}\n"
-        f"TEXT: {text}\n\n"
-        "输出 JSON schema（仅供参考，不要复述）：\n"
-        f"{json.dumps(SCHEMA_HINT, ensure_ascii=False)}\n"
-    )
+def _build_post(args: argparse.Namespace) -> tuple[dict, str]:
+    """The post to extract and its media root, from --weibo-json or --text; --image/--video override media."""
+    if args.weibo_json:
+        post = dict(_select_post(args.weibo_json, args.post_id))
+        media_root = args.media_root or os.path.dirname(args.weibo_json)
+    else:
+        post = {"id": args.post_id or "post-001", "content": args.text or ""}
+        media_root = args.media_root or ""
+    if not post.get("content"):
+        raise SystemExit("No text provided. Use --text or --weibo-json.")
+    for path in (args.image, args.video):
+        if path and not os.path.isfile(path):
+            raise SystemExit(f"No such media file: {path}")
+    media = dict(post.get("media") or {})
+    if args.image:
+        media["original_pictures"] = [{"path": os.path.abspath(args.image)}]
+    if args.video:
+        media["video"] = [{"path": os.path.abspath(args.video)}]
+    if media:
+        post["media"] = media
+    return post, os.path.abspath(media_root) if media_root else ""
+
+
+# Fixed when the engine loads, so meaningless for a --daemon request.
+_ENGINE_ONLY = (
+    "model",
+    "backend",
+    "max_model_len",
+    "gpu_memory_utilization",
+    "api_base",
+    "api_key",
+    "served_model_name",
+    "remote_media",
+    "media_cache_dir",
+)
+
+
+def _daemon_payload(args: argparse.Namespace, explicit: set[str], post: dict, media_root: str) -> dict:
+    """Daemon request for ``post``: per-request options plus the sampling the user asked for."""
+    options = {
+        name: getattr(args, name)
+        for name in ("max_images", "skip_videos", "prompt_layout", "vote_threshold")
+        if name in explicit
+    }
+    if args.no_download_media:
+        options["download_media"] = False
+    sampling = {name: getattr(args, name) for name in ("temperature", "max_tokens", "num_samples") if name in explicit}
+    return {"post": post, "media_root": media_root, "options": options, "sampling": sampling}
 
 
 def main() -> int:
@@ -326,11 +118,20 @@ def main() -> int:
     parser.add_argument("--video", help="Video path (local)")
     parser.add_argument("--max-images", type=int, default=3, help="Max images to load/download")
     parser.add_argument("--no-download-media", action="store_true", help="Skip downloading media URLs")
+    parser.add_argument("--media-cache-dir", default=DEFAULT_CACHE_DIR, help="Persistent cache for downloaded media")
     parser.add_argument("--media-root", help="Local media root (contains img/ and video/)")
-    parser.add_argument("--prefer-local-media", action="store_true", help="Prefer local media if found")
+    parser.add_argument(
+        "--prefer-local-media",
+        action="store_true",
+        help="Deprecated no-op: local media are always used before downloading",
+    )
+    parser.add_argument("--skip-videos", action="store_true")
+    parser.add_argument("--prompt-layout", choices=PROMPT_LAYOUTS, default="legacy")
     parser.add_argument("--output", help="Output JSON file path")
     parser.add_argument("--temperature", type=float, default=0.2)
     parser.add_argument("--max-tokens", type=int, default=1200)
+    parser.add_argument("--num-samples", type=int, default=1, help="Sample this many completions and merge by vote")
+    parser.add_argument("--vote-threshold", type=float, default=0.5)
     parser.add_argument(
         "--max-model-len",
         type=int,
@@ -343,170 +144,100 @@ def main() -> int:
         default=0.9,
         help="KV cache memory utilization ratio (0-1).",
     )
-
-    args = parser.parse_args()
-
-    model_path = os.path.expanduser(args.model)
-
-    # Ensure CUDA runtime (libcudart.so.12) from the venv is discoverable
-    # before importing vLLM. Some systems only honor LD_PRELOAD at process start,
-    # so we may re-exec once after setting it.
-    cuda_lib_dirs = []
-    cuda_runtime_lib = None
-    for sp in site.getsitepackages():
-        candidate = os.path.join(sp, "nvidia", "cuda_runtime", "lib")
-        if os.path.isdir(candidate):
-            cuda_lib_dirs.append(candidate)
-            cand_lib = os.path.join(candidate, "libcudart.so.12")
-            if os.path.isfile(cand_lib) and cuda_runtime_lib is None:
-                cuda_runtime_lib = cand_lib
-    if cuda_lib_dirs:
-        existing = os.environ.get("LD_LIBRARY_PATH", "")
-        os.environ["LD_LIBRARY_PATH"] = ":".join(cuda_lib_dirs + ([existing] if existing else []))
-    if cuda_runtime_lib and os.environ.get("CUDA_PRELOAD_DONE") != "1":
-        env = dict(os.environ)
-        env["CUDA_PRELOAD_DONE"] = "1"
-        env["LD_PRELOAD"] = f"{cuda_runtime_lib}:{env.get('LD_PRELOAD', '')}".rstrip(":")
-        os.execve(sys.executable, [sys.executable] + sys.argv, env)
-    if cuda_runtime_lib:
-        try:
-            ctypes.CDLL(cuda_runtime_lib, mode=ctypes.RTLD_GLOBAL)
-        except OSError:
-            pass
-
-    text = args.text
-    post_id = args.post_id or "post-001"
-    image_path = args.image
-    video_path = args.video
-
-    if args.weibo_json:
-        post = _select_post(args.weibo_json, args.post_id)
-        text = post.get("content", "")
-        post_id = post.get("id", post_id)
-        media_root = args.media_root
-        if not media_root:
-            media_root = os.path.join(os.path.dirname(args.weibo_json), "")
-        img_root = os.path.join(media_root, "img")
-        vid_root = os.path.join(media_root, "video")
-
-        # Prefer embedded media mapping in JSON if present
-        media = post.get("media") or {}
-        if not image_path:
-            media_imgs = media.get("original_pictures") or []
-            if media_imgs:
-                image_path = media_imgs[0].get("path")
-        if not video_path:
-            media_vids = media.get("video") or []
-            if media_vids:
-                video_path = media_vids[0].get("path")
-
-        pics = post.get("original_pictures")
-        if pics and pics != "无" and not image_path:
-            urls = [u.strip() for u in pics.split(",") if u.strip()]
-            bases = [os.path.basename(u) for u in urls]
-            local_imgs = _find_by_basename(img_root, bases)
-            if local_imgs and args.prefer_local_media:
-                image_path = local_imgs[0]
-            elif not args.no_download_media:
-                dl_imgs = _download_media(urls[: args.max_images], ".jpg")
-                if dl_imgs:
-                    image_path = dl_imgs[0]
-
-        vurl = post.get("video_url")
-        if vurl and vurl != "无" and not video_path:
-            base = os.path.basename(vurl)
-            local_vids = _find_by_basename(vid_root, [base])
-            if local_vids and args.prefer_local_media:
-                video_path = local_vids[0]
-            elif not args.no_download_media:
-                dl_vids = _download_media([vurl], ".mp4")
-                if dl_vids:
-                    video_path = dl_vids[0]
-
-    if not text:
-        raise SystemExit("No text provided. Use --text or --weibo-json.")
-
-    images, videos = _gather_media_paths(image_path, video_path, args.max_images)
-
-    from vllm import LLM, SamplingParams  # import after env is set
-    from vllm.sampling_params import StructuredOutputsParams
-
-    llm = LLM(
-        model=model_path,
-        trust_remote_code=True,
-        max_model_len=args.max_model_len,
-        gpu_memory_utilization=args.gpu_memory_utilization,
+    parser.add_argument(
+        "--backend",
+        choices=["vllm", "openai", "fake"],
+        default="vllm",
+        help="In-process vLLM, an already running OpenAI-compatible server, or 'fake' (tests only)",
     )
-    sampling_params = SamplingParams(
-        temperature=args.temperature,
-        max_tokens=args.max_tokens,
-        structured_outputs=StructuredOutputsParams(json=SCHEMA_JSON),
+    parser.add_argument("--api-base", default="http://127.0.0.1:8000/v1", help="Server URL for --backend openai")
+    parser.add_argument("--api-key", default="", help="Bearer token for --backend openai (default: $OPENAI_API_KEY)")
+    parser.add_argument("--served-model-name", default="", help="Model name the server expects (default: --model)")
+    parser.add_argument("--remote-media", choices=MEDIA_MODES, default="data")
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Load the engine once and answer --daemon requests on --socket until stopped",
     )
+    parser.add_argument("--daemon", action="store_true", help="Send the post to a running --serve engine")
+    parser.add_argument("--stop-daemon", action="store_true", help="Ask the running --serve engine to exit")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket of the resident engine")
 
-    user_text = build_user_text(text, post_id)
-
-    messages: list[dict] = [
-        {
-            "role": "system",
-            "content": "Return ONLY valid JSON. Do not include any extra text.",
-        },
-        {
-            "role": "user",
-            "content": (
-                [{"type": "image", "image": _as_file_uri(path)} for path in images]
-                + [{"type": "video", "video": _as_file_uri(path)} for path in videos]
-                + [{"type": "text", "text": user_text}]
-            ),
-        }
-    ]
-
-    processor = AutoProcessor.from_pretrained(model_path, trust_remote_code=True)
-    prompt = processor.apply_chat_template(
-        messages, tokenize=False, add_generation_prompt=True, enable_thinking=False
-    )
-    image_inputs, video_inputs, video_kwargs = process_vision_info(
-        messages,
-        image_patch_size=processor.image_processor.patch_size,
-        return_video_kwargs=True,
-        return_video_metadata=True,
+    args = parser.parse_args()
+    if sum((args.serve, args.daemon, args.stop_daemon)) > 1:
+        parser.error("--serve, --daemon and --stop-daemon are mutually exclusive")
+    if args.num_samples < 1:
+        parser.error("--num-samples must be >= 1")
+    if args.num_samples > 1 and args.temperature <= 0:
+        parser.error("--num-samples > 1 needs --temperature > 0 (greedy samples are identical)")
+    if args.prefer_local_media:
+        print("[warn] --prefer-local-media is deprecated and has no effect", file=sys.stderr)
+    # Flags the user actually gave; only these are forwarded to (or checked against) a daemon.
+    explicit = {name for name, value in vars(args).items() if value != parser.get_default(name)}
+    if args.daemon:
+        engine_only = sorted(explicit & set(_ENGINE_ONLY))
+        if engine_only:
+            flags = ", ".join("--" + name.replace("_", "-") for name in engine_only)
+            parser.error(f"{flags} only apply when the engine loads; pass them to --serve instead")
+
+    if args.stop_daemon:
+        try:
+            daemon_request({"op": "shutdown"}, args.socket, timeout_s=10.0)
+        except OSError as exc:
+            raise SystemExit(f"No engine listening on {args.socket} ({exc})")
+        print(f"[daemon] stop requested on {args.socket}", file=sys.stderr)
+        return 0
+
+    post: dict = {}
+    media_root = ""
+    if not args.serve:
+        post, media_root = _build_post(args)
+
+    if args.daemon:
+        try:
+            response = daemon_request(_daemon_payload(args, explicit, post, media_root), args.socket)
+        except OSError as exc:
+            raise SystemExit(f"No engine listening on {args.socket} ({exc}); start one with --serve")
+        if not response.get("ok"):
+            raise SystemExit(f"Daemon error: {response.get('error')}")
+        record = response["record"]
+        print(f"[daemon] {args.socket} elapsed={response.get('elapsed_s', 0.0)}s", file=sys.stderr)
+    else:
+        downloader = None if args.no_download_media else MediaDownloader(cache_dir=args.media_cache_dir)
+        engine = ExtractionEngine.load(
+            EngineConfig.from_args(args),
+            max_images=args.max_images,
+            downloader=downloader,
+            skip_videos=args.skip_videos,
+            prompt_layout=args.prompt_layout,
+            batch_size=1,
+            vote_threshold=args.vote_threshold,
+        )
+        with engine:
+            if args.serve:
+                serve(engine, args.socket)
+                return 0
+            record = engine.extract(post, media_root)
+
+    if record.get("error"):
+        raise SystemExit(f"Extraction failed: {record['error']}")
+    media_used = record.get("media_used") or {}
+    print(
+        f"[media] images={len(media_used.get('images', []))} videos={len(media_used.get('videos', []))}",
+        file=sys.stderr,
     )
-    mm_data: dict = {}
-    if image_inputs is not None:
-        mm_data["image"] = image_inputs
-    if video_inputs is not None:
-        mm_data["video"] = video_inputs
-
-    inputs = [
-        {
-            "prompt": prompt,
-            "multi_modal_data": mm_data,
-            "mm_processor_kwargs": video_kwargs,
-        }
-    ]
-
-    outputs = llm.generate(inputs, sampling_params)
-    text_out = ""
-    if outputs and outputs[0].outputs:
-        text_out = outputs[0].outputs[0].text.strip()
-    if not text_out:
-        # Fall back to any available text pieces for debugging.
-        pieces = []
-        for out in outputs or []:
-            for cand in out.outputs:
-                if cand.text:
-                    pieces.append(cand.text)
-        text_out = "".join(pieces).strip()
-
-    # Normalize to pretty JSON if possible.
-    try:
-        parsed = json.loads(text_out)
-        text_out = json.dumps(parsed, ensure_ascii=False, indent=2)
-    except json.JSONDecodeError:
-        pass
+    if record.get("consensus"):
+        print(f"[vote] {json.dumps(record['consensus'], ensure_ascii=False)}", file=sys.stderr)
+    extraction = record["extraction"]
+    if isinstance(extraction, dict) and "_raw" in extraction:
+        text_out = extraction["_raw"]
+    else:
+        text_out = json.dumps(extraction, ensure_ascii=False, indent=2)
 
     if args.output:
-        if not os.path.exists(args.output):
-            os.makedirs(os.path.dirname(args.output), exist_ok=True)
+        out_dir = os.path.dirname(args.output)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
         with open(args.output, "w", encoding="utf-8") as f:
             f.write(text_out)
     else:
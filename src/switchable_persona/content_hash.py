@@ -0,0 +1,40 @@
+"""Memoised sha256 of local files, keyed by path, size and mtime.
+
+Caches that key entries by media content (``image_cache``, ``result_cache``)
+hash the same files over and over; the memo makes repeated lookups a stat.
+It keeps the ``max_entries`` most recently used digests, so a long run over
+millions of files does not grow it without bound.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+class FileDigests:
+    def __init__(self, max_entries: int = 100_000) -> None:
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._digests: OrderedDict[tuple[str, int, int], str] = OrderedDict()
+
+    def sha256(self, path: str) -> str:
+        st = os.stat(path)
+        memo_key = (path, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            digest = self._digests.get(memo_key)
+            if digest is not None:
+                self._digests.move_to_end(memo_key)
+                return digest
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with self._lock:
+            self._digests[memo_key] = digest
+            if len(self._digests) > self.max_entries:
+                self._digests.popitem(last=False)
+        return digest
@@ -0,0 +1,130 @@
+"""Size accounting and LRU eviction for on-disk caches.
+
+Cache entries are plain files under one directory tree. Readers refresh an
+entry's mtime on every hit, so evicting the oldest mtimes first gives LRU.
+Files still being written (``*.part*`` / ``*.tmp*``) are never evicted, nor
+are pinned paths (handed to a caller that has not finished reading them).
+
+Several processes (shards, nodes on a shared filesystem) may evict from the
+same tree, so a pin is also an empty marker file ``<path>.pin.<owner>`` that
+every ``DiskQuota`` on that tree honours. A marker older than
+``PIN_LEASE_S`` is taken to be left behind by a process that died, and is
+removed by the next eviction.
+"""
+
+from __future__ import annotations
+
+import os
+import socket
+import threading
+import time
+from typing import Optional
+
+PIN_MARK = ".pin."
+PIN_LEASE_S = 3600.0
+
+
+def _is_partial(name: str) -> bool:
+    return ".part" in name or ".tmp" in name
+
+
+class DiskQuota:
+    def __init__(self, root: str, max_bytes: int, low_water: float = 0.9) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._bytes: Optional[int] = None
+        self._pins: dict[str, int] = {}
+        # Unique per instance, so two quotas on one tree never share a marker.
+        self._owner = f"{socket.gethostname()}.{os.getpid()}.{id(self):x}"
+
+    def pin(self, path: str) -> None:
+        """Keep ``path`` (which need not exist yet) from eviction until a matching ``unpin``; pins nest."""
+        with self._lock:
+            count = self._pins.get(path, 0)
+            self._pins[path] = count + 1
+            if count == 0:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                open(path + PIN_MARK + self._owner, "wb").close()
+
+    def unpin(self, path: str) -> None:
+        with self._lock:
+            count = self._pins.pop(path, 0) - 1
+            if count > 0:
+                self._pins[path] = count
+            elif count == 0:
+                try:
+                    os.remove(path + PIN_MARK + self._owner)
+                except OSError:
+                    pass
+
+    def _scan(self) -> tuple[list[tuple[float, int, str]], set[str]]:
+        """``(entries, pinned)``: ``(mtime, size, path)`` of each entry, and the paths under a live pin marker."""
+        entries = []
+        pinned: set[str] = set()
+        expired = time.time() - PIN_LEASE_S
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if PIN_MARK in name:
+                    try:
+                        if os.stat(path).st_mtime >= expired:
+                            pinned.add(path.rsplit(PIN_MARK, 1)[0])
+                        else:
+                            os.remove(path)
+                    except OSError:
+                        pass
+                    continue
+                if _is_partial(name):
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries, pinned
+
+    def add(self, nbytes: int, replaced: int = 0) -> None:
+        """Account for an entry of ``nbytes`` and evict down to the low-water mark if over quota.
+
+        ``replaced`` is the size of the file the entry overwrote, if any.
+        """
+        with self._lock:
+            if self._bytes is None:
+                # First write this process: the new file is already on disk.
+                self._bytes = sum(size for _, size, _ in self._scan()[0])
+            else:
+                self._bytes += nbytes - replaced
+            if self._bytes <= self.max_bytes:
+                return
+            target = int(self.max_bytes * self.low_water)
+            entries, pinned = self._scan()
+            for _, size, path in sorted(entries):
+                if self._bytes <= target:
+                    break
+                if path in self._pins or path in pinned:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                self._bytes -= size
+                self.evicted += 1
+
+
+def file_size(path: str) -> int:
+    """Size of ``path``, 0 if it does not exist (what an overwrite of it replaces)."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def touch(path: str) -> None:
+    """Mark a cache entry as recently used."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
@@ -0,0 +1,437 @@
+"""Export extraction records to columnar Parquet (or Arrow IPC) tables.
+
+Statistics over the whole corpus (tone/emotion/stance counts per user or per
+month) otherwise mean parsing every nested JSON line in Python. This flattens
+``SCHEMA_JSON`` once into typed tables that vectorised readers (pyarrow,
+DuckDB, polars, pandas) scan in seconds:
+
+  posts            one row per post: meta, emotion, confidences, topic,
+                   catchphrases/signature_patterns, child-row counts
+  tones            (post_id, tone)
+  stance_targets   (post_id, idx, target, position, evidence, confidence)
+  reasoning        (post_id, idx, target, opinion, intent, evidence, confidence)
+  knowledge_facts  (post_id, idx, fact, evidence, confidence)
+  safety_terms     (post_id, idx, term, replacement)
+
+``tone`` and ``emotion`` are dictionary-encoded over the schema enums (the
+same dictionary in every row group); values outside the enum become null.
+Posts whose output did not parse keep their ``posts`` row (``parsed`` false)
+and have no child rows. A post_id that occurs more than once (a resumed run
+that re-wrote it, overlapping inputs) is exported once, from its last record;
+a first pass over the inputs finds which one that is.
+
+Input is read as a stream and written one row group (``--row-group-size``
+posts, plus their child rows) at a time, so memory stays flat on the full
+corpus. Inputs are JSONL outputs/shards or an ``extraction_store.py`` SQLite
+file.
+
+Needs pyarrow (``pip install -e '.[export]'``).
+
+Usage:
+  python3 scripts/export_parquet.py --input processed_data/extractions.jsonl --output-dir processed_data/parquet
+  python3 scripts/export_parquet.py --input processed_data/extractions.sqlite --format arrow
+  python3 scripts/export_parquet.py --summary --output-dir processed_data/parquet
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from typing import Any, Iterable, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    raise SystemExit("export_parquet.py needs pyarrow: pip install -e '.[export]'")
+
+from .extraction import SCHEMA_JSON
+
+DEFAULT_OUTPUT_DIR = "processed_data/parquet"
+EXPORT_FORMATS = ("parquet", "arrow")
+
+_STYLE = SCHEMA_JSON["properties"]["style"]["properties"]
+TONES: list[str] = _STYLE["tone"]["items"]["enum"]
+EMOTIONS: list[str] = _STYLE["emotion"]["enum"]
+
+_STRINGS = pa.list_(pa.string())
+_ENUM = pa.dictionary(pa.int8(), pa.string())
+
+
+SCHEMAS: dict[str, pa.Schema] = {
+    "posts": pa.schema(
+        [
+            ("post_id", pa.string()),
+            ("weibo_json", pa.string()),
+            ("publish_time", pa.timestamp("s")),
+            ("created_at", pa.timestamp("us", tz="UTC")),
+            ("model", pa.string()),
+            ("parsed", pa.bool_()),
+            ("emotion", _ENUM),
+            ("style_confidence", pa.float32()),
+            ("catchphrases", _STRINGS),
+            ("signature_patterns", _STRINGS),
+            ("safety_confidence", pa.float32()),
+            ("topic_trigger", pa.string()),
+            ("topic_summary", pa.string()),
+            ("topic_confidence", pa.float32()),
+            ("tone_count", pa.int16()),
+            ("stance_target_count", pa.int16()),
+            ("reasoning_count", pa.int16()),
+            ("knowledge_fact_count", pa.int16()),
+            ("safety_term_count", pa.int16()),
+            ("image_count", pa.int16()),
+            ("video_count", pa.int16()),
+        ]
+    ),
+    "tones": pa.schema([("post_id", pa.string()), ("tone", _ENUM)]),
+    "stance_targets": pa.schema(
+        [
+            ("post_id", pa.string()),
+            ("idx", pa.int16()),
+            ("target", pa.string()),
+            ("position", pa.string()),
+            ("evidence", _STRINGS),
+            ("confidence", pa.float32()),
+        ]
+    ),
+    "reasoning": pa.schema(
+        [
+            ("post_id", pa.string()),
+            ("idx", pa.int16()),
+            ("target", pa.string()),
+            ("opinion", pa.string()),
+            ("intent", pa.string()),
+            ("evidence", _STRINGS),
+            ("confidence", pa.float32()),
+        ]
+    ),
+    "knowledge_facts": pa.schema(
+        [
+            ("post_id", pa.string()),
+            ("idx", pa.int16()),
+            ("fact", pa.string()),
+            ("evidence", _STRINGS),
+            ("confidence", pa.float32()),
+        ]
+    ),
+    "safety_terms": pa.schema(
+        [
+            ("post_id", pa.string()),
+            ("idx", pa.int16()),
+            ("term", pa.string()),
+            ("replacement", pa.string()),
+        ]
+    ),
+}
+_DICTIONARIES = {("posts", "emotion"): EMOTIONS, ("tones", "tone"): TONES}
+
+
+def _number(value: Any) -> Optional[float]:
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def _string(value: Any) -> Optional[str]:
+    return value if isinstance(value, str) else None
+
+
+def _strings(value: Any) -> list[str]:
+    return [item for item in value if isinstance(item, str)] if isinstance(value, list) else []
+
+
+def _objects(value: Any) -> list[dict]:
+    return [item for item in value if isinstance(item, dict)] if isinstance(value, list) else []
+
+
+def _publish_time(value: Any) -> Optional[datetime]:
+    """Crawler ``publish_time`` (``YYYY-MM-DD HH:MM``, sometimes with seconds or date only)."""
+    if not isinstance(value, str):
+        return None
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value.strip(), fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _created_at(value: Any) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(value) if isinstance(value, str) else None
+    except ValueError:
+        return None
+
+
+class _RowGroup:
+    """Column lists of every table for the posts buffered since the last flush."""
+
+    def __init__(self) -> None:
+        self.columns = {name: {field.name: [] for field in schema} for name, schema in SCHEMAS.items()}
+        self.posts = 0
+
+    def _row(self, table: str, **values: Any) -> None:
+        for name, column in self.columns[table].items():
+            column.append(values.get(name))
+
+    def add(self, post_id: str, line: dict) -> None:
+        meta = line.get("meta") or {}
+        result = line.get("result") or {}
+        extraction = result.get("extraction")
+        parsed = isinstance(extraction, dict) and "_raw" not in extraction
+        extraction = extraction if parsed else {}
+        style = extraction.get("style") or {}
+        safety = extraction.get("safety_rewrite") or {}
+        stance = extraction.get("stance") or {}
+        topic = extraction.get("topic") or {}
+        media_used = result.get("media_used") or {}
+
+        tones = list(dict.fromkeys(_strings(style.get("tone"))))
+        targets = _objects(stance.get("targets"))
+        reasoning = _objects(stance.get("reasoning"))
+        facts = _objects(extraction.get("knowledge_facts"))
+        terms = _objects(safety.get("terms"))
+
+        self._row(
+            "posts",
+            post_id=post_id,
+            weibo_json=_string(meta.get("weibo_json")),
+            publish_time=_publish_time(meta.get("publish_time")),
+            created_at=_created_at(meta.get("created_at")),
+            model=_string(meta.get("model")),
+            parsed=parsed,
+            emotion=_string(style.get("emotion")),
+            style_confidence=_number(style.get("confidence")),
+            catchphrases=_strings(style.get("catchphrases")),
+            signature_patterns=_strings(style.get("signature_patterns")),
+            safety_confidence=_number(safety.get("confidence")),
+            topic_trigger=_string(topic.get("trigger")),
+            topic_summary=_string(topic.get("one_sentence_summary")),
+            topic_confidence=_number(topic.get("confidence")),
+            tone_count=len(tones),
+            stance_target_count=len(targets),
+            reasoning_count=len(reasoning),
+            knowledge_fact_count=len(facts),
+            safety_term_count=len(terms),
+            image_count=len(media_used.get("images") or []),
+            video_count=len(media_used.get("videos") or []),
+        )
+        for tone in tones:
+            self._row("tones", post_id=post_id, tone=tone)
+        for idx, item in enumerate(targets):
+            self._row(
+                "stance_targets",
+                post_id=post_id,
+                idx=idx,
+                target=_string(item.get("target")),
+                position=_string(item.get("position")),
+                evidence=_strings(item.get("evidence")),
+                confidence=_number(item.get("confidence")),
+            )
+        for idx, item in enumerate(reasoning):
+            self._row(
+                "reasoning",
+                post_id=post_id,
+                idx=idx,
+                target=_string(item.get("target")),
+                opinion=_string(item.get("opinion")),
+                intent=_string(item.get("intent")),
+                evidence=_strings(item.get("evidence")),
+                confidence=_number(item.get("confidence")),
+            )
+        for idx, item in enumerate(facts):
+            self._row(
+                "knowledge_facts",
+                post_id=post_id,
+                idx=idx,
+                fact=_string(item.get("fact")),
+                evidence=_strings(item.get("evidence")),
+                confidence=_number(item.get("confidence")),
+            )
+        for idx, item in enumerate(terms):
+            self._row(
+                "safety_terms",
+                post_id=post_id,
+                idx=idx,
+                term=_string(item.get("term")),
+                replacement=_string(item.get("replacement")),
+            )
+        self.posts += 1
+
+    def table(self, name: str) -> pa.Table:
+        schema = SCHEMAS[name]
+        arrays = []
+        for field in schema:
+            values = self.columns[name][field.name]
+            enum = _DICTIONARIES.get((name, field.name))
+            if enum is not None:
+                # A fixed dictionary (the schema enum) keeps codes stable across
+                # row groups; Arrow IPC files require that.
+                codes = {value: code for code, value in enumerate(enum)}
+                indices = pa.array([codes.get(value) for value in values], type=pa.int8())
+                arrays.append(pa.DictionaryArray.from_arrays(indices, pa.array(enum, type=pa.string())))
+            else:
+                arrays.append(pa.array(values, type=field.type))
+        return pa.Table.from_arrays(arrays, schema=schema)
+
+
+class ColumnarExporter:
+    """Streams records into one Parquet/Arrow file per table, a row group per ``row_group_size`` posts."""
+
+    def __init__(self, output_dir: str, export_format: str = "parquet", row_group_size: int = 50000) -> None:
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"unknown export format: {export_format}")
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.export_format = export_format
+        self.row_group_size = row_group_size
+        self.posts = 0
+        self.row_groups = 0
+        self.rows = {name: 0 for name in SCHEMAS}
+        self._group = _RowGroup()
+        self._writers = {name: self._open(name, schema) for name, schema in SCHEMAS.items()}
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.output_dir, f"{name}.{self.export_format}")
+
+    def _open(self, name: str, schema: pa.Schema) -> Any:
+        if self.export_format == "parquet":
+            return pq.ParquetWriter(self.path(name), schema, compression="zstd")
+        return pa.ipc.new_file(self.path(name), schema)
+
+    def add(self, post_id: str, line: dict) -> None:
+        self._group.add(post_id, line)
+        if self._group.posts >= self.row_group_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._group.posts:
+            return
+        for name, writer in self._writers.items():
+            table = self._group.table(name)
+            self.rows[name] += table.num_rows
+            # One row group per flush, also in the child tables (row_group_size
+            # counts rows, and a child group can hold more rows than posts).
+            if self.export_format == "parquet":
+                writer.write_table(table, row_group_size=max(table.num_rows, 1))
+            else:
+                writer.write_table(table)
+        self.posts += self._group.posts
+        self.row_groups += 1
+        self._group = _RowGroup()
+
+    def close(self) -> None:
+        self.flush()
+        for writer in self._writers.values():
+            writer.close()
+
+    def summary(self) -> str:
+        size = sum(os.path.getsize(self.path(name)) for name in SCHEMAS if os.path.isfile(self.path(name)))
+        rows = " ".join(f"{name}={count}" for name, count in self.rows.items() if name != "posts")
+        return f"posts={self.posts} row_groups={self.row_groups} bytes={size} {rows}"
+
+
+def iter_records(path: str) -> Iterable[tuple[str, dict]]:
+    """``(post_id, line)`` from a JSONL output or an ``extraction_store.py`` SQLite file."""
+    if path.endswith((".sqlite", ".db")):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            for post_id, record in conn.execute("SELECT post_id, record FROM records ORDER BY post_id"):
+                yield post_id, json.loads(record)
+        finally:
+            conn.close()
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            post_id = (record.get("meta") or {}).get("post_id") if isinstance(record, dict) else None
+            if post_id:
+                yield post_id, record
+
+
+def last_occurrences(paths: list[str]) -> dict[str, int]:
+    """Position (over all inputs, in order) of the last record of each post_id."""
+    last: dict[str, int] = {}
+    position = 0
+    for path in paths:
+        for post_id, _ in iter_records(path):
+            last[post_id] = position
+            position += 1
+    return last
+
+
+def summarize(output_dir: str, export_format: str = "parquet") -> None:
+    """Emotion and tone distributions, read back column-wise (a smoke test of the export)."""
+
+    def read(name: str, columns: list[str]) -> pa.Table:
+        path = os.path.join(output_dir, f"{name}.{export_format}")
+        if export_format == "parquet":
+            return pq.read_table(path, columns=columns)
+        with pa.memory_map(path) as source:
+            return pa.ipc.open_file(source).read_all().select(columns)
+
+    started = time.perf_counter()
+    posts = read("posts", ["emotion", "parsed"])
+    tones = read("tones", ["tone"])
+    emotions = pc.value_counts(posts["emotion"].combine_chunks().dictionary_decode())
+    tone_counts = pc.value_counts(tones["tone"].combine_chunks().dictionary_decode())
+    parsed = pc.sum(posts["parsed"]).as_py() or 0
+
+    def fmt(counts: pa.StructArray) -> str:
+        pairs = sorted(((c["counts"], c["values"]) for c in counts.to_pylist()), key=lambda p: -p[0])
+        return ",".join(f"{value}:{count}" for count, value in pairs)
+
+    print(f"[summary] posts={posts.num_rows} parsed={parsed} tone_rows={tones.num_rows}", file=sys.stderr)
+    print(f"[summary] emotion {fmt(emotions)}", file=sys.stderr)
+    print(f"[summary] tone {fmt(tone_counts)}", file=sys.stderr)
+    print(f"[summary] read+aggregate {time.perf_counter() - started:.2f}s", file=sys.stderr)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Export extraction records to columnar Parquet/Arrow tables")
+    parser.add_argument("--input", nargs="*", default=[], help="JSONL outputs/shards or an extraction store (.sqlite)")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="parquet")
+    parser.add_argument("--row-group-size", type=int, default=50000, help="Posts per row group")
+    parser.add_argument("--summary", action="store_true", help="Print emotion/tone counts from the exported tables")
+    args = parser.parse_args()
+    if not args.input and not args.summary:
+        parser.error("nothing to do: give --input and/or --summary")
+    if args.row_group_size < 1:
+        parser.error("--row-group-size must be >= 1")
+
+    if args.input:
+        started = time.perf_counter()
+        last = last_occurrences(args.input)
+        exporter = ColumnarExporter(args.output_dir, args.format, args.row_group_size)
+        position = duplicates = 0
+        try:
+            for path in args.input:
+                for post_id, line in iter_records(path):
+                    if last[post_id] == position:
+                        exporter.add(post_id, line)
+                    else:
+                        duplicates += 1
+                    position += 1
+        finally:
+            exporter.close()
+        print(
+            f"[export] {args.format} -> {args.output_dir} {exporter.summary()} "
+            f"superseded_duplicates={duplicates} elapsed={time.perf_counter() - started:.1f}s",
+            file=sys.stderr,
+        )
+    if args.summary:
+        summarize(args.output_dir, args.format)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
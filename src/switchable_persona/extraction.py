@@ -0,0 +1,1390 @@
+"""Resident extraction engine shared by the extraction scripts.
+
+Everything that turns one weibo post into a structured extraction lives here:
+the schema and prompt, media resolution, request preparation, generation and
+output parsing. ``ExtractionEngine`` keeps the backend (model weights,
+processor) loaded across calls:
+
+  engine = ExtractionEngine.load(EngineConfig(backend="vllm", model=DEFAULT_MODEL))
+  record = engine.extract(post, media_root)                  # one post
+  for record in engine.extract_many(posts_with_media_roots):  # batched
+      ...
+
+``scripts/extract_all_weibo.py`` drives ``prepare``/``generate`` from its
+threaded pipeline; ``scripts/test_single_post_extract.py`` calls ``extract``.
+
+Loading an 8B model takes minutes, a single post seconds, so the engine can
+also run as a local daemon on a Unix socket (``serve``). Clients send one JSON
+request per connection with ``daemon_request``:
+
+  {"post": {...}, "media_root": "...",   ->  {"ok": true, "record": {...}}
+   "options": {...}, "sampling": {...}}
+  {"op": "ping"}                        ->  {"ok": true, "model": ..., "served": N, ...}
+  {"op": "shutdown"}                    ->  {"ok": true}
+
+``options`` (``ExtractionEngine.CALL_OPTIONS``) apply to that request only.
+Sampling is fixed when the engine loads; ``sampling`` lists the
+``EngineConfig`` values the client expects, and a mismatch is an error
+rather than a silently different extraction.
+
+Usage:
+  python3 scripts/test_single_post_extract.py --serve &
+  python3 scripts/test_single_post_extract.py --daemon --weibo-json weibo/<user>/<user>.json
+"""
+
+from __future__ import annotations
+
+import ctypes
+import json
+import os
+import site
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, fields
+from typing import Any, Iterable, Iterator, Optional
+
+from .image_cache import ImageCache
+from .inference_backend import (
+    LocalEngineBackend,
+    OpenAIChatBackend,
+    completion_token_count,
+    finish_reason,
+    prompt_token_count,
+)
+from .media_downloader import MediaDownloader
+from .length_scheduler import TokenEstimator
+from .media_index import find_media
+from .repair_queue import repair_reason
+from .result_cache import ResultCache
+from .stage_metrics import timed
+from .video_probe import VideoProbeTable, referenced_videos
+
+DEFAULT_MODEL = "~/models/Qwen/Qwen3-VL-8B-Thinking"
+
+SCHEMA_HINT = {
+    "post_id": "string",
+    "style": {
+        "catchphrases": ["string"],
+        "signature_patterns": ["string"],
+        "tone": ["e.g. formal", "casual", "celebratory", "persuasive"],
+        "emotion": "one of: joy|trust|fear|surprise|sadness|disgust|anger|anticipation",
+        "evidence": ["text span or visual cue"],
+        "confidence": 0.0,
+    },
+    "safety_rewrite": {
+        "terms": [{"term": "string", "replacement": "string"}],
+        "evidence": ["text span"],
+        "confidence": 0.0,
+    },
+    "stance": {
+        "targets": [
+            {
+                "target": "string",
+                "position": "support|oppose|neutral",
+                "evidence": ["text span or visual cue"],
+                "confidence": 0.0,
+            }
+        ],
+        "reasoning": [
+            {
+                "target": "string",
+                "opinion": "string",
+                "intent": "string",
+                "evidence": ["text span or visual cue"],
+                "confidence": 0.0,
+            }
+        ],
+    },
+    "topic": {
+        "trigger": "string",
+        "one_sentence_summary": "string",
+        "evidence": ["text span or visual cue"],
+        "confidence": 0.0,
+    },
+    "knowledge_facts": [
+        {"fact": "string", "evidence": ["text span"], "confidence": 0.0}
+    ],
+}
+
+SCHEMA_JSON = {
+    "type": "object",
+    "additionalProperties": False,
+    "required": ["post_id", "style", "safety_rewrite", "stance", "topic", "knowledge_facts"],
+    "properties": {
+        "post_id": {"type": "string"},
+        "style": {
+            "type": "object",
+            "additionalProperties": False,
+            "required": [
+                "catchphrases",
+                "signature_patterns",
+                "tone",
+                "emotion",
+                "evidence",
+                "confidence",
+            ],
+            "properties": {
+                "catchphrases": {"type": "array", "items": {"type": "string"}},
+                "signature_patterns": {"type": "array", "items": {"type": "string"}},
+                "tone": {
+                    "type": "array",
+                    "items": {
+                        "type": "string",
+                        "enum": [
+                            "formal",
+                            "casual",
+                            "celebratory",
+                            "persuasive",
+                            "objective",
+                            "humorous",
+                            "sarcastic",
+                            "empathetic",
+                            "authoritative",
+                            "promotional",
+                            "instructional",
+                            "narrative",
+                            "urgent",
+                            "reflective",
+                        ],
+                    },
+                },
+                "emotion": {
+                    "type": "string",
+                    "enum": [
+                        "joy",
+                        "trust",
+                        "fear",
+                        "surprise",
+                        "sadness",
+                        "disgust",
+                        "anger",
+                        "anticipation",
+                        "none",
+                    ],
+                },
+                "evidence": {"type": "array", "items": {"type": "string"}},
+                "confidence": {"type": "number"},
+            },
+        },
+        "safety_rewrite": {
+            "type": "object",
+            "additionalProperties": False,
+            "required": ["terms", "evidence", "confidence"],
+            "properties": {
+                "terms": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "additionalProperties": False,
+                        "required": ["term", "replacement"],
+                        "properties": {
+                            "term": {"type": "string"},
+                            "replacement": {"type": "string"},
+                        },
+                    },
+                },
+                "evidence": {"type": "array", "items": {"type": "string"}},
+                "confidence": {"type": "number"},
+            },
+        },
+        "stance": {
+            "type": "object",
+            "additionalProperties": False,
+            "required": ["targets", "reasoning"],
+            "properties": {
+                "targets": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "additionalProperties": False,
+                        "required": ["target", "position", "evidence", "confidence"],
+                        "properties": {
+                            "target": {"type": "string"},
+                            "position": {"type": "string"},
+                            "evidence": {"type": "array", "items": {"type": "string"}},
+                            "confidence": {"type": "number"},
+                        },
+                    },
+                },
+                "reasoning": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "additionalProperties": False,
+                        "required": [
+                            "target",
+                            "opinion",
+                            "intent",
+                            "evidence",
+                            "confidence",
+                        ],
+                        "properties": {
+                            "target": {"type": "string"},
+                            "opinion": {"type": "string"},
+                            "intent": {"type": "string"},
+                            "evidence": {"type": "array", "items": {"type": "string"}},
+                            "confidence": {"type": "number"},
+                        },
+                    },
+                },
+            },
+        },
+        "topic": {
+            "type": "object",
+            "additionalProperties": False,
+            "required": ["trigger", "one_sentence_summary", "evidence", "confidence"],
+            "properties": {
+                "trigger": {"type": "string"},
+                "one_sentence_summary": {"type": "string"},
+                "evidence": {"type": "array", "items": {"type": "string"}},
+                "confidence": {"type": "number"},
+            },
+        },
+        "knowledge_facts": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "additionalProperties": False,
+                "required": ["fact", "evidence", "confidence"],
+                "properties": {
+                    "fact": {"type": "string"},
+                    "evidence": {"type": "array", "items": {"type": "string"}},
+                    "confidence": {"type": "number"},
+                },
+            },
+        },
+    },
+}
+
+
+# Post id of the few-shot example in ``INSTRUCTION_TEXT``; never a real post.
+FEW_SHOT_POST_ID = "EXAMPLE1"
+
+# Task instructions and one few-shot alignment example, identical for every
+# post (the stable prefix of the ``prefix`` layout).
+INSTRUCTION_TEXT = (
+    "你是信息抽取器，服务于“基于三层人格架构构建虚拟角色”的长期任务。"
+    "你的输出将直接用于驱动虚拟角色的行为、写作风格与记忆库。"
+    "请基于单条微博（文字+图像/视频）做精确抽取，输出必须为严格 JSON。"
+    "不得输出分析过程或多余文本。\n\n"
+    "核心目标（与你的字段定义直接对应）：\n"
+    "A) style：提取“发帖风格线索”。tone 不是情感极性，必须描述说话语气与风格"
+    "（如 formal/casual/celebratory/persuasive/objective 等），可多选 1-3 个。"
+    "emotion 使用 8 大情绪（joy/trust/fear/surprise/sadness/disgust/anger/anticipation），"
+    "若无明显情绪则为 none。\n"
+    "B) stance：抽取作者对“具体目标对象”的立场与观点，并说明其背后意图。"
+    "必须拆成两层：targets（目标+立场+证据）与 reasoning（观点+意图+证据）。\n"
+    "C) topic：等价于“发帖原因/触发事件/主题”，用于驱动虚拟角色发帖的动机描述，"
+    "要求一句话概括，直接描述“因为什么而发帖”。\n"
+    "D) knowledge_facts：用于构建虚拟角色的“经历/认知/记忆库”。只记录稳定的实体或长期事实"
+    "（人/组织/品牌/物品/长期偏好/价值取向）。不要写一次性事件、短期里程碑或时间点。\n"
+    "E) safety_rewrite：不是审查，而是“表达时可替换的敏感词/表述”（若无则空）。\n\n"
+    "通用抽取原则：\n"
+    "1) 只抽取文本或图像/视频中可直接支持的内容；不要主观脑补。\n"
+    "2) 若某项不存在或不明显，保持为空列表/空字符串，confidence=0。\n"
+    "3) 证据字段必须为原文或视觉线索的最小片段。\n"
+    "4) 不要把“发帖原因”误放入 knowledge_facts；它应归入 topic。\n"
+    "5) knowledge_facts 里只保留“长期可复用的事实/实体”。\n\n"
+    "少样本对齐（仅用于统一任务理解，不是硬性规则）：\n"
+    f"POST_ID: {FEW_SHOT_POST_ID}\n"
+    "TEXT: “比亚迪成为全球首家达成第500万辆新能源汽车下线的车企。这份成绩属于比亚迪，更属于中国汽车品牌。在一起，才是中国汽车。”\n"
+    "正确理解：\n"
+    "- topic = 因“第500万辆下线”而发帖（一次性事件）。\n"
+    "- knowledge_facts = “比亚迪”“中国汽车品牌/行业”等长期实体，不写“第500万辆下线”。\n"
+    "- stance targets 可包含“比亚迪”“中国汽车工业/品牌”。\n"
+    "- style.tone 应为 celebratory/promotional 等风格，不是“积极/消极”。\n"
+    "- emotion 可为 joy/trust（如无明确情绪则 none）。\n\n"
+)
+
+
+def schema_text() -> str:
+    # The compact hint, not SCHEMA_JSON: structured outputs already enforce
+    # the schema, the prompt only has to explain the fields.
+    return (
+        "输出 JSON schema（仅供参考，不要复述）：\n"
+        f"{json.dumps(SCHEMA_HINT, ensure_ascii=False)}\n"
+    )
+
+
+def build_post_text(text: str, post_id: str, media_note: str = "") -> str:
+    media = f"MEDIA: {media_note}\n" if media_note else ""
+    return f"POST_ID: {post_id}\nTEXT: {text}\n{media}\n"
+
+
+def build_user_text(text: str, post_id: str, media_note: str = "") -> str:
+    return INSTRUCTION_TEXT + build_post_text(text, post_id, media_note) + schema_text()
+
+
+def withheld_media_note(num_images: int, num_videos: int) -> str:
+    """Tell the text pass of the cascade that the post has media it cannot see."""
+    parts = []
+    if num_images:
+        parts.append(f"{num_images}张图片")
+    if num_videos:
+        parts.append(f"{num_videos}个视频")
+    if not parts:
+        return ""
+    return f"本条微博附带{'、'.join(parts)}，本轮未提供。仅依据文字抽取，不要推测图像/视频内容。"
+
+
+def build_prefix_text() -> str:
+    """Post-invariant instructions, few-shot example and schema, for the ``prefix`` prompt layout."""
+    return INSTRUCTION_TEXT + schema_text()
+
+
+def as_file_uri(path: str) -> str:
+    if path.startswith(("file://", "http://", "https://", "data:")):
+        return path
+    return f"file://{path}"
+
+
+def ensure_cuda_runtime() -> None:
+    cuda_lib_dirs = []
+    cuda_runtime_lib = None
+    for sp in site.getsitepackages():
+        candidate = os.path.join(sp, "nvidia", "cuda_runtime", "lib")
+        if os.path.isdir(candidate):
+            cuda_lib_dirs.append(candidate)
+            cand_lib = os.path.join(candidate, "libcudart.so.12")
+            if os.path.isfile(cand_lib) and cuda_runtime_lib is None:
+                cuda_runtime_lib = cand_lib
+    if cuda_lib_dirs:
+        existing = os.environ.get("LD_LIBRARY_PATH", "")
+        os.environ["LD_LIBRARY_PATH"] = ":".join(cuda_lib_dirs + ([existing] if existing else []))
+    if cuda_runtime_lib and os.environ.get("CUDA_PRELOAD_DONE") != "1":
+        env = dict(os.environ)
+        env["CUDA_PRELOAD_DONE"] = "1"
+        env["LD_PRELOAD"] = f"{cuda_runtime_lib}:{env.get('LD_PRELOAD', '')}".rstrip(":")
+        os.execve(sys.executable, [sys.executable] + sys.argv, env)
+    if cuda_runtime_lib:
+        try:
+            ctypes.CDLL(cuda_runtime_lib, mode=ctypes.RTLD_GLOBAL)
+        except OSError:
+            pass
+
+
+def select_media_paths(
+    post: dict, media_root: str, max_images: int, downloader: Optional[MediaDownloader]
+) -> tuple[list[str], list[str]]:
+    image_paths: list[str] = []
+    video_paths: list[str] = []
+
+    media = post.get("media") or {}
+    media_imgs = media.get("original_pictures") or []
+    if media_imgs:
+        for item in media_imgs[:max_images]:
+            path = item.get("path")
+            if path and os.path.isfile(path):
+                image_paths.append(path)
+    if not image_paths:
+        pics = post.get("original_pictures")
+        if pics and pics != "无":
+            urls = [u.strip() for u in pics.split(",") if u.strip()]
+            bases = [os.path.basename(u) for u in urls]
+            local_imgs = find_media(media_root, "img", bases)
+            image_paths = local_imgs[:max_images]
+            if not image_paths and downloader is not None:
+                image_paths = downloader.download_many(urls[:max_images], ".jpg")
+
+    video_paths = referenced_videos(post, media_root)
+    if not video_paths and downloader is not None:
+        vurl = post.get("video_url")
+        if vurl and vurl != "无":
+            video_paths = downloader.download_many([vurl], ".mp4")
+
+    return image_paths, video_paths
+
+
+def resolve_media(
+    post: dict,
+    media_root: str,
+    max_images: int,
+    downloader: Optional[MediaDownloader],
+    skip_videos: bool,
+    bad_videos: Any,
+    probe_table: Optional[VideoProbeTable] = None,
+    max_video_seconds: float = 0.0,
+) -> tuple[list[str], list[str]]:
+    """Image and video paths to send for a post; videos the probe table rejects go to ``bad_videos``."""
+    images, videos = select_media_paths(post, media_root, max_images, downloader)
+    if skip_videos:
+        videos = []
+    if probe_table is not None and videos:
+        # Drop videos the pre-flight probe already found broken (or too long)
+        # so the decode-failure retry in prepare_request stays off the hot path.
+        kept: list[str] = []
+        for path in videos:
+            reason = probe_table.rejection(path, max_video_seconds)
+            if reason is None:
+                kept.append(path)
+                continue
+            bad_videos.append(
+                {
+                    "post_id": post.get("id", ""),
+                    "video_path": path,
+                    "error": f"probe: {reason}",
+                    "weibo_media_root": media_root,
+                }
+            )
+        videos = kept
+    return images, videos
+
+
+SYSTEM_PROMPT = "Return ONLY valid JSON. Do not include any extra text."
+
+
+PROMPT_LAYOUTS = ("legacy", "prefix")
+
+
+def prompt_texts(text: str, post_id: str, layout: str, media_note: str = "") -> tuple[str, str]:
+    """Return ``(system_text, user_text)`` for a prompt layout.
+
+    ``legacy`` keeps the original prompt: instructions and schema in the user
+    turn around the post, after the media. ``prefix`` moves every post-invariant
+    part into the system turn so all posts share one token prefix that vLLM's
+    prefix cache can reuse; the user turn holds only the media and the post.
+    """
+    if layout == "prefix":
+        return f"{SYSTEM_PROMPT}\n\n{build_prefix_text()}", build_post_text(text, post_id, media_note)
+    return SYSTEM_PROMPT, build_user_text(text, post_id, media_note)
+
+
+def build_messages(
+    images: list[str], videos: list[str], user_text: str, system_text: str = SYSTEM_PROMPT
+) -> list[dict]:
+    return [
+        {
+            "role": "system",
+            "content": system_text,
+        },
+        {
+            "role": "user",
+            "content": (
+                [{"type": "image", "image": as_file_uri(path)} for path in images]
+                + [{"type": "video", "video": as_file_uri(path)} for path in videos]
+                + [{"type": "text", "text": user_text}]
+            ),
+        },
+    ]
+
+
+def prepare_request(
+    backend: Any,
+    post: dict,
+    media_root: str,
+    max_images: int,
+    downloader: Optional[MediaDownloader],
+    skip_videos: bool,
+    bad_videos: Any,
+    prompt_layout: str = "legacy",
+    probe_table: Optional[VideoProbeTable] = None,
+    max_video_seconds: float = 0.0,
+    result_cache: Optional[ResultCache] = None,
+    text_only: bool = False,
+) -> dict:
+    """Resolve media and build the engine input for one post (no generation).
+
+    On a ``result_cache`` hit the cached output text is returned under
+    ``cached_text`` and the media are not decoded (``input`` is None). Stage
+    timings go to the request's ``timings``. With ``text_only`` (the first
+    pass of ``--cascade``) the resolved media are not sent but returned under
+    ``media_available``, and the prompt says they were withheld.
+    """
+    text = post.get("content", "")
+    post_id = post.get("id", "")
+    timings: dict = {}
+
+    with timed(timings, "media"):
+        images, videos = resolve_media(
+            post, media_root, max_images, downloader, skip_videos, bad_videos, probe_table, max_video_seconds
+        )
+    available = None
+    media_note = ""
+    if text_only:
+        available = {"images": images, "videos": videos}
+        media_note = withheld_media_note(len(images), len(videos))
+        images, videos = [], []
+    system_text, user_text = prompt_texts(text, post_id, prompt_layout, media_note)
+
+    messages = build_messages(images, videos, user_text, system_text)
+    with timed(timings, "template"):
+        prompt = backend.render(messages)
+
+    def cached(prompt: str, videos: list[str]) -> Optional[dict]:
+        if result_cache is None:
+            return None
+        cached_text = result_cache.get(result_cache.key(prompt, images + videos))
+        if cached_text is None:
+            return None
+        return {
+            "post_id": post_id,
+            "images": images,
+            "videos": videos,
+            "input": None,
+            "cached_text": cached_text,
+            "timings": timings,
+            "media_available": available,
+        }
+
+    hit = cached(prompt, videos)
+    if hit is not None:
+        return hit
+    try:
+        with timed(timings, "vision"):
+            engine_input = backend.build_input(messages, prompt)
+    except Exception as exc:
+        # If video decoding fails, retry with images only.
+        if videos:
+            for path in videos:
+                bad_videos.append(
+                    {
+                        "post_id": post_id,
+                        "video_path": path,
+                        "error": str(exc),
+                        "weibo_media_root": media_root,
+                    }
+                )
+            print(f"[warn] video decode failed for post {post_id}: {exc}", file=sys.stderr)
+            videos = []
+            messages = build_messages(images, videos, user_text, system_text)
+            with timed(timings, "template"):
+                prompt = backend.render(messages)
+            hit = cached(prompt, videos)
+            if hit is not None:
+                return hit
+            with timed(timings, "vision"):
+                engine_input = backend.build_input(messages, prompt)
+        else:
+            raise
+
+    return {
+        "post_id": post_id,
+        "images": images,
+        "videos": videos,
+        "input": engine_input,
+        "text": text,
+        # Keyed on the prompt actually sent (videos may have been dropped above).
+        "cache_key": result_cache.key(prompt, images + videos) if result_cache is not None else None,
+        "timings": timings,
+        "media_available": available,
+    }
+
+
+def output_text(output: Any) -> str:
+    text_out = ""
+    if output is not None and output.outputs:
+        text_out = output.outputs[0].text.strip()
+    if not text_out and output is not None:
+        pieces = [cand.text for cand in output.outputs if cand.text]
+        text_out = "".join(pieces).strip()
+    return text_out
+
+
+def parse_output(text_out: str) -> Any:
+    try:
+        return json.loads(text_out)
+    except json.JSONDecodeError:
+        return {"_raw": text_out}
+
+
+# -- multi-post packing ------------------------------------------------------
+
+PACK_SCHEMA_JSON = {
+    "type": "object",
+    "additionalProperties": False,
+    "required": ["extractions"],
+    "properties": {"extractions": {"type": "array", "items": SCHEMA_JSON}},
+}
+# Completion tokens reserved per post in a packed request; with the budget
+# (``max_tokens`` of the packed request) this caps how many posts share one.
+PACK_TOKENS_PER_POST = 400
+
+
+def packed_prompt_texts(posts: list[tuple[str, str]], layout: str) -> tuple[str, str]:
+    """``(system_text, user_text)`` for several ``(text, post_id)`` posts answered in one request.
+
+    Instructions and schema are the single-post ones (so the ``prefix``
+    layout keeps sharing its cached prefix); a note asks for one
+    ``extractions`` element per post, matched by ``post_id``.
+    """
+    note = (
+        f"以下共{len(posts)}条微博，彼此独立，请逐条按上述要求分别抽取。"
+        '输出一个 JSON 对象 {"extractions": [...]}：按输入顺序每条微博一个元素，'
+        "元素的 post_id 必须与该微博的 POST_ID 一致，不得合并或遗漏。\n\n"
+    )
+    body = note + "".join(build_post_text(text, post_id) for text, post_id in posts)
+    if layout == "prefix":
+        return f"{SYSTEM_PROMPT}\n\n{build_prefix_text()}", body
+    return SYSTEM_PROMPT, INSTRUCTION_TEXT + body + schema_text()
+
+
+class PostPacker:
+    """Packs short text-only requests of a batch into multi-post prompts and splits the answers.
+
+    A post is eligible if it is sent without media (and none were withheld by
+    the cascade) and its text has at most ``max_chars`` characters. Eligible
+    posts of a batch are cut into packs of at most ``max_posts``, and at most
+    ``max_tokens // PACK_TOKENS_PER_POST``; ``max_tokens`` is the completion
+    budget of one packed request. Answers for a post that are missing or off
+    schema are not used; the post is then generated on its own
+    (``fallbacks``). Packed answers are not written to the result cache,
+    which is keyed on single-post prompts.
+    """
+
+    def __init__(
+        self,
+        max_posts: int,
+        max_chars: int = 140,
+        max_tokens: int = 4096,
+        prompt_layout: str = "legacy",
+        estimator: Optional[TokenEstimator] = None,
+    ) -> None:
+        self.max_posts = max(2, min(max_posts, max_tokens // PACK_TOKENS_PER_POST))
+        self.max_chars = max_chars
+        self.max_tokens = max_tokens
+        self.prompt_layout = prompt_layout
+        self.estimator = estimator
+        self.packs = 0
+        self.posts = 0
+        self.fallbacks = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.unpacked_prompt_tokens = 0
+        self._sampling_params: Any = None
+
+    def eligible(self, req: dict) -> bool:
+        withheld = req.get("media_available") or {}
+        return (
+            req.get("input") is not None
+            and not req["images"]
+            and not req["videos"]
+            and not withheld.get("images")
+            and not withheld.get("videos")
+            and len(req.get("text", "")) <= self.max_chars
+        )
+
+    def pack(self, requests: list[dict]) -> list[list[dict]]:
+        candidates = [req for req in requests if self.eligible(req)]
+        packs = [candidates[i : i + self.max_posts] for i in range(0, len(candidates), self.max_posts)]
+        return [group for group in packs if len(group) > 1]
+
+    def build_input(self, backend: Any, group: list[dict]) -> dict:
+        system_text, user_text = packed_prompt_texts(
+            [(req["text"], req["post_id"]) for req in group], self.prompt_layout
+        )
+        messages = build_messages([], [], user_text, system_text)
+        return backend.build_input(messages, backend.render(messages))
+
+    def sampling_params(self, backend: Any) -> Any:
+        if self._sampling_params is None:
+            self._sampling_params = backend.sampling_variant(PACK_SCHEMA_JSON, self.max_tokens)
+        return self._sampling_params
+
+    def _unpacked_tokens(self, req: dict) -> int:
+        if req.get("est_tokens"):
+            return req["est_tokens"]
+        return self.estimator.estimate(req["input"]) if self.estimator is not None else 0
+
+    def unpack(
+        self, group: list[dict], engine_input: dict, output: Any, generate_s: float, usage: Optional[dict]
+    ) -> dict[int, Any]:
+        """``{id(req): extraction}`` for the posts the packed output answered usably.
+
+        ``usage`` gets the packed request's actual tokens and, as its estimate,
+        ``engine_input`` estimated as a unit: the posts' own single-post
+        estimates each include the instructions and schema the pack sends once.
+        """
+        prompt = prompt_token_count(output)
+        cached = output.num_cached_tokens or 0
+        completion = completion_token_count(output)
+        self.packs += 1
+        self.posts += len(group)
+        self.prompt_tokens += prompt
+        self.completion_tokens += completion
+        self.unpacked_prompt_tokens += sum(self._unpacked_tokens(req) for req in group)
+        if usage is not None:
+            usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + prompt
+            usage["cached_tokens"] = usage.get("cached_tokens", 0) + cached
+            if self.estimator is not None:
+                estimated = self.estimator.estimate(engine_input)
+            else:
+                estimated = sum(req.get("est_tokens", 0) for req in group)
+            usage["estimated_tokens"] = usage.get("estimated_tokens", 0) + estimated
+        parsed = parse_output(output_text(output))
+        by_id: dict[str, Any] = {}
+        if isinstance(parsed, dict) and finish_reason(output) != "length":
+            for item in parsed.get("extractions") or []:
+                if isinstance(item, dict):
+                    by_id.setdefault(item.get("post_id"), item)
+        answered: dict[int, Any] = {}
+        for req in group:
+            extraction = by_id.get(req["post_id"])
+            if extraction is None or repair_reason(extraction, None, SCHEMA_JSON) is not None:
+                self.fallbacks += 1
+                continue
+            req.setdefault("timings", {})["generate"] = generate_s
+            # The packed request's cost, split evenly over its posts.
+            req["tokens"] = {
+                "prompt": prompt // len(group),
+                "cached": cached // len(group),
+                "completion": completion // len(group),
+            }
+            req["repair_reason"] = None
+            req["pack_size"] = len(group)
+            answered[id(req)] = extraction
+        return answered
+
+    def summary(self) -> str:
+        posts = self.posts or 1
+        packed = self.prompt_tokens / posts
+        unpacked = self.unpacked_prompt_tokens / posts
+        return (
+            f"packs={self.packs} posts={self.posts} fallbacks={self.fallbacks} "
+            f"prompt_tokens/post packed={packed:.0f} unpacked_est={unpacked:.0f} "
+            f"({1 - packed / unpacked if unpacked else 0.0:.1%} fewer) "
+            f"completion_tokens/post={self.completion_tokens / posts:.0f}"
+        )
+
+
+# -- self-consistency voting --------------------------------------------------
+
+# Objects in these arrays are matched across samples by this field.
+VOTE_KEYS = {"terms": "term", "targets": "target", "reasoning": "target", "knowledge_facts": "fact"}
+# Fields whose agreement is reported per record (``[]`` = every element of the array).
+AGREEMENT_FIELDS = (
+    "style.emotion",
+    "style.tone",
+    "stance.targets",
+    "stance.targets[].position",
+    "stance.reasoning",
+    "topic.trigger",
+    "knowledge_facts",
+    "safety_rewrite.terms",
+)
+
+
+def _vote_key(value: Any) -> str:
+    if isinstance(value, str):
+        return value.strip().casefold()
+    return json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+
+class SampleVoter:
+    """Merges the ``n`` samples of one request into one extraction, field by field.
+
+    Only usable samples (``repair_reason`` None) vote. Enums and other
+    scalars take the majority value (ties go to the earliest sample),
+    numbers (the confidences) are averaged, and arrays keep the items found
+    in at least ``threshold`` of the samples; objects in arrays are matched by
+    their ``VOTE_KEYS`` field and merged the same way. The agreement of a
+    field is the share of samples that voted for the winner, or for arrays
+    the mean Jaccard similarity of each sample's items to the merged ones;
+    unlike the model's own ``confidence`` it is measured, so it can be
+    thresholded directly. Records get
+    ``{"samples", "voted", "agreement": {field: ...}}`` under ``consensus``
+    for the ``AGREEMENT_FIELDS`` present.
+    """
+
+    def __init__(self, num_samples: int, threshold: float = 0.5) -> None:
+        self.num_samples = num_samples
+        self.threshold = threshold
+        self.posts = 0
+        self.samples = 0
+        self.voted = 0
+        self.agreement: dict[str, list[float]] = {}
+
+    def _merge(self, values: list, schema: dict, path: str, agreement: dict[str, list[float]]) -> Any:
+        kind = schema.get("type")
+        if kind == "object":
+            merged = {}
+            for key, sub in (schema.get("properties") or {}).items():
+                present = [value[key] for value in values if isinstance(value, dict) and key in value]
+                if present:
+                    merged[key] = self._merge(present, sub, f"{path}.{key}" if path else key, agreement)
+            return merged
+        if kind == "array":
+            return self._merge_array(values, schema.get("items") or {}, path, agreement)
+        if kind in ("number", "integer") and all(isinstance(v, (int, float)) for v in values):
+            mean = sum(values) / len(values)
+            return round(mean, 4) if kind == "number" else round(mean)
+        counts: dict[str, list] = {}
+        for value in values:
+            counts.setdefault(_vote_key(value), []).append(value)
+        # dicts keep insertion order and max() returns the first maximum, so ties go to the earliest sample.
+        winner = max(counts.values(), key=len)
+        agreement.setdefault(path, []).append(len(winner) / len(values))
+        return winner[0]
+
+    def _merge_array(self, values: list, items: dict, path: str, agreement: dict[str, list[float]]) -> list:
+        key_field = VOTE_KEYS.get(path.rsplit(".", 1)[-1]) if items.get("type") == "object" else None
+        groups: dict[str, list] = {}
+        per_sample: list[set[str]] = []
+        for value in values:
+            keys: set[str] = set()
+            for item in value if isinstance(value, list) else []:
+                key = _vote_key(item.get(key_field) if key_field and isinstance(item, dict) else item)
+                if key in keys:
+                    continue
+                keys.add(key)
+                groups.setdefault(key, []).append(item)
+            per_sample.append(keys)
+        kept = {key for key, group in groups.items() if len(group) / len(values) >= self.threshold}
+        agreement.setdefault(path, []).append(
+            sum(len(keys & kept) / len(keys | kept) if keys | kept else 1.0 for keys in per_sample) / len(values)
+        )
+        if key_field is None:
+            return [groups[key][0] for key in groups if key in kept]
+        return [self._merge(groups[key], items, f"{path}[]", agreement) for key in groups if key in kept]
+
+    def vote(self, texts: list[str], finish_reasons: list[Optional[str]]) -> tuple[Any, Optional[str], dict]:
+        """``(extraction, repair_reason, consensus)`` for the sample texts of one request."""
+        parsed = [parse_output(text.strip()) for text in texts]
+        reasons = [repair_reason(value, reason, SCHEMA_JSON) for value, reason in zip(parsed, finish_reasons)]
+        usable = [value for value, reason in zip(parsed, reasons) if reason is None]
+        self.posts += 1
+        self.samples += len(texts)
+        self.voted += len(usable)
+        consensus: dict = {"samples": len(texts), "voted": len(usable)}
+        if not usable:
+            return parsed[0] if parsed else {"_raw": ""}, reasons[0] if reasons else "parse_error", consensus
+        agreement: dict[str, list[float]] = {}
+        merged = self._merge(usable, SCHEMA_JSON, "", agreement)
+        consensus["agreement"] = {
+            field: round(sum(agreement[field]) / len(agreement[field]), 3)
+            for field in AGREEMENT_FIELDS
+            if field in agreement
+        }
+        for field, value in consensus["agreement"].items():
+            self.agreement.setdefault(field, []).append(value)
+        return merged, repair_reason(merged, None, SCHEMA_JSON), consensus
+
+    def summary(self) -> str:
+        posts = self.posts or 1
+        fields = " ".join(
+            f"{field}={sum(values) / len(values):.3f}" for field, values in self.agreement.items() if values
+        )
+        return (
+            f"posts={self.posts} samples/post={self.samples / posts:.1f} "
+            f"usable={self.voted / self.samples if self.samples else 0.0:.1%} threshold={self.threshold} "
+            f"agreement {fields or '-'}"
+        )
+
+
+def generate_batch(
+    backend: Any,
+    prepared: list[dict],
+    usage: Optional[dict] = None,
+    result_cache: Optional[ResultCache] = None,
+    packer: Optional[PostPacker] = None,
+    voter: Optional[SampleVoter] = None,
+) -> list[dict]:
+    """Submit prepared requests in one ``generate`` call and map outputs back by position.
+
+    Backends return one output per input, in input order, so the i-th
+    output always belongs to the i-th submitted post regardless of how the
+    engine scheduled the sequences internally. Requests already answered by
+    the result cache are not submitted. With a ``packer``, short text-only
+    posts go out several to a request in the same call; posts a pack did not
+    answer usably are submitted again on their own. With a ``voter``, the
+    ``n`` samples of each request are merged into one extraction (the result
+    cache then keeps all sample texts). If ``usage`` is given, prompt,
+    prefix-cached and estimated token counts are accumulated into it.
+    Each request gets its generate/parse timings, a ``tokens`` dict and a
+    ``repair_reason`` (None for usable outputs; see ``repair_queue``).
+    A request the backend could not complete (``output.error``) yields a
+    record with an ``error`` and no extraction; callers must not write it,
+    so a rerun with ``--resume`` tries the post again.
+    """
+    if not prepared:
+        return []
+    submitted = [req for req in prepared if req.get("cached_text") is None]
+    packs = packer.pack(submitted) if packer is not None else []
+    in_pack = {id(req) for group in packs for req in group}
+    singles = [req for req in submitted if id(req) not in in_pack]
+    outputs_by_req: dict[int, tuple[Any, float]] = {}
+    answered: dict[int, Any] = {}
+    if submitted:
+        inputs = [req["input"] for req in singles]
+        started = time.perf_counter()
+        if packs:
+            inputs += [packer.build_input(backend, group) for group in packs]
+            sampling = [None] * len(singles) + [packer.sampling_params(backend)] * len(packs)
+            outputs = backend.generate(inputs, sampling)
+        else:
+            outputs = backend.generate(inputs)
+        generate_s = time.perf_counter() - started
+        if len(outputs) != len(inputs):
+            raise RuntimeError(f"engine returned {len(outputs)} outputs for {len(inputs)} inputs")
+        for req, output in zip(singles, outputs):
+            outputs_by_req[id(req)] = (output, generate_s)
+        for group, engine_input, output in zip(packs, inputs[len(singles) :], outputs[len(singles) :]):
+            answered.update(packer.unpack(group, engine_input, output, generate_s, usage))
+        retry = [req for group in packs for req in group if id(req) not in answered]
+        if retry:
+            started = time.perf_counter()
+            outputs = backend.generate([req["input"] for req in retry])
+            retry_s = generate_s + time.perf_counter() - started
+            for req, output in zip(retry, outputs):
+                outputs_by_req[id(req)] = (output, retry_s)
+    records: list[dict] = []
+    for req in prepared:
+        if result_cache is not None:
+            result_cache.record(req.get("cached_text") is not None)
+        timings = req.setdefault("timings", {})
+        consensus = None
+        if req.get("cached_text") is not None:
+            req["tokens"] = {}
+            with timed(timings, "parse"):
+                if voter is not None:
+                    texts = json.loads(req["cached_text"])
+                    extraction, req["repair_reason"], consensus = voter.vote(texts, [None] * len(texts))
+                else:
+                    extraction = parse_output(req["cached_text"])
+                    req["repair_reason"] = repair_reason(extraction, None, SCHEMA_JSON)
+        elif id(req) in answered:
+            extraction = answered[id(req)]
+        else:
+            output, timings["generate"] = outputs_by_req[id(req)]
+            if getattr(output, "error", ""):
+                req["tokens"] = {}
+                req["repair_reason"] = None
+                records.append({"post_id": req["post_id"], "extraction": None, "error": output.error})
+                continue
+            req["tokens"] = {
+                "prompt": prompt_token_count(output),
+                "cached": output.num_cached_tokens or 0,
+                "completion": completion_token_count(output),
+            }
+            if usage is not None:
+                usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + prompt_token_count(output)
+                usage["cached_tokens"] = usage.get("cached_tokens", 0) + (output.num_cached_tokens or 0)
+                usage["estimated_tokens"] = usage.get("estimated_tokens", 0) + req.get("est_tokens", 0)
+            if voter is not None:
+                texts = [cand.text for cand in output.outputs]
+                text_out = json.dumps(texts, ensure_ascii=False)
+                with timed(timings, "parse"):
+                    extraction, req["repair_reason"], consensus = voter.vote(
+                        texts, [getattr(cand, "finish_reason", None) for cand in output.outputs]
+                    )
+            else:
+                text_out = output_text(output)
+                with timed(timings, "parse"):
+                    extraction = parse_output(text_out)
+                req["repair_reason"] = repair_reason(extraction, finish_reason(output), SCHEMA_JSON)
+            # Only usable outputs are cached, so a rerun retries the rest.
+            if result_cache is not None and req.get("cache_key") and req["repair_reason"] is None:
+                result_cache.put(req["cache_key"], text_out)
+        record = {
+            "post_id": req["post_id"],
+            "extraction": extraction,
+            "media_used": {"images": req["images"], "videos": req["videos"]},
+        }
+        if id(req) in answered:
+            record["packed_with"] = req["pack_size"] - 1
+        if consensus is not None:
+            record["consensus"] = consensus
+        records.append(record)
+    return records
+
+
+@dataclass
+class EngineConfig:
+    """Which backend to load and how to sample; field names match the CLI flags."""
+
+    backend: str = "vllm"
+    model: str = DEFAULT_MODEL
+    temperature: float = 0.2
+    max_tokens: int = 1200
+    max_model_len: int = 110000
+    gpu_memory_utilization: float = 0.9
+    max_inflight: int = 0
+    api_base: str = "http://127.0.0.1:8000/v1"
+    api_key: str = ""
+    served_model_name: str = ""
+    max_concurrency: int = 32
+    request_timeout: float = 600.0
+    remote_media: str = "data"
+    num_samples: int = 1
+
+    @classmethod
+    def from_args(cls, args: Any) -> EngineConfig:
+        """Take the fields present on an ``argparse.Namespace``; the rest keep their defaults."""
+        return cls(**{f.name: getattr(args, f.name) for f in fields(cls) if hasattr(args, f.name)})
+
+
+def load_backend(
+    config: EngineConfig,
+    image_cache: Optional[ImageCache] = None,
+    startup: Optional[dict] = None,
+) -> Any:
+    """Build the inference backend chosen by ``config.backend``.
+
+    Import and model-load wall times are added to ``startup`` under
+    ``imports`` and ``model_load``.
+    """
+    startup = {} if startup is None else startup
+    model_path = os.path.expanduser(config.model)
+    if config.backend == "openai":
+        if image_cache is not None:
+            print("[warn] --image-cache-dir has no effect with --backend openai", file=sys.stderr)
+        return OpenAIChatBackend(
+            config.api_base,
+            config.served_model_name or model_path,
+            schema=SCHEMA_JSON,
+            temperature=config.temperature,
+            max_tokens=config.max_tokens,
+            n=config.num_samples,
+            max_concurrency=config.max_concurrency,
+            timeout_s=config.request_timeout,
+            api_key=config.api_key or os.environ.get("OPENAI_API_KEY"),
+            media_mode=config.remote_media,
+        )
+
+    if config.backend == "fake":
+        print("[warn] --backend fake writes synthetic extractions; use it for tests and benchmarks only", file=sys.stderr)
+        with timed(startup, "imports"):
+            from .fake_vlm import FakeLLM, FakeProcessor, SamplingParams, process_vision_info
+
+        with timed(startup, "model_load"):
+            llm = FakeLLM(
+                model=model_path,
+                max_num_seqs=config.max_inflight or None,
+                enable_prefix_caching=True,
+            )
+
+        def fake_sampling(schema: dict, max_tokens: int) -> Any:
+            return SamplingParams(
+                temperature=config.temperature,
+                max_tokens=max_tokens,
+                n=config.num_samples,
+                structured_outputs=schema,
+            )
+
+        if image_cache is not None:
+            from .fake_vlm import fetch_image
+
+            process_vision_info = image_cache.wrap(process_vision_info, fetch_image)
+        return LocalEngineBackend(
+            llm,
+            FakeProcessor(),
+            fake_sampling(SCHEMA_JSON, config.max_tokens),
+            process_vision_info,
+            fake_sampling,
+        )
+
+    # Callers run ensure_cuda_runtime() before any expensive work, so a
+    # re-exec of the interpreter there costs almost nothing.
+    with timed(startup, "imports"):
+        from transformers import AutoProcessor
+        from qwen_vl_utils import process_vision_info
+        from qwen_vl_utils import vision_process
+
+        from vllm import LLM, SamplingParams
+        from vllm.sampling_params import StructuredOutputsParams
+
+    llm_kwargs: dict = {}
+    if config.max_inflight:
+        llm_kwargs["max_num_seqs"] = config.max_inflight
+    with timed(startup, "model_load"):
+        llm = LLM(
+            model=model_path,
+            trust_remote_code=True,
+            max_model_len=config.max_model_len,
+            gpu_memory_utilization=config.gpu_memory_utilization,
+            enable_prefix_caching=True,
+            **llm_kwargs,
+        )
+        processor = AutoProcessor.from_pretrained(model_path, trust_remote_code=True)
+
+    def vllm_sampling(schema: dict, max_tokens: int) -> Any:
+        return SamplingParams(
+            temperature=config.temperature,
+            max_tokens=max_tokens,
+            # n > 1: one request, so all samples share its prefill and vision encoding.
+            n=config.num_samples,
+            structured_outputs=StructuredOutputsParams(json=schema),
+        )
+
+    if image_cache is not None:
+        image_cache.bounds = (vision_process.IMAGE_MIN_TOKEN_NUM, vision_process.IMAGE_MAX_TOKEN_NUM)
+        process_vision_info = image_cache.wrap(process_vision_info, vision_process.fetch_image)
+    return LocalEngineBackend(
+        llm,
+        processor,
+        vllm_sampling(SCHEMA_JSON, config.max_tokens),
+        process_vision_info,
+        vllm_sampling,
+    )
+
+
+class ExtractionEngine:
+    """A loaded backend plus the per-post options, reused for any number of posts.
+
+    ``prepare`` and ``generate`` are the two halves of ``extract_many`` for
+    callers that overlap them (``extract_all_weibo._run_pipeline``). Videos
+    that fail to decode or that ``probe_table`` rejects are appended to
+    ``bad_videos`` (a list unless the caller passes a log). With
+    ``pack_size`` > 1, short text-only posts of a batch share requests (see
+    ``PostPacker``). With ``num_samples`` > 1 (the backend must sample that
+    many, ``EngineConfig.num_samples``) the samples are merged by a
+    ``SampleVoter``; packing and voting do not combine.
+    """
+
+    # Options a single ``extract`` call (and so a daemon request) may change.
+    CALL_OPTIONS = ("max_images", "skip_videos", "prompt_layout", "download_media", "vote_threshold")
+
+    def __init__(
+        self,
+        backend: Any,
+        model: str = "",
+        max_images: int = 3,
+        downloader: Optional[MediaDownloader] = None,
+        skip_videos: bool = False,
+        bad_videos: Any = None,
+        prompt_layout: str = "legacy",
+        probe_table: Optional[VideoProbeTable] = None,
+        max_video_seconds: float = 0.0,
+        result_cache: Optional[ResultCache] = None,
+        batch_size: int = 8,
+        pack_size: int = 0,
+        pack_max_chars: int = 140,
+        pack_max_tokens: int = 4096,
+        num_samples: int = 1,
+        vote_threshold: float = 0.5,
+    ) -> None:
+        if prompt_layout not in PROMPT_LAYOUTS:
+            raise ValueError(f"unknown prompt layout: {prompt_layout}")
+        if pack_size > 1 and num_samples > 1:
+            raise ValueError("packing and multi-sample voting cannot be combined")
+        self.backend = backend
+        self.model = model
+        self.max_images = max_images
+        self.downloader = downloader
+        self.skip_videos = skip_videos
+        self.bad_videos = [] if bad_videos is None else bad_videos
+        self.prompt_layout = prompt_layout
+        self.probe_table = probe_table
+        self.max_video_seconds = max_video_seconds
+        self.result_cache = result_cache
+        self.batch_size = max(1, batch_size)
+        self.packer = None
+        if pack_size > 1:
+            self.packer = PostPacker(
+                pack_size, pack_max_chars, pack_max_tokens, prompt_layout, TokenEstimator(backend.processor)
+            )
+        self.voter = SampleVoter(num_samples, vote_threshold) if num_samples > 1 else None
+        self.config: Optional[EngineConfig] = None
+        self.served = 0
+
+    @classmethod
+    def load(
+        cls,
+        config: EngineConfig,
+        image_cache: Optional[ImageCache] = None,
+        startup: Optional[dict] = None,
+        **options: Any,
+    ) -> ExtractionEngine:
+        """Load the backend for ``config``; ``options`` go to the constructor.
+
+        For ``vllm`` this first makes the CUDA runtime loadable, which may
+        re-exec the interpreter, so call it before doing anything expensive.
+        """
+        if config.backend == "vllm":
+            ensure_cuda_runtime()
+        backend = load_backend(config, image_cache, startup)
+        options.setdefault("num_samples", config.num_samples)
+        engine = cls(backend, os.path.expanduser(config.model), **options)
+        engine.config = config
+        return engine
+
+    def prepare(self, post: dict, media_root: str, text_only: bool = False) -> dict:
+        """Prepare one post; downloaded media stay pinned in the cache until ``generate`` has run."""
+        if self.downloader is None:
+            return self._prepare(post, media_root, text_only)
+        with self.downloader.pinning() as pins:
+            try:
+                req = self._prepare(post, media_root, text_only)
+            except BaseException:
+                self.downloader.release(pins)
+                raise
+        req["media_pins"] = pins
+        return req
+
+    def _prepare(self, post: dict, media_root: str, text_only: bool) -> dict:
+        return prepare_request(
+            self.backend,
+            post,
+            media_root,
+            self.max_images,
+            self.downloader,
+            self.skip_videos,
+            self.bad_videos,
+            self.prompt_layout,
+            self.probe_table,
+            self.max_video_seconds,
+            self.result_cache,
+            text_only,
+        )
+
+    def generate(self, prepared: list[dict], usage: Optional[dict] = None) -> list[dict]:
+        try:
+            records = generate_batch(self.backend, prepared, usage, self.result_cache, self.packer, self.voter)
+        finally:
+            # File-mode backends read media during generate, so pins last until here.
+            if self.downloader is not None:
+                for req in prepared:
+                    self.downloader.release(req.pop("media_pins", []))
+        self.served += len(records)
+        return records
+
+    def extract(self, post: dict, media_root: str = "", **options: Any) -> dict:
+        """Extract one post: ``{"post_id", "extraction", "media_used"}``.
+
+        ``options`` (names in ``CALL_OPTIONS``) override the engine's settings
+        for this call only; ``download_media=False`` uses no downloader.
+        """
+        unknown = sorted(set(options) - set(self.CALL_OPTIONS))
+        if unknown:
+            raise ValueError(f"unknown extract options: {unknown}")
+        if options.get("prompt_layout", self.prompt_layout) not in PROMPT_LAYOUTS:
+            raise ValueError(f"unknown prompt layout: {options['prompt_layout']}")
+        saved = (self.max_images, self.skip_videos, self.prompt_layout, self.downloader, self.voter)
+        try:
+            self.max_images = options.get("max_images", self.max_images)
+            self.skip_videos = options.get("skip_videos", self.skip_videos)
+            self.prompt_layout = options.get("prompt_layout", self.prompt_layout)
+            if options.get("download_media") is False:
+                self.downloader = None
+            if "vote_threshold" in options and self.voter is not None:
+                self.voter = SampleVoter(self.voter.num_samples, options["vote_threshold"])
+            return self.generate([self.prepare(post, media_root)])[0]
+        finally:
+            self.max_images, self.skip_videos, self.prompt_layout, self.downloader, self.voter = saved
+
+    def extract_many(self, posts: Iterable[tuple[dict, str]]) -> Iterator[dict]:
+        """Extract ``(post, media_root)`` pairs ``batch_size`` at a time; records come back in input order."""
+        batch: list[dict] = []
+        for post, media_root in posts:
+            batch.append(self.prepare(post, media_root))
+            if len(batch) >= self.batch_size:
+                yield from self.generate(batch)
+                batch = []
+        if batch:
+            yield from self.generate(batch)
+
+    def close(self) -> None:
+        self.backend.close()
+        if self.downloader is not None:
+            self.downloader.close()
+
+    def __enter__(self) -> ExtractionEngine:
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+# -- local daemon -------------------------------------------------------------
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), f"switchable-persona-extract-{os.getuid()}.sock")
+
+
+class _DaemonHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        server: _DaemonServer = self.server  # type: ignore[assignment]
+        try:
+            request = json.loads(self.rfile.readline())
+            response = server.dispatch(request)
+        except Exception as exc:
+            # One bad post must not take the resident model down with it.
+            response = {"ok": False, "error": f"{type(exc).__name__}: {exc}"}
+        self.wfile.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+
+
+class _DaemonServer(socketserver.UnixStreamServer):
+    # Requests are handled one at a time: the engine is not thread-safe, and
+    # a single GPU would serialise them anyway.
+
+    def __init__(self, socket_path: str, engine: ExtractionEngine) -> None:
+        super().__init__(socket_path, _DaemonHandler)
+        self.engine = engine
+        self.started = time.time()
+
+    def dispatch(self, request: dict) -> dict:
+        op = request.get("op", "extract")
+        if op == "ping":
+            return {
+                "ok": True,
+                "model": self.engine.model,
+                "backend": self.engine.backend.name,
+                "served": self.engine.served,
+                "uptime_s": round(time.time() - self.started, 1),
+            }
+        if op == "shutdown":
+            # shutdown() waits for serve_forever to return, so not from this handler.
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return {"ok": True}
+        if op != "extract" or not isinstance(request.get("post"), dict):
+            return {"ok": False, "error": f"bad request: {sorted(request)}"}
+        config = self.engine.config
+        mismatched = [
+            f"{name}={getattr(config, name, None)!r} (requested {value!r})"
+            for name, value in (request.get("sampling") or {}).items()
+            if config is None or getattr(config, name, None) != value
+        ]
+        if mismatched:
+            return {
+                "ok": False,
+                "error": f"engine was started with {', '.join(mismatched)}; restart --serve to change it",
+            }
+        started = time.perf_counter()
+        try:
+            options = request.get("options") or {}
+            record = self.engine.extract(request["post"], request.get("media_root", ""), **options)
+        except ValueError as exc:
+            return {"ok": False, "error": str(exc)}
+        if record.get("error"):
+            return {"ok": False, "error": f"extraction failed: {record['error']}"}
+        return {"ok": True, "record": record, "elapsed_s": round(time.perf_counter() - started, 3)}
+
+
+def serve(engine: ExtractionEngine, socket_path: str = DEFAULT_SOCKET) -> None:
+    """Answer ``daemon_request`` calls on ``socket_path`` until a shutdown request or Ctrl-C."""
+    if os.path.exists(socket_path):
+        try:
+            daemon_request({"op": "ping"}, socket_path, timeout_s=2.0)
+        except OSError:
+            os.remove(socket_path)  # left behind by a daemon that died
+        else:
+            raise RuntimeError(f"a daemon is already listening on {socket_path}")
+    server = _DaemonServer(socket_path, engine)
+    os.chmod(socket_path, 0o600)
+    print(f"[daemon] {engine.backend.name} {engine.model} listening on {socket_path}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            os.remove(socket_path)
+        except FileNotFoundError:
+            pass
+        print(f"[daemon] stopped after {engine.served} posts", file=sys.stderr)
+
+
+def daemon_request(request: dict, socket_path: str = DEFAULT_SOCKET, timeout_s: float = 600.0) -> dict:
+    """Send one request to a running daemon; raises ``OSError`` if none is listening."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout_s)
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError(f"no response from {socket_path}")
+    return json.loads(line)
@@ -0,0 +1,309 @@
+"""Queryable SQLite store of extraction records.
+
+The JSONL output and the per-post JSON directory are good for appending and
+for resume, but every consumer that wants one post, or the posts of one
+user, has to scan all of it. The store keeps the same records in one SQLite
+file (WAL mode, so readers never block the writer) with indexed columns:
+
+  records       post_id (primary key), weibo_json, publish_time, model,
+                created_at, emotion, parsed (0 if the output was not JSON),
+                record (the full JSONL line)
+  record_tones  (tone, post_id) for the multi-valued ``style.tone``
+
+Writing a post again replaces its row, like ``--repair`` patching the JSONL.
+
+Fill it from existing outputs with the importer below, or directly from the
+extraction loop with ``extract_all_weibo.py --store``.
+
+Usage:
+  python3 scripts/extraction_store.py --import-jsonl processed_data/extractions.jsonl
+  python3 scripts/extraction_store.py --import-dir processed_data/extractions
+  python3 scripts/extraction_store.py --get 4983423012345678
+  python3 scripts/extraction_store.py --list --tone celebratory --since "2024-01-01" --limit 20
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Iterable, Optional
+
+DEFAULT_STORE = "processed_data/extractions.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    post_id TEXT PRIMARY KEY,
+    weibo_json TEXT,
+    publish_time TEXT,
+    model TEXT,
+    created_at TEXT,
+    emotion TEXT,
+    parsed INTEGER NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_weibo_json ON records (weibo_json);
+CREATE INDEX IF NOT EXISTS records_publish_time ON records (publish_time);
+CREATE INDEX IF NOT EXISTS records_model ON records (model);
+CREATE INDEX IF NOT EXISTS records_emotion ON records (emotion);
+CREATE TABLE IF NOT EXISTS record_tones (
+    tone TEXT NOT NULL,
+    post_id TEXT NOT NULL,
+    PRIMARY KEY (tone, post_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS record_tones_post_id ON record_tones (post_id);
+"""
+
+
+def _row(post_id: str, line: dict) -> tuple[tuple, list[str]]:
+    """Indexed columns and tones of one record line (``{"meta", "input", "result"}``)."""
+    meta = line.get("meta") or {}
+    extraction = (line.get("result") or {}).get("extraction")
+    parsed = isinstance(extraction, dict) and "_raw" not in extraction
+    style = (extraction.get("style") or {}) if parsed else {}
+    emotion = style.get("emotion") if isinstance(style.get("emotion"), str) else None
+    tones = sorted({tone for tone in style.get("tone") or [] if isinstance(tone, str)})
+    row = (
+        post_id,
+        meta.get("weibo_json"),
+        meta.get("publish_time"),
+        meta.get("model"),
+        meta.get("created_at"),
+        emotion,
+        int(parsed),
+        json.dumps(line, ensure_ascii=False),
+    )
+    return row, tones
+
+
+class ExtractionStore:
+    """One SQLite connection, shareable across threads (calls are serialised by a lock)."""
+
+    def __init__(self, path: str = DEFAULT_STORE) -> None:
+        self.path = path
+        store_dir = os.path.dirname(path)
+        if store_dir:
+            os.makedirs(store_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # Shard processes may share one store; a writer waits for the others' transactions.
+        self._conn = sqlite3.connect(path, timeout=60.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL: a commit survives a crash of the process, not of the OS.
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def put_many(self, lines: Iterable[tuple[str, dict]]) -> int:
+        """Insert or replace ``(post_id, line)`` records in one transaction."""
+        rows: list[tuple] = []
+        tones: list[tuple[str, str]] = []
+        for post_id, line in lines:
+            row, post_tones = _row(post_id, line)
+            rows.append(row)
+            tones += [(tone, post_id) for tone in post_tones]
+        if not rows:
+            return 0
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM record_tones WHERE post_id = ?", [(row[0],) for row in rows])
+            self._conn.executemany("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._conn.executemany("INSERT OR IGNORE INTO record_tones VALUES (?, ?)", tones)
+        return len(rows)
+
+    def get(self, post_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT record FROM records WHERE post_id = ?", (post_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _where(
+        self,
+        weibo_json: Optional[str],
+        model: Optional[str],
+        emotion: Optional[str],
+        tone: Optional[str],
+        since: Optional[str],
+        until: Optional[str],
+    ) -> tuple[str, list[Any]]:
+        clauses: list[str] = []
+        params: list[Any] = []
+        for column, value in (("weibo_json", weibo_json), ("model", model), ("emotion", emotion)):
+            if value is not None:
+                clauses.append(f"r.{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("r.publish_time >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("r.publish_time < ?")
+            params.append(until)
+        if tone is not None:
+            clauses.append("r.post_id IN (SELECT post_id FROM record_tones WHERE tone = ?)")
+            params.append(tone)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(
+        self,
+        weibo_json: Optional[str] = None,
+        model: Optional[str] = None,
+        emotion: Optional[str] = None,
+        tone: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        limit: int = 100,
+        offset: int = 0,
+    ) -> list[dict]:
+        """Records matching every given filter, by ``publish_time`` then ``post_id``.
+
+        ``since``/``until`` compare ``publish_time`` as text (crawler format
+        ``YYYY-MM-DD HH:MM``), ``until`` exclusive.
+        """
+        where, params = self._where(weibo_json, model, emotion, tone, since, until)
+        sql = f"SELECT r.record FROM records r{where} ORDER BY r.publish_time, r.post_id LIMIT ? OFFSET ?"
+        with self._lock:
+            rows = self._conn.execute(sql, params + [limit, offset]).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def count(self, **filters: Any) -> int:
+        where, params = self._where(
+            *(filters.get(name) for name in ("weibo_json", "model", "emotion", "tone", "since", "until"))
+        )
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM records r{where}", params).fetchone()[0]
+
+    def stats(self) -> str:
+        with self._lock:
+            records, unparsed = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(1 - parsed), 0) FROM records"
+            ).fetchone()
+            emotions = self._conn.execute(
+                "SELECT emotion, COUNT(*) FROM records GROUP BY emotion ORDER BY COUNT(*) DESC LIMIT 5"
+            ).fetchall()
+        size = sum(os.path.getsize(p) for p in (self.path, f"{self.path}-wal") if os.path.isfile(p))
+        top = ",".join(f"{emotion}:{count}" for emotion, count in emotions)
+        return f"records={records} unparsed={unparsed} bytes={size} emotions={top}"
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class StoreSink:
+    """Sink that writes records to an ``ExtractionStore``, one transaction per batch.
+
+    ``close`` flushes but leaves the store open; its owner closes it.
+    """
+
+    def __init__(self, store: ExtractionStore) -> None:
+        self.store = store
+        self.records = 0
+        self.bytes_written = 0
+        self._pending: list[tuple[str, dict]] = []
+
+    def write(self, post_id: str, line: dict) -> None:
+        self._pending.append((post_id, line))
+        self.records += 1
+
+    def end_batch(self) -> None:
+        self.flush()
+
+    def flush(self) -> None:
+        self.store.put_many(self._pending)
+        self._pending = []
+
+    def close(self) -> None:
+        self.flush()
+
+
+def _iter_jsonl(path: str) -> Iterable[tuple[str, dict]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            post_id = (record.get("meta") or {}).get("post_id") if isinstance(record, dict) else None
+            if post_id:
+                yield post_id, record
+
+
+def _iter_dir(path: str) -> Iterable[tuple[str, dict]]:
+    for entry in sorted(os.scandir(path), key=lambda e: e.name):
+        if not entry.name.endswith(".json"):
+            continue
+        try:
+            with open(entry.path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue
+        if isinstance(record, dict):
+            yield (record.get("meta") or {}).get("post_id") or entry.name[: -len(".json")], record
+
+
+def import_records(store: ExtractionStore, records: Iterable[tuple[str, dict]], batch_size: int = 2000) -> int:
+    total = 0
+    batch: list[tuple[str, dict]] = []
+    for item in records:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            total += store.put_many(batch)
+            batch = []
+    return total + store.put_many(batch)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Import, look up and filter extraction records in SQLite")
+    parser.add_argument("--store", default=DEFAULT_STORE)
+    parser.add_argument("--import-jsonl", nargs="*", default=[], help="JSONL outputs (or shards) to import")
+    parser.add_argument("--import-dir", nargs="*", default=[], help="Per-post JSON directories to import")
+    parser.add_argument("--get", default="", help="Print the record of this post_id")
+    parser.add_argument("--list", action="store_true", help="Print records matching the filters (one JSON line each)")
+    parser.add_argument("--count", action="store_true", help="Print how many records match the filters")
+    parser.add_argument("--weibo-json")
+    parser.add_argument("--model")
+    parser.add_argument("--emotion")
+    parser.add_argument("--tone")
+    parser.add_argument("--since", help="publish_time >= this")
+    parser.add_argument("--until", help="publish_time < this")
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--offset", type=int, default=0)
+    args = parser.parse_args()
+
+    store = ExtractionStore(args.store)
+    try:
+        for path in args.import_jsonl:
+            started = time.perf_counter()
+            count = import_records(store, _iter_jsonl(path))
+            print(f"[store] imported {count} from {path} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        for path in args.import_dir:
+            started = time.perf_counter()
+            count = import_records(store, _iter_dir(path))
+            print(f"[store] imported {count} from {path} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        filters = {
+            "weibo_json": args.weibo_json,
+            "model": args.model,
+            "emotion": args.emotion,
+            "tone": args.tone,
+            "since": args.since,
+            "until": args.until,
+        }
+        if args.get:
+            record = store.get(args.get)
+            if record is None:
+                print(f"[store] {args.get} not found", file=sys.stderr)
+                return 1
+            print(json.dumps(record, ensure_ascii=False, indent=2))
+        if args.list:
+            for record in store.query(limit=args.limit, offset=args.offset, **filters):
+                print(json.dumps(record, ensure_ascii=False))
+        if args.count:
+            print(store.count(**filters))
+        print(f"[store] {args.store} {store.stats()}", file=sys.stderr)
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
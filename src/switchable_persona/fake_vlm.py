@@ -0,0 +1,430 @@
+"""GPU-free stand-ins for the vLLM / transformers / qwen_vl_utils APIs used by extraction.
+
+The fakes follow the same call contracts as the real objects (``LLM.generate``,
+``processor.apply_chat_template``, ``process_vision_info``) so the extraction
+loop can be driven end-to-end on a CPU box. ``FakeLLM`` models a batched engine:
+every ``generate`` call is split into waves of at most ``max_num_seqs``
+sequences, and each wave costs a fixed step latency plus a small per-sequence
+latency, which is roughly how decode throughput scales on a real GPU. With
+``enable_prefix_caching`` it also tracks prompt blocks it has already seen and
+reports ``num_cached_tokens`` like vLLM's automatic prefix caching.
+
+Run as a script it serves a mock OpenAI-compatible ``/v1/chat/completions``
+endpoint backed by ``FakeLLM``, for exercising the remote backend:
+
+  python3 scripts/fake_vlm.py --port 8000
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import queue
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Any, Optional
+
+from .extraction import FEW_SHOT_POST_ID
+
+_POST_ID_RE = re.compile(r"POST_ID: (\S+)")
+_CACHE_BLOCK_SIZE = 16
+
+# Simulated CPU cost of decoding one image / one video in ``process_vision_info``.
+IMAGE_DECODE_S = 0.01
+VIDEO_DECODE_S = 0.05
+# Prompt tokens each image / video expands to inside the engine.
+IMAGE_TOKENS = 256
+VIDEO_TOKENS = 1024
+_PAD_TOKEN_ID = 251
+
+
+def _fake_token_ids(text: str) -> list[int]:
+    # Roughly one token per 4 bytes, deterministic for a given text.
+    return [b % 251 for b in text.encode("utf-8")[::4]]
+
+
+class SamplingParams:
+    def __init__(
+        self,
+        temperature: float = 1.0,
+        max_tokens: int = 16,
+        n: int = 1,
+        structured_outputs: Any = None,
+        **kwargs: Any,
+    ) -> None:
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.n = n
+        self.structured_outputs = structured_outputs
+        self.extra = kwargs
+
+
+class CompletionOutput:
+    def __init__(self, index: int, text: str, finish_reason: str = "stop") -> None:
+        self.index = index
+        self.text = text
+        self.token_ids = _fake_token_ids(text)
+        self.finish_reason = finish_reason
+
+
+class RequestOutput:
+    def __init__(
+        self,
+        request_id: str,
+        prompt: str,
+        outputs: list[CompletionOutput],
+        num_cached_tokens: int = 0,
+    ) -> None:
+        self.request_id = request_id
+        self.prompt = prompt
+        self.prompt_token_ids = _fake_token_ids(prompt)
+        self.outputs = outputs
+        self.num_cached_tokens = num_cached_tokens
+        self.finished = True
+
+
+def fake_extraction(post_id: str, sample: int = 0) -> dict:
+    """The fake answer for ``post_id``; some later samples (``n`` > 1) disagree on tone/emotion."""
+    drifts = sample > 0 and zlib.crc32(f"{post_id}:{sample}".encode("utf-8")) % 3 == 0
+    return {
+        "post_id": post_id,
+        "style": {
+            "catchphrases": [],
+            "signature_patterns": [],
+            "tone": ["casual", "humorous"] if drifts else ["casual"],
+            "emotion": "joy" if drifts else "none",
+            "evidence": [],
+            "confidence": 0.5,
+        },
+        "safety_rewrite": {"terms": [], "evidence": [], "confidence": 0.0},
+        "stance": {"targets": [], "reasoning": []},
+        "topic": {
+            "trigger": "",
+            "one_sentence_summary": "",
+            "evidence": [],
+            "confidence": 0.0,
+        },
+        "knowledge_facts": [],
+    }
+
+
+class FakeLLM:
+    """Deterministic ``vllm.LLM`` stand-in with a tunable batched latency model."""
+
+    def __init__(
+        self,
+        model: str = "fake",
+        max_num_seqs: Optional[int] = None,
+        step_latency_s: float = 0.05,
+        seq_latency_s: float = 0.002,
+        enable_prefix_caching: bool = False,
+        **kwargs: Any,
+    ) -> None:
+        self.model = model
+        self.max_num_seqs = max_num_seqs or 256
+        self.step_latency_s = step_latency_s
+        self.seq_latency_s = seq_latency_s
+        self.num_generate_calls = 0
+        self.num_sequences = 0
+        self.enable_prefix_caching = enable_prefix_caching
+        self._cached_blocks: set[int] = set()
+        self._next_request_id = 0
+
+    def _num_cached_tokens(self, token_ids: list[int]) -> int:
+        """Count full blocks of ``token_ids`` whose whole prefix chain was seen before."""
+        if not self.enable_prefix_caching:
+            return 0
+        cached = 0
+        prefix_hash = 0
+        hit = True
+        for start in range(0, len(token_ids) - _CACHE_BLOCK_SIZE + 1, _CACHE_BLOCK_SIZE):
+            prefix_hash = hash((prefix_hash, tuple(token_ids[start : start + _CACHE_BLOCK_SIZE])))
+            if hit and prefix_hash in self._cached_blocks:
+                cached += _CACHE_BLOCK_SIZE
+            else:
+                hit = False
+                self._cached_blocks.add(prefix_hash)
+        return cached
+
+    def generate(self, prompts: Any, sampling_params: Any = None, use_tqdm: bool = True, **kwargs: Any) -> list[RequestOutput]:
+        if isinstance(prompts, (str, dict)):
+            prompts = [prompts]
+        # Like vLLM: one params object for all prompts, or a list with one per prompt.
+        if isinstance(sampling_params, list):
+            params_list = sampling_params
+        else:
+            params_list = [sampling_params] * len(prompts)
+        num_sequences = sum(getattr(params, "n", 1) or 1 for params in params_list)
+        self.num_generate_calls += 1
+        self.num_sequences += num_sequences
+
+        remaining = num_sequences
+        while remaining > 0:
+            wave = min(remaining, self.max_num_seqs)
+            time.sleep(self.step_latency_s + self.seq_latency_s * wave)
+            remaining -= wave
+
+        results: list[RequestOutput] = []
+        for item, params in zip(prompts, params_list):
+            prompt = item if isinstance(item, str) else item.get("prompt", "")
+            mm_data = {} if isinstance(item, str) else item.get("multi_modal_data") or {}
+            # The few-shot example in the instructions is not a post to answer.
+            matches = [post_id for post_id in _POST_ID_RE.findall(prompt) if post_id != FEW_SHOT_POST_ID]
+            schema = getattr(params, "structured_outputs", None)
+            n = getattr(params, "n", 1) or 1
+            # Greedy decoding gives every sample the same answer.
+            sampled = (getattr(params, "temperature", 1.0) or 0.0) > 0
+            outputs = []
+            for i in range(n):
+                sample = i if sampled else 0
+                if isinstance(schema, dict) and "extractions" in (schema.get("properties") or {}):
+                    # Multi-post packed prompt: one extraction per POST_ID, in order.
+                    payload: Any = {"extractions": [fake_extraction(post_id, sample) for post_id in matches]}
+                else:
+                    payload = fake_extraction(matches[-1] if matches else "", sample)
+                text = json.dumps(payload, ensure_ascii=False)
+                finish_reason = "stop"
+                max_tokens = getattr(params, "max_tokens", None)
+                if max_tokens and len(_fake_token_ids(text)) > max_tokens:
+                    # Cut off like a real engine that ran out of budget.
+                    text = text.encode("utf-8")[: 4 * max_tokens].decode("utf-8", errors="ignore")
+                    finish_reason = "length"
+                outputs.append(CompletionOutput(i, text, finish_reason))
+            result = RequestOutput(str(self._next_request_id), prompt, outputs)
+            num_mm_tokens = IMAGE_TOKENS * len(mm_data.get("image") or []) + VIDEO_TOKENS * len(
+                mm_data.get("video") or []
+            )
+            result.prompt_token_ids = result.prompt_token_ids + [_PAD_TOKEN_ID] * num_mm_tokens
+            result.num_cached_tokens = self._num_cached_tokens(result.prompt_token_ids)
+            results.append(result)
+            self._next_request_id += 1
+        return results
+
+
+class FakeProcessor:
+    """Minimal ``AutoProcessor`` stand-in rendering a Qwen-style chat template."""
+
+    def __init__(self, patch_size: int = 16) -> None:
+        self.image_processor = SimpleNamespace(patch_size=patch_size)
+
+    def apply_chat_template(
+        self,
+        messages: list[dict],
+        tokenize: bool = False,
+        add_generation_prompt: bool = False,
+        **kwargs: Any,
+    ) -> Any:
+        parts: list[str] = []
+        for msg in messages:
+            content = msg.get("content")
+            if isinstance(content, str):
+                body = content
+            else:
+                pieces = []
+                for item in content or []:
+                    if item.get("type") == "text":
+                        pieces.append(item.get("text", ""))
+                    elif item.get("type") == "image":
+                        pieces.append("<|vision_start|><|image_pad|><|vision_end|>")
+                    elif item.get("type") == "video":
+                        pieces.append("<|vision_start|><|video_pad|><|vision_end|>")
+                body = "".join(pieces)
+            parts.append(f"<|im_start|>{msg.get('role')}\n{body}<|im_end|>\n")
+        if add_generation_prompt:
+            parts.append("<|im_start|>assistant\n")
+        text = "".join(parts)
+        return _fake_token_ids(text) if tokenize else text
+
+
+def _strip_file_uri(uri: str) -> str:
+    return uri[len("file://") :] if uri.startswith("file://") else uri
+
+
+def fetch_image(ele: dict, image_patch_size: int = 16) -> Any:
+    """Mimic ``qwen_vl_utils.fetch_image``: decode, convert to RGB, snap to the patch grid."""
+    from PIL import Image
+
+    image = ele["image"]
+    if not isinstance(image, Image.Image):
+        image = Image.open(_strip_file_uri(image))
+    image = image.convert("RGB")
+    factor = image_patch_size * 2
+    width, height = image.size
+    return image.resize((max(factor, width // factor * factor), max(factor, height // factor * factor)))
+
+
+def process_vision_info(
+    messages: list[dict],
+    image_patch_size: int = 16,
+    return_video_kwargs: bool = False,
+    return_video_metadata: bool = False,
+) -> tuple:
+    """Mimic ``qwen_vl_utils.process_vision_info`` without decoding pixels.
+
+    Media files are opened so missing or empty videos fail the same way a real
+    decode would.
+    """
+    images: list[Any] = []
+    videos: list[Any] = []
+    for msg in messages:
+        content = msg.get("content")
+        if isinstance(content, str):
+            continue
+        for item in content or []:
+            if item.get("type") == "image":
+                if not isinstance(item["image"], str):
+                    # Already decoded (e.g. served by image_cache).
+                    images.append(item["image"])
+                    continue
+                path = _strip_file_uri(item["image"])
+                with open(path, "rb") as f:
+                    images.append(f.read(64))
+                time.sleep(IMAGE_DECODE_S)
+            elif item.get("type") == "video":
+                path = _strip_file_uri(item["video"])
+                if not os.path.isfile(path) or os.path.getsize(path) == 0:
+                    raise RuntimeError(f"failed to decode video: {path}")
+                time.sleep(VIDEO_DECODE_S)
+                videos.append((path, {"fps": 2.0}))
+    image_inputs = images or None
+    video_inputs = videos or None
+    if return_video_kwargs:
+        return image_inputs, video_inputs, {"fps": [2.0] * len(videos)} if videos else {}
+    return image_inputs, video_inputs
+
+
+def _chat_prompt(messages: list[dict]) -> tuple[str, dict]:
+    """Flatten OpenAI chat messages to prompt text and count media parts."""
+    texts: list[str] = []
+    media = {"image": [], "video": []}
+    for msg in messages:
+        content = msg.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                texts.append(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                media["image"].append(part["image_url"]["url"])
+            elif part.get("type") == "video_url":
+                media["video"].append(part["video_url"]["url"])
+    return "\n".join(texts), media
+
+
+class _EngineLoop:
+    """Batches whatever requests are waiting into one ``FakeLLM.generate`` call, like a serving engine."""
+
+    def __init__(self, llm: FakeLLM) -> None:
+        self.llm = llm
+        self._pending: queue.Queue = queue.Queue()
+        threading.Thread(target=self._run, name="fake-engine", daemon=True).start()
+
+    def submit(self, engine_input: dict, params: SamplingParams) -> RequestOutput:
+        done = threading.Event()
+        slot: list[RequestOutput] = []
+        self._pending.put((engine_input, params, slot, done))
+        done.wait()
+        return slot[0]
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._pending.get()]
+            while True:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            outputs = self.llm.generate([entry[0] for entry in batch], [entry[1] for entry in batch])
+            for (_, _, slot, done), output in zip(batch, outputs):
+                slot.append(output)
+                done.set()
+
+
+class _ChatHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    engine: _EngineLoop
+
+    def _reply(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") == "/v1/models":
+            self._reply(200, {"object": "list", "data": [{"id": self.engine.llm.model, "object": "model"}]})
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._reply(404, {"error": "not found"})
+            return
+        req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        prompt, media = _chat_prompt(req.get("messages") or [])
+        response_format = req.get("response_format") or {}
+        params = SamplingParams(
+            temperature=req.get("temperature", 1.0),
+            max_tokens=req.get("max_tokens"),
+            n=req.get("n", 1),
+            structured_outputs=(response_format.get("json_schema") or {}).get("schema"),
+        )
+        result = self.engine.submit({"prompt": prompt, "multi_modal_data": media}, params)
+        self._reply(
+            200,
+            {
+                "id": f"chatcmpl-{result.request_id}",
+                "object": "chat.completion",
+                "model": req.get("model", self.engine.llm.model),
+                "choices": [
+                    {
+                        "index": out.index,
+                        "message": {"role": "assistant", "content": out.text},
+                        "finish_reason": out.finish_reason,
+                    }
+                    for out in result.outputs
+                ],
+                "usage": {
+                    "prompt_tokens": len(result.prompt_token_ids),
+                    "completion_tokens": sum(len(out.token_ids) for out in result.outputs),
+                    "prompt_tokens_details": {"cached_tokens": result.num_cached_tokens},
+                },
+            },
+        )
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible chat completions server backed by FakeLLM")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--model", default="fake")
+    parser.add_argument("--step-latency", type=float, default=0.05, help="Seconds per engine step")
+    args = parser.parse_args()
+
+    _ChatHandler.engine = _EngineLoop(
+        FakeLLM(model=args.model, step_latency_s=args.step_latency, enable_prefix_caching=True)
+    )
+    server = ThreadingHTTPServer((args.host, args.port), _ChatHandler)
+    print(f"[fake_vlm] serving http://{args.host}:{args.port}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
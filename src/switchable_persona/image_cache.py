@@ -0,0 +1,136 @@
+"""On-disk cache of decoded + resized images for ``process_vision_info``.
+
+``fetch_image`` opens every image, converts it to RGB and resizes it to the
+model's patch grid, on every run and again on the video-failure retry path.
+The cache stores the resized RGB pixels uncompressed, keyed by the source
+file's content hash, ``image_patch_size`` and the pixel bounds, so a rerun
+with a new prompt or model version skips decoding entirely.
+
+Entries are ``<cache_dir>/<key[:2]>/<key>.rgb``: a 12-byte header (magic,
+width, height) followed by raw RGB bytes. The cache is size-capped with LRU
+eviction (see ``disk_quota``).
+"""
+
+from __future__ import annotations
+
+import copy
+import hashlib
+import os
+import struct
+import threading
+from typing import Any, Callable, Optional
+
+from .content_hash import FileDigests
+from .disk_quota import DiskQuota, file_size, touch
+
+# Bump when the stored representation or the resize logic it mirrors changes.
+CACHE_VERSION = 1
+_MAGIC = b"SPI1"
+_HEADER = struct.Struct("<4sII")
+
+
+def _local_path(image: Any) -> Optional[str]:
+    if not isinstance(image, str):
+        return None
+    if image.startswith("file://"):
+        return image[len("file://") :]
+    if image.startswith(("http://", "https://", "data:")):
+        return None
+    return image
+
+
+class ImageCache:
+    def __init__(self, cache_dir: str, max_bytes: int = 10 << 30, bounds: tuple = ()) -> None:
+        """``bounds`` identifies the default pixel limits of the resize code (part of every key)."""
+        self.cache_dir = cache_dir
+        self.bounds = bounds
+        self.hits = 0
+        self.misses = 0
+        self._quota = DiskQuota(cache_dir, max_bytes)
+        self._lock = threading.Lock()
+        self._digests = FileDigests()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, path: str, item: dict, image_patch_size: int) -> str:
+        parts = [
+            f"v{CACHE_VERSION}",
+            self._digests.sha256(path),
+            f"patch={image_patch_size}",
+            f"bounds={self.bounds}",
+        ]
+        for field in ("min_pixels", "max_pixels", "resized_height", "resized_width"):
+            if field in item:
+                parts.append(f"{field}={item[field]}")
+        return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + ".rgb")
+
+    def get(self, key: str) -> Any:
+        path = self._entry_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        magic, width, height = _HEADER.unpack_from(data)
+        if magic != _MAGIC or len(data) != _HEADER.size + width * height * 3:
+            return None
+        from PIL import Image
+
+        touch(path)
+        return Image.frombytes("RGB", (width, height), data[_HEADER.size :])
+
+    def put(self, key: str, image: Any) -> None:
+        image = image.convert("RGB") if image.mode != "RGB" else image
+        width, height = image.size
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, width, height))
+            f.write(image.tobytes())
+        replaced = file_size(path)
+        os.replace(tmp_path, path)
+        self._quota.add(_HEADER.size + width * height * 3, replaced)
+
+    def fetch(self, item: dict, image_patch_size: int, fetch_image: Callable) -> Any:
+        """Resized image for a message item, from cache or via ``fetch_image``."""
+        path = _local_path(item.get("image"))
+        if path is None or not os.path.isfile(path):
+            return fetch_image(item, image_patch_size=image_patch_size)
+        key = self.key(path, item, image_patch_size)
+        image = self.get(key)
+        if image is not None:
+            with self._lock:
+                self.hits += 1
+            return image
+        image = fetch_image(item, image_patch_size=image_patch_size)
+        self.put(key, image)
+        with self._lock:
+            self.misses += 1
+        return image
+
+    def wrap(self, vision_info: Callable, fetch_image: Callable) -> Callable:
+        """Return a ``process_vision_info`` drop-in that serves images from the cache.
+
+        Image items are swapped for already-resized PIL images before calling the
+        real ``vision_info``; resizing an image to its own size is a plain copy,
+        so the original function returns them unchanged. Videos pass through.
+        """
+
+        def cached_vision_info(messages: list[dict], image_patch_size: int = 14, **kwargs: Any) -> Any:
+            messages = copy.deepcopy(messages)
+            for msg in messages:
+                content = msg.get("content")
+                if isinstance(content, str):
+                    continue
+                for item in content or []:
+                    if item.get("type") == "image" and "image" in item:
+                        item["image"] = self.fetch(item, image_patch_size, fetch_image)
+            return vision_info(messages, image_patch_size=image_patch_size, **kwargs)
+
+        return cached_vision_info
+
+    def stats(self) -> str:
+        return f"hits={self.hits} misses={self.misses} evicted={self._quota.evicted}"
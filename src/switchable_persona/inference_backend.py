@@ -0,0 +1,473 @@
+"""Inference backends for the extraction scripts.
+
+Every backend turns chat ``messages`` (the Qwen-VL format built by the
+extraction scripts) into outputs in two steps, so callers can check the
+result cache between them:
+
+  prompt = backend.render(messages)              # cheap, deterministic
+  engine_input = backend.build_input(messages, prompt)   # media loading
+  outputs = backend.generate([engine_input, ...])        # input order
+
+``generate`` optionally takes one sampling-params object per input (None =
+the backend default); ``backend.sampling_variant(schema, max_tokens)`` makes
+one with a different guided-decoding schema and token budget, which is how
+multi-post packed requests ask for an array of extractions.
+
+Outputs look like vLLM's ``RequestOutput`` (``.outputs[i].text``,
+``.num_cached_tokens``); use ``prompt_token_count`` for the prompt length.
+
+``LocalEngineBackend`` wraps an in-process ``vllm.LLM`` (or ``fake_vlm.FakeLLM``)
+with the processor's chat template and ``process_vision_info``.
+
+``OpenAIChatBackend`` talks to an already running OpenAI-compatible server
+(``vllm serve``) at ``/v1/chat/completions``. Requests run on an asyncio loop
+in a background thread over a pool of keep-alive HTTP/1.1 connections, at
+most ``max_concurrency`` in flight; ``SCHEMA_JSON`` is passed as a
+``json_schema`` response format so the server applies guided decoding.
+Local media are sent inline as base64 data URLs, or as ``file://`` URLs when
+the server shares the filesystem (``vllm serve --allowed-local-media-path``).
+The server decodes them, so ``build_input`` checks local videos first (with
+PyAV when installed, else only that the file is non-empty) and raises like the
+local backend does, which keeps the retry-without-videos path working.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import json
+import mimetypes
+import os
+import ssl
+import sys
+import threading
+from types import SimpleNamespace
+from typing import Any, Callable, Optional
+from urllib.parse import urlsplit
+
+from .video_probe import probe_video
+
+MEDIA_MODES = ("data", "file")
+
+
+def prompt_token_count(output: Any) -> int:
+    """Prompt tokens of one output (a ``RequestOutput`` or a ``ChatOutput``)."""
+    count = getattr(output, "num_prompt_tokens", None)
+    if count is not None:
+        return count
+    return len(getattr(output, "prompt_token_ids", None) or [])
+
+
+def finish_reason(output: Any) -> Optional[str]:
+    """Why generation of the first sample stopped (``stop``, ``length``, ...), if known."""
+    if output is None or not output.outputs:
+        return None
+    return getattr(output.outputs[0], "finish_reason", None)
+
+
+def completion_token_count(output: Any) -> int:
+    """Generated tokens of one output, over all of its samples."""
+    count = getattr(output, "num_completion_tokens", None)
+    if count is not None:
+        return count
+    return sum(len(getattr(cand, "token_ids", None) or []) for cand in output.outputs)
+
+
+class LocalEngineBackend:
+    """In-process engine: chat template + ``process_vision_info`` + ``LLM.generate``."""
+
+    name = "local"
+
+    def __init__(
+        self,
+        llm: Any,
+        processor: Any,
+        sampling_params: Any,
+        vision_info: Callable,
+        sampling_factory: Optional[Callable[[dict, int], Any]] = None,
+    ) -> None:
+        self.llm = llm
+        self.processor = processor
+        self.sampling_params = sampling_params
+        self.vision_info = vision_info
+        # ``(schema, max_tokens) -> SamplingParams`` with the engine's own
+        # structured-output wrapper; needed for ``sampling_variant``.
+        self.sampling_factory = sampling_factory
+
+    def sampling_variant(self, schema: dict, max_tokens: int) -> Any:
+        if self.sampling_factory is None:
+            raise ValueError("this backend was built without a sampling_factory")
+        return self.sampling_factory(schema, max_tokens)
+
+    def render(self, messages: list[dict]) -> str:
+        return self.processor.apply_chat_template(
+            messages, tokenize=False, add_generation_prompt=True, enable_thinking=False
+        )
+
+    def build_input(self, messages: list[dict], prompt: str) -> dict:
+        """Decode media for ``messages``; raises if a video cannot be decoded."""
+        if not any(
+            item.get("type") in ("image", "video")
+            for msg in messages
+            if not isinstance(msg.get("content"), str)
+            for item in msg.get("content") or []
+        ):
+            # Text-only prompt: nothing for the vision pipeline to do.
+            return {"prompt": prompt, "multi_modal_data": {}, "mm_processor_kwargs": {}}
+        image_inputs, video_inputs, video_kwargs = self.vision_info(
+            messages,
+            image_patch_size=self.processor.image_processor.patch_size,
+            return_video_kwargs=True,
+            return_video_metadata=True,
+        )
+        mm_data: dict = {}
+        if image_inputs is not None:
+            mm_data["image"] = image_inputs
+        if video_inputs is not None:
+            mm_data["video"] = video_inputs
+        return {
+            "prompt": prompt,
+            "multi_modal_data": mm_data,
+            "mm_processor_kwargs": video_kwargs,
+        }
+
+    def generate(self, inputs: list[dict], sampling_params: Optional[list[Any]] = None) -> list[Any]:
+        params: Any = self.sampling_params
+        if sampling_params is not None:
+            params = [sp or self.sampling_params for sp in sampling_params]
+        return self.llm.generate(inputs, params, use_tqdm=False)
+
+    def close(self) -> None:
+        pass
+
+
+# -- OpenAI-compatible HTTP backend -----------------------------------------
+
+
+class ChatOutput:
+    """``RequestOutput``-shaped result of one chat completion."""
+
+    def __init__(
+        self,
+        texts: list[str],
+        num_prompt_tokens: int = 0,
+        num_cached_tokens: int = 0,
+        num_completion_tokens: int = 0,
+        error: str = "",
+        finish_reasons: Optional[list[Optional[str]]] = None,
+    ) -> None:
+        reasons = finish_reasons or [None] * len(texts)
+        self.outputs = [
+            SimpleNamespace(index=i, text=text, finish_reason=reason)
+            for i, (text, reason) in enumerate(zip(texts, reasons))
+        ]
+        self.prompt_token_ids = None
+        self.num_prompt_tokens = num_prompt_tokens
+        self.num_cached_tokens = num_cached_tokens
+        self.num_completion_tokens = num_completion_tokens
+        self.error = error
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, body: bytes) -> None:
+        super().__init__(f"HTTP {status}: {body[:300].decode('utf-8', 'replace')}")
+        self.status = status
+
+
+class _NoResponse(Exception):
+    """The connection failed or closed before any byte of the response arrived."""
+
+    def __init__(self, cause: Exception) -> None:
+        super().__init__(str(cause))
+        self.cause = cause
+
+
+class _ConnectionPool:
+    """Keep-alive HTTP/1.1 connections to one host, reused across requests."""
+
+    def __init__(self, base_url: str, timeout_s: float) -> None:
+        parts = urlsplit(base_url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.ssl = ssl.create_default_context() if parts.scheme == "https" else None
+        self.netloc = parts.netloc
+        self.timeout_s = timeout_s
+        self.opened = 0
+        self._idle: list[tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+
+    async def _acquire(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter, bool]:
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.ssl), self.timeout_s
+        )
+        self.opened += 1
+        return reader, writer, False
+
+    async def _read_response(self, status_line: bytes, reader: asyncio.StreamReader) -> tuple[int, dict, bytes]:
+        status = int(status_line.split()[1])
+        headers: dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b"".join(chunks)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await reader.read()
+            headers["connection"] = "close"
+        return status, headers, body
+
+    async def _exchange(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, request: bytes
+    ) -> tuple[int, dict, bytes]:
+        try:
+            writer.write(request)
+            await writer.drain()
+            status_line = await reader.readline()
+        except (ConnectionError, OSError) as exc:
+            raise _NoResponse(exc) from exc
+        if not status_line:
+            raise _NoResponse(ConnectionError("connection closed by server"))
+        return await self._read_response(status_line, reader)
+
+    async def post_json(self, path: str, payload: dict, headers: dict[str, str]) -> dict:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        head = [f"POST {path} HTTP/1.1", f"Host: {self.netloc}", "Content-Type: application/json"]
+        head += [f"{k}: {v}" for k, v in headers.items()]
+        head.append(f"Content-Length: {len(body)}")
+        request = ("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body
+        for attempt in range(2):
+            reader, writer, reused = await self._acquire()
+            try:
+                # One budget for the whole exchange: a server that stops reading
+                # stalls ``drain`` just as one that never answers stalls the read.
+                status, resp_headers, data = await asyncio.wait_for(
+                    self._exchange(reader, writer, request), self.timeout_s
+                )
+            except _NoResponse as exc:
+                writer.close()
+                # Closed before any response byte: a reused keep-alive socket the
+                # server had already dropped, so the request never ran. Anything
+                # later (a timeout, a cut-off body) may have, and is not retried.
+                if reused and attempt == 0:
+                    continue
+                raise exc.cause from None
+            except BaseException:
+                writer.close()
+                raise
+            if resp_headers.get("connection", "").lower() == "close":
+                writer.close()
+            else:
+                self._idle.append((reader, writer))
+            if status != 200:
+                raise HTTPError(status, data)
+            return json.loads(data)
+        raise ConnectionError("unreachable")
+
+    def close(self) -> None:
+        for _, writer in self._idle:
+            writer.close()
+        self._idle = []
+
+
+def _media_url(uri: str, mode: str) -> str:
+    if uri.startswith(("http://", "https://", "data:")):
+        return uri
+    path = uri[len("file://") :] if uri.startswith("file://") else uri
+    if mode == "file":
+        return f"file://{os.path.abspath(path)}"
+    mime = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    with open(path, "rb") as f:
+        return f"data:{mime};base64,{base64.b64encode(f.read()).decode('ascii')}"
+
+
+def check_local_video(uri: str) -> None:
+    """Raise ``ValueError`` if a local video is missing, empty or (with PyAV) does not decode."""
+    if uri.startswith(("http://", "https://", "data:")):
+        return
+    path = uri[len("file://") :] if uri.startswith("file://") else uri
+    try:
+        entry = probe_video(path)
+    except ImportError:
+        size = os.path.getsize(path) if os.path.isfile(path) else -1
+        entry = {"ok": size > 0, "error": "missing file" if size < 0 else "empty file"}
+    if not entry["ok"]:
+        raise ValueError(f"failed to decode video {path}: {entry.get('error')}")
+
+
+def to_openai_messages(messages: list[dict], media_mode: str = "data") -> list[dict]:
+    """Convert Qwen-VL style messages to OpenAI chat content parts."""
+    converted: list[dict] = []
+    for msg in messages:
+        content = msg.get("content")
+        if isinstance(content, str):
+            converted.append({"role": msg["role"], "content": content})
+            continue
+        parts: list[dict] = []
+        for item in content or []:
+            kind = item.get("type")
+            if kind == "text":
+                parts.append({"type": "text", "text": item.get("text", "")})
+            elif kind == "image":
+                parts.append({"type": "image_url", "image_url": {"url": _media_url(item["image"], media_mode)}})
+            elif kind == "video":
+                parts.append({"type": "video_url", "video_url": {"url": _media_url(item["video"], media_mode)}})
+        converted.append({"role": msg["role"], "content": parts})
+    return converted
+
+
+def _without_media_uris(messages: list[dict]) -> list[dict]:
+    """``messages`` with every image/video item reduced to ``{"type": ...}``."""
+    stripped: list[dict] = []
+    for msg in messages:
+        content = msg.get("content")
+        if not isinstance(content, str):
+            content = [
+                {"type": item["type"]} if item.get("type") in ("image", "video") else item for item in content or []
+            ]
+        stripped.append(dict(msg, content=content))
+    return stripped
+
+
+class OpenAIChatBackend:
+    """Async client for an OpenAI-compatible ``/v1/chat/completions`` endpoint."""
+
+    name = "openai"
+
+    def __init__(
+        self,
+        base_url: str,
+        model: str,
+        schema: Optional[dict] = None,
+        temperature: float = 0.2,
+        max_tokens: int = 1200,
+        n: int = 1,
+        max_concurrency: int = 16,
+        timeout_s: float = 600.0,
+        api_key: Optional[str] = None,
+        media_mode: str = "data",
+    ) -> None:
+        if media_mode not in MEDIA_MODES:
+            raise ValueError(f"unknown media mode: {media_mode}")
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.schema = schema
+        self.media_mode = media_mode
+        self.max_concurrency = max_concurrency
+        self.processor = None
+        # Sampling fields in the shape result_cache.sampling_fingerprint reads.
+        self.sampling_params = SimpleNamespace(temperature=temperature, max_tokens=max_tokens, n=n)
+        self.errors = 0
+        self._path = urlsplit(self.base_url).path + "/chat/completions"
+        self._headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self._pool = _ConnectionPool(self.base_url, timeout_s)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="openai-backend", daemon=True)
+        self._thread.start()
+        self._semaphore = asyncio.run_coroutine_threadsafe(self._make_semaphore(), self._loop).result()
+
+    async def _make_semaphore(self) -> asyncio.Semaphore:
+        return asyncio.Semaphore(self.max_concurrency)
+
+    def render(self, messages: list[dict]) -> str:
+        # The server applies the chat template; the canonical request body
+        # stands in for the prompt (cache key, length estimate). Media appear
+        # only as their type: the result cache keys them by content digest, so
+        # moving the media tree must not change the prompt.
+        return json.dumps(_without_media_uris(messages), ensure_ascii=False, sort_keys=True)
+
+    def build_input(self, messages: list[dict], prompt: str) -> dict:
+        """Convert ``messages`` for the server; raises if a local video would not decode."""
+        media_counts = {"image": 0, "video": 0}
+        for msg in messages:
+            if not isinstance(msg.get("content"), str):
+                for item in msg.get("content") or []:
+                    if item.get("type") in media_counts:
+                        media_counts[item["type"]] += 1
+                    if item.get("type") == "video":
+                        check_local_video(item["video"])
+        return {
+            "prompt": prompt,
+            "messages": to_openai_messages(messages, self.media_mode),
+            "media_counts": media_counts,
+        }
+
+    def sampling_variant(self, schema: dict, max_tokens: int) -> SimpleNamespace:
+        sp = self.sampling_params
+        return SimpleNamespace(temperature=sp.temperature, max_tokens=max_tokens, n=sp.n, schema=schema)
+
+    def _payload(self, engine_input: dict, sampling_params: Any = None) -> dict:
+        sp = sampling_params or self.sampling_params
+        schema = getattr(sp, "schema", self.schema)
+        payload: dict = {
+            "model": self.model,
+            "messages": engine_input["messages"],
+            "temperature": sp.temperature,
+            "max_tokens": sp.max_tokens,
+            "n": sp.n,
+            "chat_template_kwargs": {"enable_thinking": False},
+        }
+        if schema is not None:
+            payload["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": "extraction", "schema": schema, "strict": True},
+            }
+        return payload
+
+    async def _complete(self, engine_input: dict, sampling_params: Any = None) -> ChatOutput:
+        async with self._semaphore:
+            # Connection failures propagate and stop the run (resume picks it up
+            # again); a request the server rejects or times out fails only that
+            # post, as an output with ``error`` set that is never written.
+            try:
+                resp = await self._pool.post_json(
+                    self._path, self._payload(engine_input, sampling_params), self._headers
+                )
+            except (HTTPError, asyncio.TimeoutError, ValueError) as exc:
+                self.errors += 1
+                # TimeoutError has no message; the type keeps ``error`` non-empty.
+                error = f"{type(exc).__name__}: {exc}"
+                print(f"[warn] chat completion failed: {error}", file=sys.stderr)
+                return ChatOutput([""], error=error)
+        choices = sorted(resp.get("choices") or [], key=lambda c: c.get("index", 0))
+        usage = resp.get("usage") or {}
+        details = usage.get("prompt_tokens_details") or {}
+        return ChatOutput(
+            [(c.get("message") or {}).get("content") or "" for c in choices] or [""],
+            num_prompt_tokens=usage.get("prompt_tokens") or 0,
+            num_cached_tokens=details.get("cached_tokens") or 0,
+            num_completion_tokens=usage.get("completion_tokens") or 0,
+            finish_reasons=[c.get("finish_reason") for c in choices] or None,
+        )
+
+    async def _complete_all(self, inputs: list[dict], sampling_params: list[Any]) -> list[ChatOutput]:
+        return list(await asyncio.gather(*(self._complete(item, sp) for item, sp in zip(inputs, sampling_params))))
+
+    def generate(self, inputs: list[dict], sampling_params: Optional[list[Any]] = None) -> list[ChatOutput]:
+        """Run all requests concurrently (bounded) and return outputs in input order."""
+        per_input = sampling_params if sampling_params is not None else [None] * len(inputs)
+        return asyncio.run_coroutine_threadsafe(self._complete_all(inputs, per_input), self._loop).result()
+
+    def stats(self) -> str:
+        return f"connections_opened={self._pool.opened} errors={self.errors} max_concurrency={self.max_concurrency}"
+
+    def close(self) -> None:
+        self._loop.call_soon_threadsafe(self._pool.close)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
@@ -0,0 +1,259 @@
+"""Pooled media downloader with a persistent, quota-bounded cache.
+
+Downloads for ``--allow-download-media`` used to go through ``urlretrieve``
+one URL at a time into a fresh temp dir per post, and were repeated on every
+run. Here:
+
+- a thread pool fetches URLs concurrently, and each worker thread keeps one
+  keep-alive ``http.client`` connection per host;
+- requests have a timeout and a bounded number of retries with backoff;
+- finished files land in ``<cache_dir>/<sha256(url)[:2]>/<sha256(url)><suffix>``,
+  so the next run (or another post with the same URL) is a cache hit;
+- the cache is LRU-evicted (by mtime, refreshed on every hit) down to
+  ``quota_bytes``. Paths ``download_many`` returns inside ``pinning()`` are
+  not evicted until the caller ``release``s them, so a concurrent post's
+  download, in this process or another one sharing the cache, cannot delete
+  a file a post is still reading (see ``disk_quota``).
+
+Usage:
+  python3 scripts/media_downloader.py --cache-dir processed_data/media_cache URL [URL ...]
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import http.client
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional
+from urllib.parse import urljoin, urlsplit
+
+from .disk_quota import DiskQuota, file_size, touch
+
+DEFAULT_CACHE_DIR = "processed_data/media_cache"
+USER_AGENT = "Mozilla/5.0 (switchable_persona media fetcher)"
+_MAX_REDIRECTS = 5
+
+
+class DownloadError(Exception):
+    pass
+
+
+class _HTTPStatusError(DownloadError):
+    def __init__(self, status: int, url: str) -> None:
+        super().__init__(f"HTTP {status} for {url}")
+        self.status = status
+
+
+class MediaDownloader:
+    def __init__(
+        self,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        quota_bytes: int = 20 << 30,
+        workers: int = 8,
+        timeout_s: float = 30.0,
+        retries: int = 2,
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.quota_bytes = quota_bytes
+        self.timeout_s = timeout_s
+        self.retries = retries
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="download")
+        self._local = threading.local()
+        # Re-entrant: a future that is already done runs its callback inline.
+        self._lock = threading.RLock()
+        self._inflight: dict[str, Future] = {}
+        self._quota = DiskQuota(cache_dir, quota_bytes)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def cache_path(self, url: str, suffix: str) -> str:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key + suffix)
+
+    # -- connections -------------------------------------------------------
+
+    def _connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = {}
+        conn = conns.get((scheme, netloc))
+        if conn is None:
+            cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            conn = conns[(scheme, netloc)] = cls(netloc, timeout=self.timeout_s)
+        return conn
+
+    def _drop_connection(self, scheme: str, netloc: str) -> None:
+        conn = getattr(self._local, "conns", {}).pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def _fetch_to(self, url: str, out_path: str) -> int:
+        for _ in range(_MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            if parts.scheme not in ("http", "https"):
+                raise DownloadError(f"unsupported URL scheme: {url}")
+            path = parts.path or "/"
+            if parts.query:
+                path += "?" + parts.query
+            conn = self._connection(parts.scheme, parts.netloc)
+            try:
+                conn.request("GET", path, headers={"User-Agent": USER_AGENT, "Connection": "keep-alive"})
+                resp = conn.getresponse()
+            except (OSError, http.client.HTTPException):
+                # Stale keep-alive socket or network error: reconnect on retry.
+                self._drop_connection(parts.scheme, parts.netloc)
+                raise
+            if resp.status in (301, 302, 303, 307, 308):
+                resp.read()
+                url = urljoin(url, resp.getheader("Location", ""))
+                continue
+            if resp.status != 200:
+                resp.read()
+                raise _HTTPStatusError(resp.status, url)
+            size = 0
+            with open(out_path, "wb") as f:
+                while True:
+                    chunk = resp.read(1 << 20)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    size += len(chunk)
+            expected = resp.getheader("Content-Length")
+            if expected is not None and expected.isdigit() and size != int(expected):
+                # ``read(amt)`` returns short at EOF instead of raising IncompleteRead.
+                self._drop_connection(parts.scheme, parts.netloc)
+                raise DownloadError(f"truncated download of {url}: {size} of {expected} bytes")
+            if resp.will_close:
+                self._drop_connection(parts.scheme, parts.netloc)
+            return size
+        raise DownloadError(f"too many redirects for {url}")
+
+    # -- cache ---------------------------------------------------------------
+
+    def _download(self, url: str, suffix: str) -> str:
+        final_path = self.cache_path(url, suffix)
+        if os.path.isfile(final_path):
+            touch(final_path)
+            with self._lock:
+                self.hits += 1
+            return final_path
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        tmp_path = f"{final_path}.part.{os.getpid()}.{threading.get_ident()}"
+        last_exc: Optional[BaseException] = None
+        for attempt in range(self.retries + 1):
+            try:
+                size = self._fetch_to(url, tmp_path)
+                # Another process may have fetched the same URL meanwhile.
+                replaced = file_size(final_path)
+                os.replace(tmp_path, final_path)
+                with self._lock:
+                    self.misses += 1
+                self._quota.add(size, replaced)
+                return final_path
+            except (OSError, http.client.HTTPException, DownloadError) as exc:
+                last_exc = exc
+                if isinstance(exc, _HTTPStatusError) and exc.status < 500:
+                    break
+                if attempt < self.retries:
+                    time.sleep(0.5 * (2**attempt))
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        with self._lock:
+            self.failures += 1
+        raise DownloadError(f"failed to download {url}: {last_exc}")
+
+    # -- public API ------------------------------------------------------------
+
+    def submit(self, url: str, suffix: str) -> Future:
+        """Schedule ``url``; concurrent requests for the same URL share one download."""
+        key = self.cache_path(url, suffix)
+        with self._lock:
+            fut = self._inflight.get(key)
+            if fut is None:
+                fut = self._pool.submit(self._download, url, suffix)
+                self._inflight[key] = fut
+                fut.add_done_callback(lambda _f, k=key: self._forget(k))
+        return fut
+
+    def _forget(self, key: str) -> None:
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    @contextmanager
+    def pinning(self) -> Iterator[list[str]]:
+        """Pin what ``download_many`` returns on this thread; the caller ``release``s the list."""
+        previous = getattr(self._local, "pins", None)
+        pins: list[str] = []
+        self._local.pins = pins
+        try:
+            yield pins
+        finally:
+            self._local.pins = previous
+
+    def release(self, paths: Iterable[str]) -> None:
+        for path in paths:
+            self._quota.unpin(path)
+
+    def download_many(self, urls: Iterable[str], suffix: str) -> list[str]:
+        """Local paths of the URLs that could be fetched, in input order; failures are skipped."""
+        pins = getattr(self._local, "pins", None)
+        keys = [self.cache_path(url, suffix) for url in urls]
+        if pins is not None:
+            # Pinned before submitting, so no other download's eviction can
+            # slip in between this file landing and the caller reading it.
+            for key in keys:
+                self._quota.pin(key)
+        futures = [self.submit(url, suffix) for url in urls]
+        local_paths: list[str] = []
+        for key, fut in zip(keys, futures):
+            try:
+                local_paths.append(fut.result())
+            except DownloadError as exc:
+                print(f"[warn] {exc}", file=sys.stderr)
+                if pins is not None:
+                    self._quota.unpin(key)
+                continue
+            if pins is not None:
+                pins.append(key)
+        return local_paths
+
+    def stats(self) -> str:
+        return (
+            f"hits={self.hits} downloads={self.misses} failures={self.failures} "
+            f"evicted={self._quota.evicted}"
+        )
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=True)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Fetch media URLs into the shared download cache")
+    parser.add_argument("urls", nargs="+")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--suffix", default="")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    downloader = MediaDownloader(cache_dir=args.cache_dir, workers=args.workers)
+    try:
+        for path in downloader.download_many(args.urls, args.suffix):
+            print(path)
+    finally:
+        downloader.close()
+    print(f"[download] {downloader.stats()}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
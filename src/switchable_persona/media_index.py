@@ -0,0 +1,144 @@
+"""Basename -> path index for crawler media trees (img/, video/).
+
+The crawler stores media under ``<media_root>/img/...`` and
+``<media_root>/video/...`` next to the weibo JSON. Looking a basename up used to
+mean a full ``os.walk`` per lookup; here each subtree is walked once, the
+resulting map is persisted to ``<media_root>/.media_index.json.gz`` and reused
+until the mtime of any directory in the subtree changes (adding, removing or
+renaming a file bumps its parent directory's mtime).
+
+Usage:
+  python3 scripts/media_index.py --weibo-root weibo
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import threading
+from typing import Iterable
+
+INDEX_NAME = ".media_index.json.gz"
+INDEX_VERSION = 1
+MEDIA_KINDS = ("img", "video")
+
+_lock = threading.Lock()
+_indexes: dict[str, dict] = {}
+
+
+def _scan(root: str) -> dict:
+    """Walk ``root`` once and record directory mtimes and first-seen basenames."""
+    dirs: dict[str, int] = {}
+    files: dict[str, str] = {}
+    if not os.path.isdir(root):
+        return {"dirs": dirs, "files": files}
+    for dirpath, _, filenames in os.walk(root):
+        rel_dir = os.path.relpath(dirpath, root)
+        try:
+            dirs[rel_dir] = os.stat(dirpath).st_mtime_ns
+        except OSError:
+            continue
+        for name in filenames:
+            # Keep the first hit in walk order, matching the old per-lookup walk.
+            files.setdefault(name, rel_dir)
+    return {"dirs": dirs, "files": files}
+
+
+def _is_fresh(root: str, entry: dict) -> bool:
+    dirs = entry.get("dirs") or {}
+    if not dirs:
+        return not os.path.isdir(root)
+    for rel_dir, mtime_ns in dirs.items():
+        try:
+            if os.stat(os.path.join(root, rel_dir)).st_mtime_ns != mtime_ns:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def _read_index(path: str) -> dict:
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != INDEX_VERSION:
+        return {}
+    return data.get("kinds") or {}
+
+
+def _write_index(path: str, kinds: dict) -> None:
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    try:
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "kinds": kinds}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as exc:
+        # A read-only media root still works; it just rebuilds next run.
+        print(f"[warn] cannot persist media index {path}: {exc}", file=sys.stderr)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def load_media_index(media_root: str, rebuild: bool = False) -> dict:
+    """Return ``{kind: {"dirs": ..., "files": ...}}`` for ``media_root``, refreshing stale kinds."""
+    media_root = os.path.abspath(media_root)
+    with _lock:
+        cached = _indexes.get(media_root)
+        if cached is not None and not rebuild:
+            return cached
+        index_path = os.path.join(media_root, INDEX_NAME)
+        kinds = {} if rebuild else _read_index(index_path)
+        changed = False
+        for kind in MEDIA_KINDS:
+            root = os.path.join(media_root, kind)
+            entry = kinds.get(kind)
+            if entry is None or not _is_fresh(root, entry):
+                kinds[kind] = _scan(root)
+                changed = True
+        if changed and os.path.isdir(media_root):
+            _write_index(index_path, kinds)
+        _indexes[media_root] = kinds
+        return kinds
+
+
+def find_media(media_root: str, kind: str, basenames: Iterable[str]) -> list[str]:
+    """Resolve basenames under ``<media_root>/<kind>`` in O(1) each; unknown names are skipped."""
+    if not media_root:
+        return []
+    entry = load_media_index(media_root).get(kind) or {}
+    files = entry.get("files") or {}
+    root = os.path.join(media_root, kind)
+    found: list[str] = []
+    for base in basenames:
+        rel_dir = files.get(base)
+        if rel_dir is not None:
+            found.append(os.path.normpath(os.path.join(root, rel_dir, base)))
+    return found
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Build media basename indexes for every weibo JSON folder")
+    parser.add_argument("--weibo-root", required=True, help="Root dir that contains weibo JSON folders")
+    parser.add_argument("--rebuild", action="store_true", help="Ignore persisted indexes and rescan")
+    args = parser.parse_args()
+
+    media_roots = set()
+    for dirpath, _, filenames in os.walk(args.weibo_root):
+        if any(name.endswith(".json") for name in filenames):
+            media_roots.add(dirpath)
+    for media_root in sorted(media_roots):
+        kinds = load_media_index(media_root, rebuild=args.rebuild)
+        counts = " ".join(f"{kind}={len(kinds[kind]['files'])}" for kind in MEDIA_KINDS)
+        print(f"[media_index] {media_root} {counts}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,299 @@
+"""Output sinks for extraction records.
+
+Formats:
+  jsonl   one JSONL file (plus its resume ledger)
+  files   the JSONL plus one pretty-printed ``<post_id>.json`` per post in
+          ``output_dir`` (the original behaviour; the annotation server reads it)
+  shards  size-rotated JSONL shards ``<stem>-00000.jsonl``, ``<stem>-00001.jsonl``,
+          ... each with its own ledger
+
+JSONL writes go through a large userspace buffer. Records are flushed at the
+end of each batch, or at most every ``flush_interval_s`` seconds, and
+optionally fsynced. Ledger entries are only written once the records they
+point to have been flushed, so the ledger never runs ahead of the data.
+"""
+
+from __future__ import annotations
+
+import glob
+import json
+import os
+import threading
+import time
+from typing import IO, Any, Optional
+
+from .resume_ledger import append_entries, ledger_path, load_ledger, replace_records
+
+OUTPUT_FORMATS = ("jsonl", "files", "shards")
+FLUSH_POLICIES = ("batch", "interval", "close")
+
+
+class JsonlSink:
+    """Buffered append-only JSONL writer with a resume ledger."""
+
+    def __init__(
+        self,
+        output: str,
+        buffer_bytes: int = 1 << 20,
+        flush_policy: str = "batch",
+        flush_interval_s: float = 5.0,
+        fsync: bool = False,
+    ) -> None:
+        if flush_policy not in FLUSH_POLICIES:
+            raise ValueError(f"unknown flush policy: {flush_policy}")
+        self.output = output
+        self.flush_policy = flush_policy
+        self.flush_interval_s = flush_interval_s
+        self.fsync = fsync
+        self.records = 0
+        self.bytes_written = 0
+        out_dir = os.path.dirname(output)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+        self._terminate_partial_line()
+        self._out = open(output, "ab", buffering=buffer_bytes)
+        self._ledger = open(ledger_path(output), "a", encoding="utf-8")
+        self._pending: list[tuple[str, int]] = []
+        self._last_flush = time.monotonic()
+
+    def _terminate_partial_line(self) -> None:
+        if not os.path.isfile(self.output) or os.path.getsize(self.output) == 0:
+            return
+        with open(self.output, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                # Terminate a record truncated by an interrupted run.
+                f.write(b"\n")
+
+    def size(self) -> int:
+        return self._out.tell()
+
+    def write(self, post_id: str, line: dict) -> None:
+        data = (json.dumps(line, ensure_ascii=False) + "\n").encode("utf-8")
+        self._pending.append((post_id, self._out.tell()))
+        self._out.write(data)
+        self.records += 1
+        self.bytes_written += len(data)
+
+    def end_batch(self) -> None:
+        if self.flush_policy == "batch":
+            self.flush()
+        elif self.flush_policy == "interval" and time.monotonic() - self._last_flush >= self.flush_interval_s:
+            self.flush()
+
+    def flush(self) -> None:
+        self._out.flush()
+        if self.fsync:
+            os.fsync(self._out.fileno())
+        if self._pending:
+            append_entries(self._ledger, self._pending)
+            if self.fsync:
+                os.fsync(self._ledger.fileno())
+            self._pending = []
+        self._last_flush = time.monotonic()
+
+    def close(self) -> None:
+        self.flush()
+        self._out.close()
+        self._ledger.close()
+
+
+class FilesSink(JsonlSink):
+    """JSONL plus a pretty-printed JSON file per post in ``output_dir``."""
+
+    def __init__(self, output: str, output_dir: str, **kwargs) -> None:
+        super().__init__(output, **kwargs)
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+
+    def write(self, post_id: str, line: dict) -> None:
+        super().write(post_id, line)
+        with open(os.path.join(self.output_dir, f"{post_id}.json"), "w", encoding="utf-8") as fp:
+            json.dump(line, fp, ensure_ascii=False, indent=2)
+
+
+def shard_paths(output: str) -> list[str]:
+    stem, ext = os.path.splitext(output)
+    return sorted(glob.glob(f"{glob.escape(stem)}-[0-9][0-9][0-9][0-9][0-9]{ext or '.jsonl'}"))
+
+
+class ShardedSink:
+    """JSONL shards rotated once the current shard exceeds ``max_bytes``."""
+
+    def __init__(self, output: str, max_bytes: int = 1 << 30, **kwargs) -> None:
+        self.output = output
+        self.max_bytes = max_bytes
+        self.kwargs = kwargs
+        self.records = 0
+        self.bytes_written = 0
+        existing = shard_paths(output)
+        self._index = len(existing) - 1 if existing else 0
+        self._sink = self._open(self._index)
+
+    def _open(self, index: int) -> JsonlSink:
+        stem, ext = os.path.splitext(self.output)
+        return JsonlSink(f"{stem}-{index:05d}{ext or '.jsonl'}", **self.kwargs)
+
+    def write(self, post_id: str, line: dict) -> None:
+        if self._sink.size() >= self.max_bytes:
+            self._sink.close()
+            self._index += 1
+            self._sink = self._open(self._index)
+        before = self._sink.bytes_written
+        self._sink.write(post_id, line)
+        self.records += 1
+        self.bytes_written += self._sink.bytes_written - before
+
+    def end_batch(self) -> None:
+        self._sink.end_batch()
+
+    def flush(self) -> None:
+        self._sink.flush()
+
+    def close(self) -> None:
+        self._sink.close()
+
+
+class TeeSink:
+    """Writes every record to ``primary`` and ``secondary``; counts come from ``primary``."""
+
+    def __init__(self, primary: Any, secondary: Any) -> None:
+        self.primary = primary
+        self.secondary = secondary
+
+    @property
+    def records(self) -> int:
+        return self.primary.records
+
+    @property
+    def bytes_written(self) -> int:
+        return self.primary.bytes_written
+
+    def write(self, post_id: str, line: dict) -> None:
+        self.primary.write(post_id, line)
+        self.secondary.write(post_id, line)
+
+    def end_batch(self) -> None:
+        self.primary.end_batch()
+        self.secondary.end_batch()
+
+    def flush(self) -> None:
+        self.primary.flush()
+        self.secondary.flush()
+
+    def close(self) -> None:
+        try:
+            self.primary.close()
+        finally:
+            self.secondary.close()
+
+
+def open_sink(
+    output_format: str,
+    output: str,
+    output_dir: str,
+    shard_max_bytes: int = 1 << 30,
+    **kwargs,
+):
+    if output_format == "jsonl":
+        return JsonlSink(output, **kwargs)
+    if output_format == "files":
+        return FilesSink(output, output_dir, **kwargs)
+    if output_format == "shards":
+        return ShardedSink(output, max_bytes=shard_max_bytes, **kwargs)
+    raise ValueError(f"unknown output format: {output_format}")
+
+
+def record_paths(output: str) -> list[str]:
+    """Every JSONL a sink may have written at ``output``: the single file (jsonl/files) and its shards.
+
+    Both layouts are read regardless of the current ``--output-format``, so
+    switching formats between runs neither re-extracts nor misses posts.
+    """
+    return [output] + shard_paths(output)
+
+
+def completed_post_ids(output: str) -> set[str]:
+    """post_ids already written at ``output``, in either layout."""
+    done: set[str] = set()
+    for path in record_paths(output):
+        done.update(load_ledger(path))
+    return done
+
+
+def patch_records(output_format: str, output: str, output_dir: str, replacements: dict[str, dict]) -> set[str]:
+    """Replace already written records in place (used by ``--repair``); return the post_ids patched.
+
+    ``replacements`` maps post_id to the full record line. Posts not found in
+    the output are left out of the result.
+    """
+    remaining = dict(replacements)
+    patched: set[str] = set()
+    for path in record_paths(output):
+        if not remaining:
+            break
+        if not os.path.isfile(path):
+            continue
+        done = replace_records(path, remaining)
+        patched |= done
+        for post_id in done:
+            del remaining[post_id]
+    if output_format == "files":
+        for post_id in patched:
+            with open(os.path.join(output_dir, f"{post_id}.json"), "w", encoding="utf-8") as fp:
+                json.dump(replacements[post_id], fp, ensure_ascii=False, indent=2)
+    return patched
+
+
+class BadVideoLog:
+    """Appends bad-video entries to a JSONL log as they happen (thread-safe).
+
+    Exposes ``append`` so it can stand in for the list the extraction code used
+    to collect entries in. A ``(post_id, video_path)`` already in the log (from
+    this run, an earlier one, or ``--repair`` re-running the post) is not
+    written again.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.count = 0
+        self.duplicates = 0
+        self._lock = threading.Lock()
+        self._f: Optional[IO[str]] = None
+        self._seen: set[tuple[str, str]] = set()
+
+    def _load_seen(self) -> None:
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(entry, dict):
+                    self._seen.add((str(entry.get("post_id", "")), str(entry.get("video_path", ""))))
+
+    def append(self, item: dict) -> None:
+        line = json.dumps(item, ensure_ascii=False) + "\n"
+        key = (str(item.get("post_id", "")), str(item.get("video_path", "")))
+        with self._lock:
+            if self._f is None:
+                log_dir = os.path.dirname(self.path)
+                if log_dir:
+                    os.makedirs(log_dir, exist_ok=True)
+                self._load_seen()
+                self._f = open(self.path, "a", encoding="utf-8")
+            if key in self._seen:
+                self.duplicates += 1
+                return
+            self._seen.add(key)
+            self._f.write(line)
+            self._f.flush()
+            self.count += 1
+
+    def close(self) -> None:
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
@@ -0,0 +1,163 @@
+"""Canonical post registry: one extraction per distinct post across all crawls.
+
+The same post shows up in several weibo JSON folders (re-crawls, overlapping
+date ranges, retweets of identical content). This script walks a crawl root
+and fingerprints every post by its normalised text, its media (picture and
+video URL basenames) and, for retweets, the retweeted post. Each fingerprint
+gets one canonical occurrence — the first in sorted file order — and the
+registry records every ``(weibo_json, post_id)`` it was seen under.
+
+Registry file (JSONL, one line per canonical post; paths relative to the
+crawl root so shards on other nodes agree):
+
+  {"fingerprint": "...", "post_id": "...", "weibo_json": "user/123.json",
+   "occurrences": [{"weibo_json": "...", "post_id": "..."}, ...]}
+
+``extract_all_weibo.py --post-registry`` then only extracts canonical
+occurrences. Posts missing from the registry (a newer crawl) are extracted as
+before.
+
+Usage:
+  python3 scripts/post_registry.py --weibo-root weibo --registry processed_data/post_registry.jsonl
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from typing import Iterable, Optional
+
+from .weibo_stream import iter_posts
+
+DEFAULT_REGISTRY = "processed_data/post_registry.jsonl"
+
+
+def _url_names(value: object) -> list[str]:
+    if not isinstance(value, str) or value == "无":
+        return []
+    return sorted(os.path.basename(u.strip()) for u in value.split(",") if u.strip())
+
+
+def post_fingerprint(post: dict) -> str:
+    """Content + media fingerprint of a post; independent of its id and crawl file."""
+    text = " ".join(str(post.get("content") or "").split())
+    media = [
+        "img=" + ",".join(_url_names(post.get("original_pictures"))),
+        "rimg=" + ",".join(_url_names(post.get("retweet_pictures"))),
+        "video=" + ",".join(_url_names(post.get("video_url"))),
+    ]
+    parts = [text, *media]
+    retweet = post.get("retweet")
+    if isinstance(retweet, dict):
+        parts.append(f"retweet={retweet.get('id', '')}:{' '.join(str(retweet.get('content') or '').split())}")
+    elif not text and all(m.endswith("=") for m in media):
+        # Nothing to compare by (empty text, no media): only the id identifies it.
+        parts.append(f"id={post.get('id', '')}")
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def _iter_sorted_jsons(root: str) -> Iterable[str]:
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.endswith(".json"):
+                yield os.path.join(dirpath, name)
+
+
+def build_registry(weibo_root: str) -> tuple[dict[str, dict], dict[str, int]]:
+    """Scan ``weibo_root``; return ``({fingerprint: entry}, stats)``."""
+    entries: dict[str, dict] = {}
+    by_id: dict[str, str] = {}
+    stats = {"posts": 0, "same_id": 0, "same_content": 0}
+    for weibo_json in _iter_sorted_jsons(weibo_root):
+        rel = os.path.relpath(weibo_json, weibo_root)
+        for post in iter_posts(weibo_json):
+            post_id = str(post.get("id", ""))
+            if not post_id:
+                continue
+            stats["posts"] += 1
+            # A re-crawled post may have edited text; its id still ties it
+            # to the first occurrence.
+            fingerprint = by_id.get(post_id) or post_fingerprint(post)
+            entry = entries.get(fingerprint)
+            occurrence = {"weibo_json": rel, "post_id": post_id}
+            if entry is None:
+                entries[fingerprint] = {
+                    "fingerprint": fingerprint,
+                    "post_id": post_id,
+                    "weibo_json": rel,
+                    "occurrences": [occurrence],
+                }
+            else:
+                stats["same_id" if entry["post_id"] == post_id else "same_content"] += 1
+                entry["occurrences"].append(occurrence)
+            by_id.setdefault(post_id, fingerprint)
+    return entries, stats
+
+
+class PostRegistry:
+    """Canonical occurrence lookup loaded from a registry file."""
+
+    def __init__(self, path: str, weibo_root: str) -> None:
+        self.path = path
+        self.weibo_root = weibo_root
+        self.duplicates = 0
+        self.unregistered = 0
+        self._canonical: dict[str, tuple[str, str]] = {}
+        self._by_id: dict[str, str] = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                self._canonical[entry["fingerprint"]] = (entry["post_id"], entry["weibo_json"])
+                for occ in entry["occurrences"]:
+                    self._by_id.setdefault(occ["post_id"], entry["fingerprint"])
+
+    def __len__(self) -> int:
+        return len(self._canonical)
+
+    def canonical(self, post: dict) -> Optional[tuple[str, str]]:
+        """``(post_id, weibo_json)`` of the canonical occurrence, or None if unregistered."""
+        fingerprint = self._by_id.get(str(post.get("id", ""))) or post_fingerprint(post)
+        return self._canonical.get(fingerprint)
+
+    def is_duplicate(self, post: dict, weibo_json: str) -> bool:
+        """True if this occurrence is not the canonical one and should not be extracted."""
+        canonical = self.canonical(post)
+        if canonical is None:
+            self.unregistered += 1
+            return False
+        rel = os.path.relpath(weibo_json, self.weibo_root)
+        if canonical == (str(post.get("id", "")), rel):
+            return False
+        self.duplicates += 1
+        return True
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Build the canonical post registry for a weibo crawl")
+    parser.add_argument("--weibo-root", required=True, help="Root dir that contains weibo JSON folders")
+    parser.add_argument("--registry", default=DEFAULT_REGISTRY, help="Registry output (JSONL)")
+    args = parser.parse_args()
+
+    entries, stats = build_registry(args.weibo_root)
+    reg_dir = os.path.dirname(args.registry)
+    if reg_dir:
+        os.makedirs(reg_dir, exist_ok=True)
+    tmp_path = f"{args.registry}.tmp.{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for entry in entries.values():
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, args.registry)
+    print(
+        f"[registry] posts={stats['posts']} canonical={len(entries)} "
+        f"duplicate_id={stats['same_id']} duplicate_content={stats['same_content']} -> {args.registry}",
+        file=sys.stderr,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,166 @@
+"""Repair queue for extraction outputs that came back unusable.
+
+A post lands in the queue when its output
+
+  parse_error  is not valid JSON (the record holds ``{"_raw": ...}``),
+  truncated    stopped at ``max_tokens`` (finish_reason ``length``), or
+  schema       parsed but does not match ``SCHEMA_JSON``.
+
+The queue is a JSONL file next to the outputs, one entry per failed post:
+
+  {"post_id": "...", "weibo_json": "...", "reason": "schema: $.style.tone[0]: ...",
+   "attempt": 0, "created_at": "..."}
+
+``extract_all_weibo.py`` appends to it while writing records, and
+``extract_all_weibo.py --repair`` re-runs only the queued posts (larger token
+budget, lower temperature), patches the fixed records into the output in
+place and rewrites the queue with whatever still fails.
+
+Usage:
+  python3 scripts/repair_queue.py --queue processed_data/repair_queue.jsonl
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import threading
+from collections import Counter
+from typing import IO, Any, Optional
+
+DEFAULT_QUEUE = "processed_data/repair_queue.jsonl"
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "boolean": bool,
+}
+
+
+def schema_errors(value: Any, schema: dict, path: str = "$", limit: int = 5) -> list[str]:
+    """Violations of ``schema`` by ``value`` (type/required/properties/additionalProperties/items/enum only)."""
+    errors: list[str] = []
+    expected = schema.get("type")
+    if expected in _TYPES:
+        ok = isinstance(value, _TYPES[expected]) and not (expected in ("number", "integer") and isinstance(value, bool))
+        if not ok:
+            return [f"{path}: expected {expected}, got {type(value).__name__}"]
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append(f"{path}: {value!r} not in enum")
+    if isinstance(value, dict):
+        properties = schema.get("properties") or {}
+        for key in schema.get("required") or []:
+            if key not in value:
+                errors.append(f"{path}: missing {key!r}")
+        if schema.get("additionalProperties") is False:
+            errors += [f"{path}: unexpected {key!r}" for key in value if key not in properties]
+        for key, sub in properties.items():
+            if key in value and len(errors) < limit:
+                errors += schema_errors(value[key], sub, f"{path}.{key}", limit - len(errors))
+    elif isinstance(value, list) and isinstance(schema.get("items"), dict):
+        for i, item in enumerate(value):
+            if len(errors) >= limit:
+                break
+            errors += schema_errors(item, schema["items"], f"{path}[{i}]", limit - len(errors))
+    return errors[:limit]
+
+
+def repair_reason(extraction: Any, finish_reason: Optional[str], schema: dict) -> Optional[str]:
+    """Why an output needs repair, or None if it is usable."""
+    if isinstance(extraction, dict) and "_raw" in extraction:
+        return "truncated" if finish_reason == "length" else "parse_error"
+    if finish_reason == "length":
+        return "truncated"
+    errors = schema_errors(extraction, schema, limit=1)
+    if errors:
+        return f"schema: {errors[0]}"
+    return None
+
+
+def reason_kind(reason: str) -> str:
+    return reason.split(":", 1)[0]
+
+
+class RepairQueue:
+    """Append-only writer for queue entries (thread-safe, file opened on first use)."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        self._f: Optional[IO[str]] = None
+
+    def append(self, entry: dict) -> None:
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._f is None:
+                queue_dir = os.path.dirname(self.path)
+                if queue_dir:
+                    os.makedirs(queue_dir, exist_ok=True)
+                self._f = open(self.path, "a", encoding="utf-8")
+            self._f.write(line)
+            self._f.flush()
+            self.count += 1
+
+    def close(self) -> None:
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+
+
+def load_queue(path: str) -> dict[str, dict]:
+    """``{post_id: entry}``; a later entry for the same post replaces an earlier one."""
+    entries: dict[str, dict] = {}
+    if not os.path.isfile(path):
+        return entries
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(entry, dict) and entry.get("post_id"):
+                entries[entry["post_id"]] = entry
+    return entries
+
+
+def write_queue(path: str, entries: list[dict]) -> None:
+    """Replace the queue with ``entries`` (atomically)."""
+    queue_dir = os.path.dirname(path)
+    if queue_dir:
+        os.makedirs(queue_dir, exist_ok=True)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Summarise the extraction repair queue")
+    parser.add_argument("--queue", default=DEFAULT_QUEUE)
+    parser.add_argument("--list", action="store_true", help="Print one line per queued post")
+    args = parser.parse_args()
+
+    entries = load_queue(args.queue)
+    if args.list:
+        for entry in entries.values():
+            print(f"{entry['post_id']}\t{entry.get('attempt', 0)}\t{entry.get('reason', '')}")
+    kinds = Counter(reason_kind(entry.get("reason", "")) for entry in entries.values())
+    attempts = Counter(entry.get("attempt", 0) for entry in entries.values())
+    fields = [f"queued={len(entries)}"]
+    fields += [f"{kind}={count}" for kind, count in kinds.most_common()]
+    if attempts:
+        fields.append("attempts=" + ",".join(f"{a}:{c}" for a, c in sorted(attempts.items())))
+    print(f"[repair-queue] {' '.join(fields)}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
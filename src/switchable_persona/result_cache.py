@@ -0,0 +1,206 @@
+"""Content-addressed cache of extraction outputs.
+
+A rerun of ``extract_all_weibo.py`` with new output paths used to redo every
+inference even when nothing that affects the result had changed. Entries
+here are keyed by a hash of everything that does:
+
+- model path, ``SCHEMA_JSON`` and the sampling parameters (the namespace,
+  fixed for a run);
+- the rendered prompt;
+- the sha256 of every image and video file the prompt references.
+
+Media enter the key by content only, never by path, so moving or
+re-mirroring the media tree keeps every entry. The model is identified by its
+path (``--model``) alone: weights replaced under the same path, or a
+different server behind ``--backend openai``, still hit the old entries.
+The cache is therefore opt-in (``extract_all_weibo.py --result-cache-dir``);
+point it at a fresh directory or ``--drop-model`` after changing weights.
+
+A hit returns the model's raw output text without preprocessing media or
+touching the engine. Outputs that need repair (not JSON, truncated, or not
+matching the schema; see ``repair_queue``) are not cached, so they are
+retried on the next run.
+
+Entries are ``<cache_dir>/<key[:2]>/<key>.json`` holding the output text and
+the model that produced it; the tree is size-capped with LRU eviction (see
+``disk_quota``).
+
+Usage:
+  python3 scripts/result_cache.py --cache-dir processed_data/result_cache --list
+  python3 scripts/result_cache.py --cache-dir processed_data/result_cache --drop-model ~/models/old
+  python3 scripts/result_cache.py --cache-dir processed_data/result_cache --keep-model ~/models/current
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Iterable, Optional
+
+from .content_hash import FileDigests
+from .disk_quota import DiskQuota, file_size, touch
+
+DEFAULT_CACHE_DIR = "processed_data/result_cache"
+# Bump when the meaning of a cached output changes without the prompt changing.
+CACHE_VERSION = 1
+
+_SAMPLING_FIELDS = (
+    "n",
+    "temperature",
+    "top_p",
+    "top_k",
+    "min_p",
+    "seed",
+    "max_tokens",
+    "min_tokens",
+    "presence_penalty",
+    "frequency_penalty",
+    "repetition_penalty",
+    "stop",
+)
+
+
+def sampling_fingerprint(sampling_params: Any) -> dict:
+    """Plain-data view of the sampling fields that change outputs (guided decoding is keyed via the schema)."""
+    fields = {}
+    for name in _SAMPLING_FIELDS:
+        value = getattr(sampling_params, name, None)
+        if value is not None:
+            fields[name] = value if isinstance(value, (int, float, str, bool)) else repr(value)
+    return fields
+
+
+class ResultCache:
+    def __init__(
+        self,
+        cache_dir: str,
+        model: str,
+        schema: Any,
+        sampling_params: Any,
+        max_bytes: int = 2 << 30,
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.model = model
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        namespace = {
+            "version": CACHE_VERSION,
+            "model": model,
+            "schema": schema,
+            "sampling": sampling_fingerprint(sampling_params),
+        }
+        self.namespace = hashlib.sha256(
+            json.dumps(namespace, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+        self._digests = FileDigests()
+        self._quota = DiskQuota(cache_dir, max_bytes)
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, prompt: str, media_paths: Iterable[str]) -> str:
+        h = hashlib.sha256()
+        h.update(self.namespace.encode("ascii"))
+        h.update(b"\0")
+        h.update(prompt.encode("utf-8"))
+        for path in media_paths:
+            h.update(b"\0")
+            h.update(self._digests.sha256(path).encode("ascii"))
+        return h.hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._entry_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = json.load(f)["text"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        touch(path)
+        return text
+
+    def record(self, hit: bool) -> None:
+        """Count one post as served from the cache or generated."""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def put(self, key: str, text: str) -> None:
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(
+            {"model": self.model, "created_at": datetime.now(timezone.utc).isoformat(), "text": text},
+            ensure_ascii=False,
+        ).encode("utf-8")
+        tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        replaced = file_size(path)
+        os.replace(tmp_path, path)
+        self._quota.add(len(data), replaced)
+        with self._lock:
+            self.stores += 1
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        return (
+            f"hits={self.hits} misses={self.misses} "
+            f"hit_rate={self.hits / lookups if lookups else 0.0:.3f} stored={self.stores} "
+            f"evicted={self._quota.evicted}"
+        )
+
+
+def _iter_entries(cache_dir: str) -> Iterable[tuple[str, Optional[str]]]:
+    """Yield ``(path, model)`` for every entry; model is None for unreadable entries."""
+    for dirpath, _, filenames in os.walk(cache_dir):
+        for name in filenames:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    model = json.load(f).get("model")
+            except (OSError, ValueError, AttributeError):
+                model = None
+            yield path, model
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Inspect or prune the extraction result cache")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--list", action="store_true", help="Count entries per model")
+    parser.add_argument("--drop-model", action="append", default=[], help="Remove entries of this model (repeatable)")
+    parser.add_argument("--keep-model", action="append", default=[], help="Remove entries of every other model (repeatable)")
+    args = parser.parse_args()
+    if args.drop_model and args.keep_model:
+        parser.error("use either --drop-model or --keep-model")
+
+    drop = {os.path.expanduser(m) for m in args.drop_model}
+    keep = {os.path.expanduser(m) for m in args.keep_model}
+    counts: Counter = Counter()
+    removed = 0
+    for path, model in _iter_entries(args.cache_dir):
+        if (drop and (model in drop or model is None)) or (keep and model not in keep):
+            os.remove(path)
+            removed += 1
+            continue
+        counts[model] += 1
+    if args.list or not (drop or keep):
+        for model, count in counts.most_common():
+            print(f"{count}\t{model}")
+    print(f"[result-cache] kept={sum(counts.values())} removed={removed}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
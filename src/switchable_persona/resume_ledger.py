@@ -0,0 +1,177 @@
+"""Append-only ledger of completed post_ids for an extractions JSONL.
+
+Each ledger line is ``<post_id>\\t<byte offset of the record in the JSONL>``.
+Loading it is a plain split per line, so ``--resume`` no longer has to decode
+every (large) JSONL record just to learn which posts are done. The ledger
+lives next to the JSONL as ``<output>.ledger``.
+
+If a run dies between writing a JSONL record and its ledger line, the next
+load notices that the JSONL extends past the last ledgered record and indexes
+the tail. A missing ledger is rebuilt from the JSONL once.
+
+Usage:
+  python3 scripts/resume_ledger.py --output processed_data/extractions.jsonl --rebuild
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import sys
+from typing import IO, Iterable, Optional
+
+LEDGER_SUFFIX = ".ledger"
+
+_POST_ID_RE = re.compile(rb'^\{"meta": \{"post_id": "((?:[^"\\]|\\.)*)"')
+
+
+def ledger_path(output: str) -> str:
+    return output + LEDGER_SUFFIX
+
+
+def _record_post_id(line: bytes) -> Optional[str]:
+    # Records written by extract_all_weibo.py start with meta.post_id, so the
+    # common case needs no JSON decode at all.
+    m = _POST_ID_RE.match(line)
+    if m:
+        return json.loads(b'"' + m.group(1) + b'"')
+    try:
+        rec = json.loads(line)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    if not isinstance(rec, dict):
+        return None
+    meta = rec.get("meta") if isinstance(rec.get("meta"), dict) else {}
+    result = rec.get("result") if isinstance(rec.get("result"), dict) else {}
+    return meta.get("post_id") or result.get("post_id") or rec.get("post_id")
+
+
+def iter_jsonl_offsets(output: str, start: int = 0) -> Iterable[tuple[str, int]]:
+    """Yield ``(post_id, offset)`` for complete, parseable records from ``start`` on."""
+    with open(output, "rb") as f:
+        f.seek(start)
+        offset = start
+        for line in f:
+            if line.endswith(b"\n"):
+                post_id = _record_post_id(line)
+                if post_id:
+                    yield post_id, offset
+            offset += len(line)
+
+
+def append_entries(ledger: IO[str], entries: Iterable[tuple[str, int]]) -> None:
+    for post_id, offset in entries:
+        ledger.write(f"{post_id}\t{offset}\n")
+    ledger.flush()
+
+
+def rebuild_ledger(output: str) -> int:
+    """Rewrite the ledger from scratch by scanning ``output``; returns entry count."""
+    path = ledger_path(output)
+    tmp_path = path + ".tmp"
+    count = 0
+    with open(tmp_path, "w", encoding="utf-8") as ledger:
+        if os.path.isfile(output):
+            for post_id, offset in iter_jsonl_offsets(output):
+                ledger.write(f"{post_id}\t{offset}\n")
+                count += 1
+    os.replace(tmp_path, path)
+    return count
+
+
+def load_ledger(output: str) -> dict[str, int]:
+    """Return ``{post_id: offset}`` for every record in ``output``, catching up the ledger if needed."""
+    path = ledger_path(output)
+    if not os.path.isfile(output):
+        return {}
+    if not os.path.isfile(path):
+        print(f"[ledger] no ledger for {output}; rebuilding", file=sys.stderr)
+        rebuild_ledger(output)
+
+    entries: dict[str, int] = {}
+    last_offset = -1
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            post_id, sep, offset = line.rstrip("\n").rpartition("\t")
+            if not sep or not post_id:
+                continue
+            try:
+                value = int(offset)
+            except ValueError:
+                continue
+            entries[post_id] = value
+            last_offset = max(last_offset, value)
+
+    # Index records that reached the JSONL but not the ledger (interrupted run).
+    tail_start = 0
+    if last_offset >= 0:
+        with open(output, "rb") as f:
+            f.seek(last_offset)
+            tail_start = last_offset + len(f.readline())
+    if tail_start < os.path.getsize(output):
+        tail = list(iter_jsonl_offsets(output, tail_start))
+        if tail:
+            with open(path, "a", encoding="utf-8") as ledger:
+                append_entries(ledger, tail)
+            entries.update(tail)
+    return entries
+
+
+def replace_records(output: str, replacements: dict[str, dict]) -> set[str]:
+    """Rewrite ``output`` with the records in ``replacements`` swapped in; return the post_ids replaced.
+
+    Records are located through the ledger and every other line is copied
+    byte for byte; a fresh ledger is written for the new offsets. Nothing
+    may append to ``output`` meanwhile.
+    """
+    entries = load_ledger(output)
+    by_offset = {offset: post_id for post_id, offset in entries.items()}
+    replaced = {post_id for post_id in replacements if post_id in entries}
+    if not replaced:
+        return set()
+    path = ledger_path(output)
+    tmp_output = f"{output}.tmp.{os.getpid()}"
+    tmp_ledger = f"{path}.tmp.{os.getpid()}"
+    with open(output, "rb") as src, open(tmp_output, "wb") as dst, open(tmp_ledger, "w", encoding="utf-8") as ledger:
+        offset = 0
+        for line in src:
+            post_id = by_offset.get(offset)
+            offset += len(line)
+            if post_id in replaced:
+                line = (json.dumps(replacements[post_id], ensure_ascii=False) + "\n").encode("utf-8")
+            if post_id is not None:
+                ledger.write(f"{post_id}\t{dst.tell()}\n")
+            dst.write(line)
+    # Drop the old ledger first: a crash between the renames leaves no ledger
+    # (rebuilt on the next load) rather than one with stale offsets.
+    os.remove(path)
+    os.replace(tmp_output, output)
+    os.replace(tmp_ledger, path)
+    return replaced
+
+
+def read_record(output: str, offset: int) -> dict:
+    """Read the single JSONL record that starts at ``offset``."""
+    with open(output, "rb") as f:
+        f.seek(offset)
+        return json.loads(f.readline())
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Build or inspect the resume ledger of an extractions JSONL")
+    parser.add_argument("--output", default="processed_data/extractions.jsonl", help="Extractions JSONL")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the ledger from the JSONL")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        count = rebuild_ledger(args.output)
+    else:
+        count = len(load_ledger(args.output))
+    print(f"[ledger] {ledger_path(args.output)} entries={count}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,134 @@
+"""Deterministic post_id sharding for multi-process / multi-node extraction.
+
+``extract_all_weibo.py --num-shards N --shard-index I`` only processes posts
+whose ``shard_of(post_id, N) == I``. The partition is a keyed hash of the
+post_id (not Python's salted ``hash``), so every process and every node agrees
+on it without coordination. Each shard writes its own output and ledger
+(``extractions.shard-01-of-04.jsonl`` + ``.ledger``), so shards can resume
+independently.
+
+This script merges the shard outputs into one deduplicated JSONL ordered by
+post_id, and writes a fresh ledger for it. Records are located through the
+shard ledgers and copied byte-for-byte; nothing is re-encoded.
+
+Local multi-process run (no GPU):
+  for i in 0 1 2 3; do
+    python3 scripts/extract_all_weibo.py --weibo-root weibo --backend fake \\
+      --output-format jsonl --num-shards 4 --shard-index $i &
+  done; wait
+  python3 scripts/sharding.py --output processed_data/extractions.jsonl --num-shards 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import sys
+
+from .output_sink import shard_paths
+from .resume_ledger import append_entries, ledger_path, load_ledger
+
+
+def shard_of(post_id: str, num_shards: int) -> int:
+    """Stable shard index in ``[0, num_shards)`` for a post_id."""
+    if num_shards <= 1:
+        return 0
+    digest = hashlib.blake2b(post_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % num_shards
+
+
+def shard_output(output: str, shard_index: int, num_shards: int) -> str:
+    """Per-shard variant of an output path; unchanged for a single shard."""
+    if num_shards <= 1:
+        return output
+    stem, ext = os.path.splitext(output)
+    width = max(2, len(str(num_shards - 1)))
+    return f"{stem}.shard-{shard_index:0{width}d}-of-{num_shards:0{width}d}{ext}"
+
+
+def shard_files(output: str, shard_index: int, num_shards: int) -> list[str]:
+    """Existing JSONL files written by one shard (plain or size-rotated)."""
+    base = shard_output(output, shard_index, num_shards)
+    paths = [base] if os.path.isfile(base) else []
+    return paths + shard_paths(base)
+
+
+def _order_key(post_id: str) -> tuple:
+    # Weibo ids are numeric and grow over time; compare them as numbers.
+    return (0, int(post_id), "") if post_id.isdigit() else (1, 0, post_id)
+
+
+def merge_shards(output: str, num_shards: int) -> tuple[int, int]:
+    """Merge all shard outputs into ``output``; returns ``(records, duplicates)``.
+
+    A post_id written more than once inside a shard keeps its latest record (as
+    the ledger does); across shards the lowest shard index wins. Records already
+    in ``output`` (an earlier merge or single-process run) are kept unless a
+    shard has a newer one.
+    """
+    paths = [p for index in range(num_shards) for p in shard_files(output, index, num_shards)]
+    if not paths:
+        raise FileNotFoundError(f"no shard outputs found for {output} with {num_shards} shards")
+    if os.path.isfile(output):
+        paths.append(output)
+
+    sources: list[str] = []
+    located: dict[str, tuple[int, int]] = {}
+    duplicates = 0
+    for path in paths:
+        source = len(sources)
+        sources.append(path)
+        for post_id, offset in load_ledger(path).items():
+            if post_id in located:
+                # The previous merge is expected to overlap; only count shard duplicates.
+                duplicates += path != output
+                continue
+            located[post_id] = (source, offset)
+
+    out_dir = os.path.dirname(output)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    tmp_path = f"{output}.tmp.{os.getpid()}"
+    tmp_ledger = f"{ledger_path(output)}.tmp.{os.getpid()}"
+    handles = [open(path, "rb") for path in sources]
+    try:
+        with open(tmp_path, "wb", buffering=1 << 20) as out, open(tmp_ledger, "w", encoding="utf-8") as ledger:
+            entries: list[tuple[str, int]] = []
+            for post_id in sorted(located, key=_order_key):
+                source, offset = located[post_id]
+                f = handles[source]
+                f.seek(offset)
+                entries.append((post_id, out.tell()))
+                out.write(f.readline())
+                if len(entries) >= 4096:
+                    append_entries(ledger, entries)
+                    entries = []
+            append_entries(ledger, entries)
+    finally:
+        for f in handles:
+            f.close()
+    # Drop the old ledger before swapping data in: a crash in between then
+    # leaves no ledger (rebuilt on load) rather than one with stale offsets.
+    if os.path.isfile(ledger_path(output)):
+        os.remove(ledger_path(output))
+    os.replace(tmp_path, output)
+    os.replace(tmp_ledger, ledger_path(output))
+    return len(located), duplicates
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Merge per-shard extraction outputs into one JSONL")
+    parser.add_argument("--output", default="processed_data/extractions.jsonl", help="Merged JSONL (shard paths derive from it)")
+    parser.add_argument("--num-shards", type=int, required=True)
+    args = parser.parse_args()
+    if args.num_shards < 2:
+        parser.error("--num-shards must be >= 2")
+
+    records, duplicates = merge_shards(args.output, args.num_shards)
+    print(f"[merge] {args.output} records={records} duplicates_dropped={duplicates}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
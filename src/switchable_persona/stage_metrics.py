@@ -0,0 +1,187 @@
+"""Per-post stage timings and token counts for the extraction loop.
+
+Each post carries a ``timings`` dict (seconds per stage) and a ``tokens``
+dict filled in as it moves through the pipeline:
+
+  media     local lookup / download of images and videos, probe filtering
+  template  chat template rendering
+  vision    image/video decoding and resizing (``build_input``)
+  generate  wall time of the engine call the post was batched into
+  parse     JSON decoding of the model output
+  write     the post's share of its batch's sink write
+
+``StageMetrics.record`` is called once per post after it is written. It keeps
+a rolling window per stage for p50/p95, prints a summary line to stderr every
+``interval_s`` seconds, and optionally appends one JSON line per post and
+rewrites a Prometheus textfile (for node_exporter's textfile collector).
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import IO, Iterator, Optional
+
+STAGES = ("media", "template", "vision", "generate", "parse", "write")
+TOKEN_KINDS = ("prompt", "cached", "completion")
+
+
+@contextmanager
+def timed(timings: dict, stage: str) -> Iterator[None]:
+    """Add the wall time of the ``with`` body to ``timings[stage]``."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
+
+
+def _quantile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class StageMetrics:
+    def __init__(
+        self,
+        interval_s: float = 30.0,
+        jsonl_path: str = "",
+        prometheus_path: str = "",
+        window: int = 1000,
+    ) -> None:
+        self.interval_s = interval_s
+        self.prometheus_path = prometheus_path
+        self.posts = 0
+        self.tokens = {kind: 0 for kind in TOKEN_KINDS}
+        self.stage_totals = {stage: 0.0 for stage in STAGES}
+        self._windows = {stage: deque(maxlen=window) for stage in STAGES}
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._last_report = self._started
+        self._last_posts = 0
+        self._last_tokens = 0
+        self._jsonl: Optional[IO[str]] = None
+        if jsonl_path:
+            out_dir = os.path.dirname(jsonl_path)
+            if out_dir:
+                os.makedirs(out_dir, exist_ok=True)
+            self._jsonl = open(jsonl_path, "a", encoding="utf-8")
+
+    def record(self, post_id: str, timings: dict, tokens: dict) -> None:
+        with self._lock:
+            self.posts += 1
+            for stage in STAGES:
+                if stage in timings:
+                    self.stage_totals[stage] += timings[stage]
+                    self._windows[stage].append(timings[stage])
+            for kind in TOKEN_KINDS:
+                self.tokens[kind] += tokens.get(kind, 0)
+            if self._jsonl is not None:
+                line = {
+                    "ts": time.time(),
+                    "post_id": post_id,
+                    "seconds": {stage: round(timings[stage], 6) for stage in STAGES if stage in timings},
+                    "tokens": tokens,
+                }
+                self._jsonl.write(json.dumps(line, ensure_ascii=False) + "\n")
+            now = time.perf_counter()
+            if self.interval_s and now - self._last_report >= self.interval_s:
+                self._report(now)
+
+    def _percentiles(self) -> dict[str, tuple[float, float]]:
+        return {
+            stage: (_quantile(list(values), 0.5), _quantile(list(values), 0.95))
+            for stage, values in self._windows.items()
+            if values
+        }
+
+    def _report(self, now: float, whole_run: bool = False) -> None:
+        total_tokens = self.tokens["prompt"] + self.tokens["completion"]
+        if whole_run:
+            elapsed, posts, tokens = now - self._started, self.posts, total_tokens
+        else:
+            elapsed = now - self._last_report
+            posts, tokens = self.posts - self._last_posts, total_tokens - self._last_tokens
+        posts_per_s = posts / elapsed if elapsed > 0 else 0.0
+        tokens_per_s = tokens / elapsed if elapsed > 0 else 0.0
+        stages = " ".join(
+            f"{stage}={p50 * 1000:.0f}/{p95 * 1000:.0f}ms" for stage, (p50, p95) in self._percentiles().items()
+        )
+        print(
+            f"[metrics] posts={self.posts} posts/s={posts_per_s:.2f} tokens/s={tokens_per_s:.0f} "
+            f"p50/p95 {stages}",
+            file=sys.stderr,
+        )
+        if self._jsonl is not None:
+            self._jsonl.flush()
+        if self.prometheus_path:
+            self._write_prometheus(posts_per_s, tokens_per_s)
+        self._last_report = now
+        self._last_posts = self.posts
+        self._last_tokens = total_tokens
+
+    def _write_prometheus(self, posts_per_s: float, tokens_per_s: float) -> None:
+        lines = [
+            "# HELP extract_posts_total Posts extracted by this run.",
+            "# TYPE extract_posts_total counter",
+            f"extract_posts_total {self.posts}",
+            "# HELP extract_tokens_total Tokens processed by this run.",
+            "# TYPE extract_tokens_total counter",
+        ]
+        lines += [f'extract_tokens_total{{kind="{kind}"}} {count}' for kind, count in self.tokens.items()]
+        lines += [
+            "# HELP extract_stage_seconds_total Time spent per stage, summed over posts.",
+            "# TYPE extract_stage_seconds_total counter",
+        ]
+        lines += [f'extract_stage_seconds_total{{stage="{stage}"}} {total:.6f}' for stage, total in self.stage_totals.items()]
+        lines += [
+            "# HELP extract_stage_seconds Recent per-post stage latency.",
+            "# TYPE extract_stage_seconds gauge",
+        ]
+        for stage, (p50, p95) in self._percentiles().items():
+            lines.append(f'extract_stage_seconds{{stage="{stage}",quantile="0.5"}} {p50:.6f}')
+            lines.append(f'extract_stage_seconds{{stage="{stage}",quantile="0.95"}} {p95:.6f}')
+        lines += [
+            "# TYPE extract_posts_per_second gauge",
+            f"extract_posts_per_second {posts_per_s:.3f}",
+            "# TYPE extract_tokens_per_second gauge",
+            f"extract_tokens_per_second {tokens_per_s:.1f}",
+            "# TYPE extract_last_update_timestamp_seconds gauge",
+            f"extract_last_update_timestamp_seconds {time.time():.0f}",
+        ]
+        out_dir = os.path.dirname(self.prometheus_path)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+        # node_exporter may read at any time: write aside, then rename.
+        tmp_path = f"{self.prometheus_path}.tmp.{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.prometheus_path)
+
+    def summary(self) -> str:
+        elapsed = time.perf_counter() - self._started
+        stages = " ".join(
+            f"{stage}={p50 * 1000:.0f}/{p95 * 1000:.0f}ms" for stage, (p50, p95) in self._percentiles().items()
+        )
+        tokens = self.tokens["prompt"] + self.tokens["completion"]
+        return (
+            f"tokens/s={tokens / elapsed if elapsed > 0 else 0.0:.0f} "
+            f"prompt={self.tokens['prompt']} cached={self.tokens['cached']} "
+            f"completion={self.tokens['completion']} p50/p95 {stages}"
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            # The tail since the last report can be arbitrarily short; report
+            # rates over the whole run instead.
+            self._report(time.perf_counter(), whole_run=True)
+            if self._jsonl is not None:
+                self._jsonl.close()
+                self._jsonl = None
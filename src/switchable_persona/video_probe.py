@@ -0,0 +1,218 @@
+"""Pre-flight probe of every video referenced by a weibo crawl.
+
+A broken video used to surface only when ``process_vision_info`` threw in the
+middle of extraction, which forced a second templating + preprocessing pass
+for that post. This script probes all referenced videos up front in a process
+pool (open, stream metadata, decode the first frame and one near the end) and
+appends the results to a JSONL probe table. ``extract_all_weibo.py`` consults
+the table and drops known-bad videos before building the prompt.
+
+Entries are keyed by real path and remember the file's size and mtime; a
+changed file is treated as unprobed. Only the file itself can earn a bad
+verdict: if the probe cannot run (PyAV missing, worker crash) the video stays
+unprobed rather than being recorded as broken.
+
+Requires PyAV (``pip install -e '.[probe]'``).
+
+Usage:
+  python3 scripts/video_probe.py --weibo-root weibo --table processed_data/video_probe.jsonl
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterable, Optional
+
+from .media_index import find_media
+from .weibo_stream import iter_posts
+
+DEFAULT_TABLE = "processed_data/video_probe.jsonl"
+
+
+def referenced_videos(post: dict, media_root: str) -> list[str]:
+    """Local video files for a post: the augmented ``media.video`` paths, else by URL basename."""
+    video_paths: list[str] = []
+    for item in (post.get("media") or {}).get("video") or []:
+        path = item.get("path")
+        if path and os.path.isfile(path):
+            video_paths.append(path)
+    if not video_paths:
+        vurl = post.get("video_url")
+        if vurl and vurl != "无":
+            video_paths = find_media(media_root, "video", [os.path.basename(vurl)])
+    return video_paths
+
+
+def _file_key(path: str) -> Optional[tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+# Written by probes that could not run at all; not a verdict about the file.
+_ENVIRONMENT_ERRORS = ("ImportError", "ModuleNotFoundError")
+
+
+def probe_video(path: str) -> dict:
+    """Open ``path`` with PyAV and report decodability, duration, frame count and resolution.
+
+    Raises ``ImportError`` without PyAV, and lets errors that are not about the
+    file (``MemoryError``, OS resource limits, ...) propagate.
+    """
+    import av
+
+    path = os.path.realpath(path)
+    entry: dict = {"path": path, "ok": False}
+    key = _file_key(path)
+    if key is None:
+        entry["error"] = "missing file"
+        return entry
+    entry["size"], entry["mtime_ns"] = key
+    if entry["size"] == 0:
+        entry["error"] = "empty file"
+        return entry
+    started = time.perf_counter()
+    try:
+        with av.open(path) as container:
+            if not container.streams.video:
+                raise ValueError("no video stream")
+            stream = container.streams.video[0]
+            duration = None
+            if stream.duration is not None and stream.time_base is not None:
+                duration = float(stream.duration * stream.time_base)
+            elif container.duration is not None:
+                duration = container.duration / av.time_base
+            fps = float(stream.average_rate) if stream.average_rate else None
+            frames = stream.frames or (int(duration * fps) if duration and fps else None)
+            first = next(container.decode(stream), None)
+            if first is None:
+                raise ValueError("no decodable frames")
+            entry.update(
+                {
+                    "duration_s": duration,
+                    "fps": fps,
+                    "frames": frames,
+                    "width": first.width,
+                    "height": first.height,
+                    "codec": stream.codec_context.name,
+                }
+            )
+            # Truncated uploads often decode fine at the start and break later.
+            if duration and duration > 1.0 and stream.time_base is not None:
+                container.seek(int((duration * 0.9) / stream.time_base), stream=stream)
+                if next(container.decode(stream), None) is None:
+                    raise ValueError("no decodable frames near the end")
+        entry["ok"] = True
+    except (av.error.FFmpegError, ValueError, EOFError) as exc:
+        entry["error"] = f"{type(exc).__name__}: {exc}"
+    entry["probe_s"] = round(time.perf_counter() - started, 3)
+    return entry
+
+
+class VideoProbeTable:
+    """Latest probe result per path, loaded from the JSONL table."""
+
+    def __init__(self, path: str = DEFAULT_TABLE) -> None:
+        self.path = path
+        self.entries: dict[str, dict] = {}
+        self.ignored = 0
+        if os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if not isinstance(entry, dict) or not entry.get("path"):
+                        continue
+                    if str(entry.get("error", "")).startswith(_ENVIRONMENT_ERRORS):
+                        self.ignored += 1
+                        continue
+                    self.entries[os.path.realpath(entry["path"])] = entry
+
+    def lookup(self, path: str) -> Optional[dict]:
+        """Probe entry for ``path`` if it still describes the file on disk."""
+        entry = self.entries.get(os.path.realpath(path))
+        if entry is None or "size" not in entry:
+            return None
+        if _file_key(path) != (entry["size"], entry["mtime_ns"]):
+            return None
+        return entry
+
+    def rejection(self, path: str, max_seconds: float = 0.0) -> Optional[str]:
+        """Why a video should be skipped, or None if it is fine or unprobed."""
+        entry = self.lookup(path)
+        if entry is None:
+            return None
+        if not entry.get("ok"):
+            return entry.get("error") or "probe failed"
+        duration = entry.get("duration_s")
+        if max_seconds and duration and duration > max_seconds:
+            return f"duration {duration:.1f}s exceeds {max_seconds:.1f}s"
+        return None
+
+
+def _iter_video_paths(weibo_root: str) -> Iterable[str]:
+    seen: set[str] = set()
+    for dirpath, _, filenames in os.walk(weibo_root):
+        for name in filenames:
+            if not name.endswith(".json"):
+                continue
+            for post in iter_posts(os.path.join(dirpath, name)):
+                for path in referenced_videos(post, dirpath):
+                    path = os.path.realpath(path)
+                    if path not in seen:
+                        seen.add(path)
+                        yield path
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Probe all referenced videos and record results")
+    parser.add_argument("--weibo-root", required=True, help="Root dir that contains weibo JSON folders")
+    parser.add_argument("--table", default=DEFAULT_TABLE, help="Probe table (JSONL, appended)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--reprobe", action="store_true", help="Probe again even if a fresh entry exists")
+    args = parser.parse_args()
+
+    try:
+        import av  # noqa: F401
+    except ImportError:
+        raise SystemExit("video_probe needs PyAV: pip install -e '.[probe]'")
+
+    table = VideoProbeTable(args.table)
+    todo = [p for p in _iter_video_paths(args.weibo_root) if args.reprobe or table.lookup(p) is None]
+    table_dir = os.path.dirname(args.table)
+    if table_dir:
+        os.makedirs(table_dir, exist_ok=True)
+
+    ok = bad = failed = 0
+    with open(args.table, "a", encoding="utf-8") as out, ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(probe_video, path): path for path in todo}
+        for fut in as_completed(futures):
+            try:
+                entry = fut.result()
+            except Exception as exc:
+                # Left unprobed (and out of the table) so the next run tries again.
+                failed += 1
+                print(f"[error] {futures[fut]}: probe did not run: {type(exc).__name__}: {exc}", file=sys.stderr)
+                continue
+            out.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            out.flush()
+            if entry["ok"]:
+                ok += 1
+            else:
+                bad += 1
+                print(f"[bad] {entry['path']}: {entry.get('error')}", file=sys.stderr)
+    print(f"[video_probe] probed={len(todo)} ok={ok} bad={bad} failed={failed} table={args.table}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
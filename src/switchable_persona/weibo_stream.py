@@ -0,0 +1,179 @@
+"""Streaming reader for crawler weibo JSON files.
+
+Crawler output looks like ``{"user": {...}, "weibo": [post, post, ...]}`` and
+for prolific accounts the ``weibo`` array runs to hundreds of MB. Instead of
+``json.loads`` on the whole file, the reader pulls fixed-size chunks and
+decodes one array element at a time with ``JSONDecoder.raw_decode``, so peak
+memory is one chunk plus the post being decoded.
+
+Usage:
+  python3 scripts/weibo_stream.py --bench weibo/<user>/<uid>.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from typing import Any, Iterator
+
+ARRAY_KEY = "weibo"
+CHUNK_SIZE = 1 << 20
+
+_decoder = json.JSONDecoder()
+_WS = " \t\n\r"
+
+
+class _Buffer:
+    """Sliding text window over a file, refilled on demand."""
+
+    def __init__(self, f, chunk_size: int) -> None:
+        self.f = f
+        self.chunk_size = chunk_size
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # Drop consumed text so the window does not grow with the file.
+        self.text = self.text[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Skip whitespace and return the next character ('' at EOF)."""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WS:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, ch: str) -> None:
+        got = self.peek()
+        if got != ch:
+            raise ValueError(f"expected {ch!r} at offset {self.pos}, got {got!r}")
+        self.pos += 1
+
+    def decode(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                # Most likely the value is cut off at the window edge.
+                if self.fill():
+                    continue
+                raise
+            # A number at the window edge may continue in the next chunk.
+            if end == len(self.text) and not self.eof and isinstance(value, (int, float)):
+                if self.fill():
+                    continue
+            self.pos = end
+            return value
+
+
+def iter_events(path: str, array_key: str = ARRAY_KEY, chunk_size: int = CHUNK_SIZE) -> Iterator[tuple]:
+    """Yield top-level events of a crawler file, streaming ``array_key``.
+
+    Events are ``("field", key, value)`` for ordinary top-level members,
+    ``("begin", key)`` / ``("item", value)`` / ``("end", key)`` around the
+    streamed array. If ``array_key`` holds something other than a list it is
+    reported as a plain field.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        buf = _Buffer(f, chunk_size)
+        buf.expect("{")
+        if buf.peek() == "}":
+            return
+        while True:
+            key = buf.decode()
+            buf.expect(":")
+            if key == array_key and buf.peek() == "[":
+                buf.pos += 1
+                yield ("begin", key)
+                if buf.peek() == "]":
+                    buf.pos += 1
+                else:
+                    while True:
+                        yield ("item", buf.decode())
+                        sep = buf.peek()
+                        buf.pos += 1
+                        if sep == "]":
+                            break
+                        if sep != ",":
+                            raise ValueError(f"expected ',' or ']' in {path}, got {sep!r}")
+                yield ("end", key)
+            else:
+                yield ("field", key, buf.decode())
+            sep = buf.peek()
+            buf.pos += 1
+            if sep == "}":
+                return
+            if sep != ",":
+                raise ValueError(f"expected ',' or '}}' in {path}, got {sep!r}")
+
+
+def iter_posts(path: str, array_key: str = ARRAY_KEY, chunk_size: int = CHUNK_SIZE) -> Iterator[dict]:
+    """Yield the posts of a crawler weibo JSON one at a time."""
+    for event in iter_events(path, array_key, chunk_size):
+        if event[0] == "item":
+            yield event[1]
+
+
+def iter_weibo_jsons(root: str) -> Iterator[str]:
+    """Yield the path of every ``.json`` file under a crawl root, in ``os.walk`` order."""
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if name.endswith(".json"):
+                yield os.path.join(dirpath, name)
+
+
+def _bench_child(path: str, mode: str) -> None:
+    started = time.perf_counter()
+    if mode == "stream":
+        count = sum(1 for _ in iter_posts(path))
+    else:
+        count = len(json.loads(open(path, "r", encoding="utf-8").read()).get(ARRAY_KEY, []))
+    elapsed = time.perf_counter() - started
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"mode": mode, "posts": count, "seconds": round(elapsed, 3), "peak_rss_mb": round(peak_kb / 1024, 1)}))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark streaming vs whole-file parsing of crawler weibo JSON")
+    parser.add_argument("--bench", required=True, help="Weibo JSON file to parse")
+    parser.add_argument("--child", choices=["stream", "loads"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _bench_child(args.bench, args.child)
+        return 0
+
+    size_mb = os.path.getsize(args.bench) / (1 << 20)
+    print(f"[bench] {args.bench} size={size_mb:.1f}MB")
+    # Each mode runs in a fresh interpreter so ru_maxrss is not shared.
+    for mode in ("loads", "stream"):
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--bench", args.bench, "--child", mode],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        print(f"[bench] {out.stdout.strip()}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,36 @@
+"""``export_parquet.py`` over a small JSONL output with a re-written post."""
+
+from __future__ import annotations
+
+import json
+import sys
+
+import pytest
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+from switchable_persona import export_parquet  # noqa: E402
+
+
+def _line(post_id: str, emotion: str) -> dict:
+    extraction = {"post_id": post_id, "style": {"emotion": emotion, "tone": ["casual"]}}
+    return {"meta": {"post_id": post_id, "weibo_json": "u.json"}, "result": {"extraction": extraction}}
+
+
+def test_duplicate_post_ids_keep_the_last_record(monkeypatch, tmp_path):
+    first = tmp_path / "a.jsonl"
+    second = tmp_path / "b.jsonl"
+    first.write_text(
+        "".join(json.dumps(_line(post_id, "joy")) + "\n" for post_id in ("p1", "p2", "p1")),
+        encoding="utf-8",
+    )
+    second.write_text(json.dumps(_line("p2", "anger")) + "\n", encoding="utf-8")
+    out_dir = tmp_path / "parquet"
+    argv = ["export_parquet.py", "--input", str(first), str(second), "--output-dir", str(out_dir)]
+    monkeypatch.setattr(sys, "argv", argv)
+    assert export_parquet.main() == 0
+
+    posts = pq.read_table(out_dir / "posts.parquet", columns=["post_id", "emotion"]).to_pylist()
+    assert sorted((row["post_id"], row["emotion"]) for row in posts) == [("p1", "joy"), ("p2", "anger")]
+    tones = pq.read_table(out_dir / "tones.parquet", columns=["post_id"]).to_pylist()
+    assert sorted(row["post_id"] for row in tones) == ["p1", "p2"]
@@ -0,0 +1,147 @@
+"""End-to-end checks of ``extract_all_weibo.py`` over the fake backend.
+
+The corpus comes from ``benchmarks.synth_corpus`` (seeded, so every run sees
+the same posts, images and empty videos); the backend is
+``switchable_persona.fake_vlm``, whose output depends only on the prompt.
+"""
+
+from __future__ import annotations
+
+import json
+import sys
+
+import pytest
+
+import extract_all_weibo
+from benchmarks.synth_corpus import CorpusSpec, generate_corpus
+from switchable_persona.length_scheduler import LengthScheduler
+from switchable_persona.weibo_stream import iter_posts, iter_weibo_jsons
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    root = tmp_path_factory.mktemp("weibo")
+    spec = CorpusSpec(users=3, posts_per_user=20, video_ratio=0.4, bad_video_ratio=0.5, seed=7)
+    stats = generate_corpus(str(root), spec)
+    assert stats["bad_videos"] > 0
+    return root
+
+
+def _corpus_post_ids(root) -> list[str]:
+    return [
+        post["id"]
+        for weibo_json in iter_weibo_jsons(str(root))
+        for post in iter_posts(weibo_json)
+    ]
+
+
+def _run(monkeypatch, root, out_dir, *extra: str) -> int:
+    argv = [
+        "extract_all_weibo.py",
+        "--backend",
+        "fake",
+        "--weibo-root",
+        str(root),
+        "--output",
+        str(out_dir / "extractions.jsonl"),
+        "--output-dir",
+        str(out_dir / "extractions"),
+        "--bad-video-log",
+        str(out_dir / "bad_videos.jsonl"),
+        "--video-probe-table",
+        "",
+        "--result-cache-dir",
+        "",
+        "--repair-queue",
+        str(out_dir / "repair_queue.jsonl"),
+        "--batch-size",
+        "4",
+        *extra,
+    ]
+    monkeypatch.setattr(sys, "argv", argv)
+    return extract_all_weibo.main()
+
+
+def _records(path) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_run_pipeline_keeps_count_and_order():
+    posts = [({"id": str(i)}, "user.json") for i in range(23)]
+    written: list[str] = []
+
+    def prepare(post: dict, weibo_json: str) -> dict:
+        return {"post_id": post["id"], "est_tokens": 10}
+
+    def generate(prepared: list[dict]) -> list[dict]:
+        return [{"post_id": req["post_id"]} for req in prepared]
+
+    def write(batch, records, prepared) -> None:
+        assert [post["id"] for post, _ in batch] == [record["post_id"] for record in records]
+        written.extend(record["post_id"] for record in records)
+
+    total, _ = extract_all_weibo._run_pipeline(
+        posts, prepare, generate, write, LengthScheduler(batch_size=4), prefetch_depth=3, workers=2
+    )
+    assert total == 23
+    assert written == [str(i) for i in range(23)]
+
+
+def test_fake_run_writes_every_post_in_order(monkeypatch, corpus, tmp_path):
+    assert _run(monkeypatch, corpus, tmp_path) == 0
+    records = _records(tmp_path / "extractions.jsonl")
+    assert [record["meta"]["post_id"] for record in records] == _corpus_post_ids(corpus)
+    assert all("_raw" not in record["result"]["extraction"] for record in records)
+
+
+def test_resume_skips_written_posts(monkeypatch, corpus, tmp_path):
+    assert _run(monkeypatch, corpus, tmp_path, "--limit", "15") == 0
+    assert len(_records(tmp_path / "extractions.jsonl")) == 15
+    assert _run(monkeypatch, corpus, tmp_path, "--resume") == 0
+    post_ids = [record["meta"]["post_id"] for record in _records(tmp_path / "extractions.jsonl")]
+    assert post_ids == _corpus_post_ids(corpus)
+
+
+def test_bad_video_falls_back_to_text_and_images(monkeypatch, corpus, tmp_path):
+    assert _run(monkeypatch, corpus, tmp_path) == 0
+    bad = _records(tmp_path / "bad_videos.jsonl")
+    assert bad
+    bad_ids = {entry["post_id"] for entry in bad}
+    by_id = {record["meta"]["post_id"]: record for record in _records(tmp_path / "extractions.jsonl")}
+    for post_id in bad_ids:
+        result = by_id[post_id]["result"]
+        assert result["media_used"]["videos"] == []
+        assert "_raw" not in result["extraction"]
+
+
+def test_repair_does_not_relog_bad_videos(monkeypatch, corpus, tmp_path):
+    assert _run(monkeypatch, corpus, tmp_path) == 0
+    bad_log = tmp_path / "bad_videos.jsonl"
+    logged = bad_log.read_text(encoding="utf-8")
+    by_id = {record["meta"]["post_id"]: record for record in _records(tmp_path / "extractions.jsonl")}
+    with open(tmp_path / "repair_queue.jsonl", "w", encoding="utf-8") as f:
+        for entry in _records(bad_log):
+            queued = {"post_id": entry["post_id"], "weibo_json": by_id[entry["post_id"]]["meta"]["weibo_json"]}
+            f.write(json.dumps(dict(queued, reason="invalid_json", attempt=0)) + "\n")
+    assert _run(monkeypatch, corpus, tmp_path, "--repair") == 0
+    assert bad_log.read_text(encoding="utf-8") == logged
+
+
+def test_packed_requests_are_estimated_as_a_unit(monkeypatch, corpus, tmp_path, capsys):
+    assert _run(monkeypatch, corpus, tmp_path, "--pack", "8") == 0
+    (schedule,) = [line for line in capsys.readouterr().err.splitlines() if line.startswith("[schedule]")]
+    fields = dict(part.split("=", 1) for part in schedule.split()[1:])
+    estimated, actual = int(fields["estimated_tokens"]), int(fields["actual_tokens"])
+    assert abs(estimated - actual) / actual < 0.05
+
+
+def test_resume_reads_the_other_output_layout(monkeypatch, corpus, tmp_path):
+    assert _run(monkeypatch, corpus, tmp_path, "--output-format", "jsonl", "--limit", "15") == 0
+    assert _run(monkeypatch, corpus, tmp_path, "--output-format", "shards", "--resume") == 0
+    written = [
+        record["meta"]["post_id"]
+        for path in [tmp_path / "extractions.jsonl", *sorted(tmp_path.glob("extractions-*.jsonl"))]
+        for record in _records(path)
+    ]
+    assert written == _corpus_post_ids(corpus)
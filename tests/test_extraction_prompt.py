@@ -0,0 +1,19 @@
+"""Prompt layouts of ``switchable_persona.extraction``."""
+
+from __future__ import annotations
+
+from switchable_persona.extraction import FEW_SHOT_POST_ID, prompt_texts
+
+
+def test_prefix_layout_keeps_the_few_shot_example_in_the_shared_prefix():
+    system_a, user_a = prompt_texts("第一条", "p1", "prefix")
+    system_b, user_b = prompt_texts("第二条", "p2", "prefix")
+    assert system_a == system_b
+    assert f"POST_ID: {FEW_SHOT_POST_ID}" in system_a
+    assert FEW_SHOT_POST_ID not in user_a + user_b
+
+
+def test_legacy_layout_sends_the_example_and_schema_hint_with_the_post():
+    _, user = prompt_texts("正文", "p1", "legacy")
+    example = user.index(f"POST_ID: {FEW_SHOT_POST_ID}")
+    assert example < user.index("POST_ID: p1") < user.index('"position": "support|oppose|neutral"')
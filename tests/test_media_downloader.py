@@ -0,0 +1,201 @@
+"""``MediaDownloader`` against a local keep-alive HTTP server.
+
+``/bytes/<n>`` answers ``n`` bytes, ``/redirect/<n>`` redirects there,
+``/partial/<n>`` promises ``n`` bytes but hangs up halfway and
+``/status/<code>`` fails with that status. The server counts requests and TCP
+connections so retries and connection reuse are observable.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from switchable_persona.disk_quota import DiskQuota
+from switchable_persona.media_downloader import MediaDownloader
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests = 0
+    connections = 0
+
+    def setup(self) -> None:
+        super().setup()
+        _Handler.connections += 1
+
+    def do_GET(self) -> None:
+        _Handler.requests += 1
+        kind, _, arg = self.path.lstrip("/").partition("/")
+        arg = arg.split("?")[0]
+        if kind == "bytes":
+            body = b"x" * int(arg)
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif kind == "redirect":
+            self.send_response(302)
+            self.send_header("Location", f"/bytes/{arg}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif kind == "partial":
+            self.send_response(200)
+            self.send_header("Content-Length", arg)
+            self.end_headers()
+            self.wfile.write(b"x" * (int(arg) // 2))
+            self.close_connection = True
+        else:
+            self.send_response(int(arg) if kind == "status" else 404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def _reset_counters():
+    _Handler.requests = 0
+    _Handler.connections = 0
+
+
+def _cached_bytes(cache_dir) -> int:
+    return sum(
+        os.path.getsize(os.path.join(dirpath, name))
+        for dirpath, _, names in os.walk(cache_dir)
+        for name in names
+    )
+
+
+def test_worker_reuses_one_connection(server, tmp_path):
+    downloader = MediaDownloader(cache_dir=str(tmp_path), workers=1)
+    try:
+        paths = downloader.download_many([f"{server}/bytes/{n}" for n in range(100, 105)], ".jpg")
+    finally:
+        downloader.close()
+    assert [os.path.getsize(path) for path in paths] == list(range(100, 105))
+    assert _Handler.requests == 5
+    assert _Handler.connections == 1
+
+
+def test_same_url_is_fetched_once(server, tmp_path):
+    downloader = MediaDownloader(cache_dir=str(tmp_path), workers=4)
+    try:
+        first, second = downloader.download_many([f"{server}/bytes/500", f"{server}/bytes/500"], ".jpg")
+        again = downloader.download_many([f"{server}/bytes/500"], ".jpg")
+    finally:
+        downloader.close()
+    assert first == second == again[0]
+    assert _Handler.requests == 1
+    assert downloader.misses == 1
+
+
+def test_quota_evicts_least_recently_used(server, tmp_path):
+    downloader = MediaDownloader(cache_dir=str(tmp_path), quota_bytes=3500, workers=1)
+    try:
+        a, b, c = downloader.download_many([f"{server}/bytes/1000?{name}" for name in "abc"], ".jpg")
+        # A hit refreshes ``a``, so ``b`` is now the least recently used.
+        downloader.download_many([f"{server}/bytes/1000?a"], ".jpg")
+        (d,) = downloader.download_many([f"{server}/bytes/1000?d"], ".jpg")
+    finally:
+        downloader.close()
+    assert [os.path.exists(path) for path in (a, b, c, d)] == [True, False, True, True]
+    assert downloader._quota.evicted == 1
+    assert _cached_bytes(tmp_path) <= 3500
+
+
+def _cache_files(cache_dir) -> list[str]:
+    return sorted(name for _, _, names in os.walk(cache_dir) for name in names)
+
+
+def test_redirect_is_followed_and_cached_under_the_original_url(server, tmp_path):
+    downloader = MediaDownloader(cache_dir=str(tmp_path), workers=1)
+    try:
+        (path,) = downloader.download_many([f"{server}/redirect/300"], ".jpg")
+    finally:
+        downloader.close()
+    assert path == downloader.cache_path(f"{server}/redirect/300", ".jpg")
+    assert os.path.getsize(path) == 300
+    assert _Handler.requests == 2
+
+
+def test_partial_download_leaves_nothing_in_the_cache(server, tmp_path):
+    downloader = MediaDownloader(cache_dir=str(tmp_path), workers=1, retries=1)
+    try:
+        assert downloader.download_many([f"{server}/partial/4000"], ".mp4") == []
+    finally:
+        downloader.close()
+    assert _Handler.requests == 2
+    assert downloader.failures == 1
+    assert _cache_files(tmp_path) == []
+
+
+@pytest.mark.parametrize("status, attempts", [(404, 1), (503, 2)])
+def test_failed_download_retries_only_server_errors(server, tmp_path, status, attempts):
+    downloader = MediaDownloader(cache_dir=str(tmp_path), workers=1, retries=1)
+    try:
+        paths = downloader.download_many([f"{server}/status/{status}", f"{server}/bytes/10"], ".jpg")
+    finally:
+        downloader.close()
+    assert [os.path.getsize(path) for path in paths] == [10]
+    assert _Handler.requests == attempts + 1
+
+
+def test_cache_is_reused_across_downloaders(server, tmp_path):
+    urls = [f"{server}/bytes/{n}" for n in (10, 20)]
+    for _ in range(2):
+        downloader = MediaDownloader(cache_dir=str(tmp_path), workers=2)
+        try:
+            paths = downloader.download_many(urls, ".jpg")
+        finally:
+            downloader.close()
+        assert [os.path.getsize(path) for path in paths] == [10, 20]
+    assert _Handler.requests == 2
+    assert downloader.hits == 2
+
+
+def test_pinned_download_survives_eviction_until_released(server, tmp_path):
+    downloader = MediaDownloader(cache_dir=str(tmp_path), quota_bytes=2500, workers=1)
+    try:
+        with downloader.pinning() as pins:
+            (held,) = downloader.download_many([f"{server}/bytes/1000?held"], ".jpg")
+        downloader.download_many([f"{server}/bytes/1000?{name}" for name in "ab"], ".jpg")
+        assert os.path.exists(held)
+        downloader.release(pins)
+        downloader.download_many([f"{server}/bytes/1000?c"], ".jpg")
+    finally:
+        downloader.close()
+    assert not os.path.exists(held)
+
+
+def test_pin_holds_against_another_process_until_its_lease_expires(tmp_path):
+    # Two quotas on one tree stand in for two shard processes sharing the cache.
+    ours = DiskQuota(str(tmp_path), max_bytes=2500)
+    theirs = DiskQuota(str(tmp_path), max_bytes=2500)
+    held = tmp_path / "held.jpg"
+    held.write_bytes(b"x" * 1000)
+    os.utime(held, (0, 0))
+    ours.pin(str(held))
+    for name in "abc":
+        (tmp_path / f"{name}.jpg").write_bytes(b"x" * 1000)
+        theirs.add(1000)
+    assert held.exists()
+    marker = next(tmp_path.glob("held.jpg.pin.*"))
+    os.utime(marker, (0, 0))  # the pinning process died an hour ago
+    (tmp_path / "d.jpg").write_bytes(b"x" * 1000)
+    theirs.add(1000)
+    assert not held.exists()
+    assert not marker.exists()
@@ -0,0 +1,146 @@
+"""``OpenAIChatBackend`` against the mock server in ``switchable_persona.fake_vlm``.
+
+``_FaultyHandler`` answers each request normally unless the test queued a
+fault for it: an HTTP status, or ``"hang"`` (reply only after the client's
+timeout).
+"""
+
+from __future__ import annotations
+
+import json
+import socket
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from switchable_persona import fake_vlm
+from switchable_persona.extraction import SCHEMA_JSON, generate_batch
+from switchable_persona.inference_backend import OpenAIChatBackend
+
+TIMEOUT_S = 0.5
+
+
+class _FaultyHandler(fake_vlm._ChatHandler):
+    faults: list = []
+    requests = 0
+    connections: list[socket.socket] = []
+
+    def setup(self) -> None:
+        super().setup()
+        _FaultyHandler.connections.append(self.connection)
+
+    def do_POST(self) -> None:
+        _FaultyHandler.requests += 1
+        fault = _FaultyHandler.faults.pop(0) if _FaultyHandler.faults else None
+        if fault is None:
+            super().do_POST()
+            return
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if fault == "hang":
+            time.sleep(TIMEOUT_S * 2)
+            self.close_connection = True
+            return
+        self._reply(fault, {"error": f"injected {fault}"})
+
+
+@pytest.fixture(scope="module")
+def server():
+    _FaultyHandler.engine = fake_vlm._EngineLoop(
+        fake_vlm.FakeLLM(model="fake", step_latency_s=0.0, enable_prefix_caching=True)
+    )
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _FaultyHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/v1"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def backend(server):
+    _FaultyHandler.faults = []
+    _FaultyHandler.requests = 0
+    _FaultyHandler.connections = []
+    backend = OpenAIChatBackend(server, "fake", schema=SCHEMA_JSON, max_concurrency=1, timeout_s=TIMEOUT_S)
+    yield backend
+    backend.close()
+
+
+def _input(backend: OpenAIChatBackend, post_id: str) -> dict:
+    messages = [{"role": "user", "content": [{"type": "text", "text": f"POST_ID: {post_id}"}]}]
+    return backend.build_input(messages, backend.render(messages))
+
+
+def test_keep_alive_connection_is_reused(backend):
+    for i in range(4):
+        (output,) = backend.generate([_input(backend, f"p{i}")])
+        assert json.loads(output.outputs[0].text)["post_id"] == f"p{i}"
+    assert backend._pool.opened == 1
+    assert _FaultyHandler.requests == 4
+
+
+def test_stale_keep_alive_is_retried_once(backend):
+    backend.generate([_input(backend, "p0")])
+    for conn in _FaultyHandler.connections:
+        conn.shutdown(socket.SHUT_RDWR)
+    (output,) = backend.generate([_input(backend, "p1")])
+    assert not output.error
+    assert backend._pool.opened == 2
+    assert _FaultyHandler.requests == 2
+
+
+@pytest.mark.parametrize("status", [400, 503])
+def test_http_error_fails_only_that_post(backend, status):
+    _FaultyHandler.faults = [status]
+    failed, ok = backend.generate([_input(backend, "p0"), _input(backend, "p1")])
+    assert f"HTTP {status}" in failed.error
+    assert not ok.error
+    assert _FaultyHandler.requests == 2
+    assert backend.errors == 1
+
+
+def test_timeout_is_not_retried(backend):
+    # Warm up so the timed-out request runs on a reused keep-alive connection.
+    backend.generate([_input(backend, "p0")])
+    _FaultyHandler.faults = ["hang"]
+    (output,) = backend.generate([_input(backend, "p1")])
+    assert output.error.startswith("TimeoutError")
+    assert _FaultyHandler.requests == 2
+
+
+def test_failed_request_yields_unwritable_record(backend):
+    _FaultyHandler.faults = [503]
+    prepared = [
+        {"post_id": "p0", "input": _input(backend, "p0"), "images": [], "videos": []},
+        {"post_id": "p1", "input": _input(backend, "p1"), "images": [], "videos": []},
+    ]
+    failed, ok = generate_batch(backend, prepared)
+    assert failed["extraction"] is None and "HTTP 503" in failed["error"]
+    assert "error" not in ok and ok["extraction"]["post_id"] == "p1"
+
+
+def test_undecodable_video_is_rejected_before_sending(backend, tmp_path):
+    video = tmp_path / "empty.mp4"
+    video.write_bytes(b"")
+    messages = [{"role": "user", "content": [{"type": "video", "video": str(video)}, {"type": "text", "text": "x"}]}]
+    with pytest.raises(ValueError, match="failed to decode video"):
+        backend.build_input(messages, backend.render(messages))
+
+
+def test_server_that_stops_reading_times_out():
+    # Accepts connections (the kernel does) but never reads, so the request
+    # body fills the socket buffers and the client's drain() blocks.
+    listener = socket.create_server(("127.0.0.1", 0))
+    backend = OpenAIChatBackend(
+        f"http://127.0.0.1:{listener.getsockname()[1]}/v1", "fake", max_concurrency=1, timeout_s=TIMEOUT_S
+    )
+    try:
+        messages = [{"role": "user", "content": [{"type": "text", "text": "x" * (32 << 20)}]}]
+        started = time.monotonic()
+        (output,) = backend.generate([backend.build_input(messages, "")])
+        assert output.error.startswith("TimeoutError")
+        assert time.monotonic() - started < TIMEOUT_S * 10
+    finally:
+        backend.close()
+        listener.close()
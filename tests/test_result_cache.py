@@ -0,0 +1,67 @@
+"""Size accounting of the on-disk caches and the bounded file-digest memo."""
+
+from __future__ import annotations
+
+import os
+from types import SimpleNamespace
+
+from switchable_persona.content_hash import FileDigests
+from switchable_persona.extraction import build_messages
+from switchable_persona.inference_backend import OpenAIChatBackend
+from switchable_persona.result_cache import ResultCache
+
+
+def _cache(tmp_path, max_bytes: int) -> ResultCache:
+    sampling = SimpleNamespace(temperature=0.0, max_tokens=100, n=1)
+    return ResultCache(str(tmp_path), "model", {"type": "object"}, sampling, max_bytes=max_bytes)
+
+
+def _disk_bytes(root) -> int:
+    return sum(os.path.getsize(os.path.join(d, n)) for d, _, names in os.walk(root) for n in names)
+
+
+def test_overwrite_is_not_counted_twice(tmp_path):
+    cache = _cache(tmp_path, max_bytes=1 << 20)
+    for _ in range(50):
+        cache.put("a" * 64, "x" * 1000)
+    assert cache._quota._bytes == _disk_bytes(tmp_path)
+    assert cache._quota.evicted == 0
+
+
+def test_quota_evicts_when_really_over(tmp_path):
+    cache = _cache(tmp_path, max_bytes=5000)
+    for i in range(10):
+        cache.put(f"{i:064d}", "x" * 1000)
+    assert cache._quota.evicted > 0
+    assert _disk_bytes(tmp_path) <= 5000
+    assert cache._quota._bytes == _disk_bytes(tmp_path)
+
+
+def test_file_digests_keep_only_recent_entries(tmp_path):
+    digests = FileDigests(max_entries=2)
+    paths = []
+    for name in "abc":
+        path = tmp_path / name
+        path.write_text(name)
+        paths.append(str(path))
+    first = digests.sha256(paths[0])
+    digests.sha256(paths[1])
+    digests.sha256(paths[0])  # refresh: ``b`` is now the oldest
+    digests.sha256(paths[2])
+    assert len(digests._digests) == 2
+    assert {key[0] for key in digests._digests} == {paths[0], paths[2]}
+    assert digests.sha256(paths[0]) == first
+
+
+def test_moved_media_keep_their_key(tmp_path):
+    backend = OpenAIChatBackend("http://127.0.0.1:9/v1", "model")
+    cache = _cache(tmp_path / "cache", max_bytes=1 << 20)
+    keys = []
+    for mirror in ("a", "b"):
+        image = tmp_path / mirror / "img.jpg"
+        image.parent.mkdir()
+        image.write_bytes(b"same pixels")
+        messages = build_messages([str(image)], [], "POST_ID: p1")
+        keys.append(cache.key(backend.render(messages), [str(image)]))
+    backend.close()
+    assert keys[0] == keys[1]